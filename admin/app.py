@@ -4,11 +4,12 @@
 """
 
 import streamlit as st
-import requests
 import qrcode
 from io import BytesIO
 from datetime import datetime
 
+import backend_client
+
 # 页面配置
 st.set_page_config(
     page_title="海鲜乐园 - 核销系统",
@@ -66,9 +67,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# API 配置
-API_BASE_URL = "http://localhost:8000/api"
-
 # Session 状态初始化
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -91,11 +89,7 @@ def login_page():
         if submitted:
             if username and password:
                 try:
-                    response = requests.post(
-                        f"{API_BASE_URL}/admin/login",
-                        json={"username": username, "password": password}
-                    )
-                    data = response.json()
+                    data = backend_client.login(username, password)
                     
                     if data.get("success"):
                         st.session_state.logged_in = True
@@ -165,25 +159,12 @@ def check_coupon(code: str, verify: bool = False):
     """检查或核销优惠券"""
     try:
         if verify:
-            response = requests.post(
-                f"{API_BASE_URL}/admin/coupon/verify",
-                json={
-                    "code": code,
-                    "admin_id": st.session_state.admin_id
-                }
-            )
+            data = backend_client.verify_coupon(code, st.session_state.admin_id)
         else:
-            response = requests.get(f"{API_BASE_URL}/admin/coupon/check/{code}")
-        
-        data = response.json()
+            data = backend_client.check_coupon(code)
         
         if data.get("success"):
-            fish_names = {
-                "qingjiang": "清江鱼",
-                "lingbo": "凌波鱼",
-                "basha": "巴沙鱼",
-                "jinmu": "金目鲈",
-            }
+            fish_names = backend_client.get_fish_names()
             fish_name = fish_names.get(data.get("fish_type"), "鱼")
             
             st.markdown(f"""
@@ -221,8 +202,10 @@ def stats_page():
     st.markdown("# 📊 数据统计")
     
     try:
-        response = requests.get(f"{API_BASE_URL}/admin/stats")
-        data = response.json()
+        stats_cache = backend_client.get_stats_cache()
+        force = st.button("🔄 刷新")
+        data = stats_cache.get(force=force)
+        st.caption(f"数据更新于 {int(stats_cache.age)} 秒前")
         
         col1, col2 = st.columns(2)
         
@@ -0,0 +1,137 @@
+"""
+后端 API 客户端（管理后台共用）
+
+- 所有请求共用一个 keep-alive 连接池，并带显式超时
+- 统计数据在进程内缓存，过期后在后台线程刷新，页面始终立即拿到最近一次结果
+- 核销带 Idempotency-Key，网络错误时用同一个键重试，不会重复核销
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+import os
+import threading
+import time
+import uuid
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+# API 配置（docker-compose 中通过环境变量注入）
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000/api")
+
+# (连接超时, 读取超时)，单位秒
+REQUEST_TIMEOUT = (
+    float(os.getenv("API_CONNECT_TIMEOUT", "2")),
+    float(os.getenv("API_READ_TIMEOUT", "5")),
+)
+
+# 核销遇到连接错误/超时时的重试次数
+VERIFY_RETRIES = int(os.getenv("VERIFY_RETRIES", "2"))
+
+# 统计数据缓存有效期（秒）
+STATS_TTL = float(os.getenv("STATS_TTL", "30"))
+
+# 鱼类配置缓存有效期（秒）
+CATALOGUE_TTL = int(os.getenv("CATALOGUE_TTL", "300"))
+
+# 后端不可用时使用的鱼类名称
+DEFAULT_FISH_NAMES = {
+    "qingjiang": "清江鱼",
+    "lingbo": "凌波鱼",
+    "basha": "巴沙鱼",
+    "jinmu": "金目鲈",
+}
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """进程内共享的连接池（跨 rerun、跨会话复用）"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _request(session: requests.Session, method: str, path: str, **kwargs) -> dict:
+    response = session.request(method, f"{API_BASE_URL}{path}", timeout=REQUEST_TIMEOUT, **kwargs)
+    return response.json()
+
+
+def login(username: str, password: str) -> dict:
+    """店员登录"""
+    return _request(get_session(), "POST", "/admin/login", json={"username": username, "password": password})
+
+
+def check_coupon(code: str) -> dict:
+    """查询优惠券状态"""
+    return _request(get_session(), "GET", f"/admin/coupon/check/{code}")
+
+
+def verify_coupon(code: str, admin_id: int) -> dict:
+    """核销优惠券"""
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    for attempt in range(VERIFY_RETRIES + 1):
+        try:
+            return _request(
+                get_session(), "POST", "/admin/coupon/verify",
+                json={"code": code, "admin_id": admin_id}, headers=headers,
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == VERIFY_RETRIES:
+                raise
+
+
+@st.cache_data(ttl=CATALOGUE_TTL, show_spinner=False)
+def get_fish_names() -> dict:
+    """鱼类名称（来自后端鱼类配置）"""
+    try:
+        items = _request(get_session(), "GET", "/game/catalogue")
+        return {item["fish_type"]: item["name"] for item in items}
+    except Exception:
+        return dict(DEFAULT_FISH_NAMES)
+
+
+class StatsCache:
+    """统计数据缓存：过期后后台刷新（stale-while-revalidate），同一时间最多一个刷新请求"""
+
+    def __init__(self, session: requests.Session, ttl: float):
+        self.session = session
+        self.ttl = ttl
+        self._data: Optional[dict] = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._pending: Optional[Future] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stats-refresh")
+
+    def _refresh(self) -> dict:
+        data = _request(self.session, "GET", "/admin/stats")
+        with self._lock:
+            self._data = data
+            self._fetched_at = time.monotonic()
+        return data
+
+    def _schedule(self) -> Future:
+        with self._lock:
+            if self._pending is None or self._pending.done():
+                self._pending = self._executor.submit(self._refresh)
+            return self._pending
+
+    def get(self, force: bool = False) -> dict:
+        """返回最近一次的统计数据；首次加载时等待，之后过期只触发后台刷新"""
+        if self._data is None or force:
+            return self._schedule().result()
+        if self.age > self.ttl:
+            self._schedule()
+        return self._data
+
+    @property
+    def age(self) -> float:
+        """距上次成功刷新的秒数"""
+        return time.monotonic() - self._fetched_at
+
+
+@st.cache_resource
+def get_stats_cache() -> StatsCache:
+    return StatsCache(get_session(), STATS_TTL)
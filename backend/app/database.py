@@ -2,19 +2,45 @@
 数据库配置和连接
 """
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import DeclarativeBase
-from typing import AsyncGenerator
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker, AsyncConnection
+from sqlalchemy.orm import DeclarativeBase, Session
+from sqlalchemy.schema import CreateTable, CreateIndex
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, text, select, delete, insert, inspect, event, literal
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Callable, List, Optional
+from datetime import datetime
+import asyncio
+import hashlib
+import logging
 import os
 
 # 数据库 URL (使用 SQLite 进行开发，生产使用 PostgreSQL)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./ocean_flame.db")
 
+# 启动模式: check = 比对 schema 版本，一致时跳过 DDL; create = 每次启动都 create_all; skip = 不做 DDL
+DB_STARTUP_MODE = os.getenv("DB_STARTUP_MODE", "check")
+
+# 启动时预热的连接数
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "5"))
+
+# SQLite 配置: default = 驱动默认行为; tuned = WAL + 单写连接组提交 + 只读连接池（需显式开启）
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default")
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_CACHE_KIB = int(os.getenv("SQLITE_CACHE_KIB", "65536"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# 只读连接数
+SQLITE_READERS = int(os.getenv("SQLITE_READERS", "4"))
+# 一次组提交最多合并的请求数
+SQLITE_GROUP_COMMIT_MAX = int(os.getenv("SQLITE_GROUP_COMMIT_MAX", "16"))
+
+logger = logging.getLogger("app.database")
+
+# PostgreSQL advisory lock 键，保证多 worker 同时启动时只有一个执行 DDL
+_DDL_LOCK_KEY = 0x0CEA_F1A3
+
 # 创建异步引擎
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,  # 开发环境打印 SQL
-)
+# SQL 日志由 LOG_SQL 控制，经日志队列异步输出
+engine = create_async_engine(DATABASE_URL)
 
 # 创建会话工厂
 async_session_maker = async_sessionmaker(
@@ -23,17 +49,341 @@ async_session_maker = async_sessionmaker(
     expire_on_commit=False,
 )
 
+# 需要安装查询统计等钩子的全部引擎
+engines: List = [engine]
+
+
+def _apply_pragmas(dbapi_connection, query_only: bool = False):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # WAL 下 NORMAL 只在检查点时 fsync，掉电最多丢失最近提交，不会损坏数据库
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KIB}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if query_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+class GroupCommitWriter:
+    """
+    SQLite 单写连接
+
+    请求按到达顺序排队独占写连接（不再由多个连接抢锁、按 busy_timeout 退避重试），
+    每个请求的事务以 SAVEPOINT 运行，出错只回滚自己的部分。当队列中没有后续请求
+    或已合并 SQLITE_GROUP_COMMIT_MAX 个请求时统一 COMMIT 一次，组内请求都等到
+    这次 COMMIT 完成才返回；COMMIT 失败时整组请求一起失败。
+
+    会话提交只是释放 SAVEPOINT，run_after_commit 的回调暂存在写入器上，
+    等组 COMMIT 成功后才执行，COMMIT 失败则丢弃。
+    """
+
+    def __init__(self, engine, max_group: int = SQLITE_GROUP_COMMIT_MAX):
+        self.engine = engine
+        self.max_group = max_group
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop = None
+        self._waiting = 0
+        self._conn: Optional[AsyncConnection] = None
+        self._group: List[asyncio.Future] = []
+        self._callbacks: List[Callable[[], None]] = []
+
+    @asynccontextmanager
+    async def session(self) -> AsyncGenerator[AsyncSession, None]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 锁与事件循环绑定（测试中会多次启动应用）
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._conn = None
+        self._waiting += 1
+        try:
+            await self._lock.acquire()
+        except BaseException:
+            # 排队时被取消（客户端断开、超时、停机）：不再计入等待数；
+            # 若前一个持锁者因为还有人排队而没有提交，由后台补一次提交
+            self._waiting -= 1
+            if self._group and self._waiting == 0:
+                loop.create_task(self._flush())
+            raise
+        self._waiting -= 1
+        try:
+            committed = loop.create_future()
+            try:
+                if self._conn is None:
+                    self._conn = await self.engine.connect()
+                if not self._conn.in_transaction():
+                    await self._conn.begin()
+                session = AsyncSession(
+                    bind=self._conn,
+                    join_transaction_mode="create_savepoint",
+                    expire_on_commit=False,
+                )
+                session.info["defer_after_commit"] = lambda callbacks: self._callbacks.extend(callbacks)
+                try:
+                    yield session
+                    await session.commit()
+                except BaseException:
+                    await session.rollback()
+                    raise
+                finally:
+                    await session.close()
+                self._group.append(committed)
+            finally:
+                if self._group and (self._waiting == 0 or len(self._group) >= self.max_group):
+                    await self._commit_group()
+        finally:
+            self._lock.release()
+        await committed
+
+    async def _flush(self):
+        async with self._lock:
+            if self._group:
+                await self._commit_group()
+
+    async def _commit_group(self):
+        group, self._group = self._group, []
+        callbacks, self._callbacks = self._callbacks, []
+        try:
+            await self._conn.commit()
+        except Exception as exc:
+            # 连接状态不确定，丢弃后下次重建；回调对应的写入已回滚，一并丢弃
+            conn, self._conn = self._conn, None
+            await conn.invalidate()
+            for future in group:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception:
+                logger.exception("提交后回调失败")
+        for future in group:
+            if not future.done():
+                future.set_result(None)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
+writer: Optional[GroupCommitWriter] = None
+read_engine = engine
+read_session_maker = async_session_maker
+
+if (
+    SQLITE_PROFILE == "tuned"
+    and engine.dialect.name == "sqlite"
+    and engine.url.database not in (None, "", ":memory:")
+):
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        _apply_pragmas(dbapi_connection)
+
+    writer_engine = create_async_engine(DATABASE_URL, pool_size=1, max_overflow=0)
+
+    @event.listens_for(writer_engine.sync_engine, "connect")
+    def _on_writer_connect(dbapi_connection, connection_record):
+        # 由 SQLAlchemy 显式发出 BEGIN，SAVEPOINT 才能按预期工作
+        dbapi_connection.isolation_level = None
+        _apply_pragmas(dbapi_connection)
+
+    @event.listens_for(writer_engine.sync_engine, "begin")
+    def _on_writer_begin(conn):
+        # 开始即取得写锁，避免读后升级写锁时的 SQLITE_BUSY
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    read_engine = create_async_engine(DATABASE_URL, pool_size=SQLITE_READERS, max_overflow=0)
+
+    @event.listens_for(read_engine.sync_engine, "connect")
+    def _on_reader_connect(dbapi_connection, connection_record):
+        _apply_pragmas(dbapi_connection, query_only=True)
+
+    read_session_maker = async_sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+    writer = GroupCommitWriter(writer_engine)
+    engines += [writer_engine, read_engine]
+
+
 # 基类
 class Base(DeclarativeBase):
-    pass
+    # 服务端生成的默认值随 INSERT/UPDATE 的 RETURNING 一起取回，写入后无需 refresh
+    __mapper_args__ = {"eager_defaults": True}
+
+
+# schema 版本表（不属于业务模型，不参与版本计算）
+schema_meta = Table(
+    "schema_meta",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("version", String(64), nullable=False),
+    Column("updated_at", DateTime, default=datetime.utcnow),
+)
+
+
+def schema_version() -> str:
+    """根据当前模型生成的 DDL 计算 schema 版本"""
+    ddl = []
+    for table in Base.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=engine.dialect)))
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            ddl.append(str(CreateIndex(index).compile(dialect=engine.dialect)))
+    return hashlib.sha256("\n".join(ddl).encode()).hexdigest()[:16]
+
+
+async def _stored_version(conn: AsyncConnection) -> Optional[str]:
+    has_table = await conn.run_sync(lambda c: inspect(c).has_table(schema_meta.name))
+    if not has_table:
+        return None
+    result = await conn.execute(select(schema_meta.c.version).where(schema_meta.c.id == 1))
+    return result.scalar_one_or_none()
+
+
+def _column_ddl(conn, table, column) -> str:
+    """ALTER TABLE ... ADD COLUMN 的列定义；NOT NULL 列需要标量默认值来回填已有行"""
+    ddl = f"{column.name} {column.type.compile(dialect=conn.dialect)}"
+    if not column.nullable:
+        if column.default is None or not column.default.is_scalar:
+            raise RuntimeError(f"无法自动添加 NOT NULL 列 {table.name}.{column.name}，需手动迁移")
+        default = literal(column.default.arg).compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        ddl += f" DEFAULT {default} NOT NULL"
+    return ddl
+
+
+def _migrate(conn) -> List[str]:
+    """
+    给已有表补上模型新增的列和索引（只做加法），返回执行的变更
+
+    列的 info 中 pg_default 为 PostgreSQL 上的列默认值（补列后单独设置，已有行不重写），
+    pg_backfill 为 PostgreSQL 上已有行的回填值。
+    """
+    inspector = inspect(conn)
+    postgres = conn.dialect.name == "postgresql"
+    changes = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(conn, table, column)}"))
+            if postgres and "pg_default" in column.info:
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ALTER COLUMN {column.name} SET DEFAULT {column.info['pg_default']}"
+                ))
+            if postgres and "pg_backfill" in column.info:
+                conn.execute(table.update().where(column.is_(None)).values({column.name: column.info["pg_backfill"]}))
+            changes.append(f"{table.name}.{column.name}")
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(conn)
+                changes.append(index.name)
+    return changes
+
+
+def _missing_columns(conn) -> List[str]:
+    """模型中有、数据库已有表中没有的列（表.列）"""
+    inspector = inspect(conn)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in existing]
+    return missing
+
 
 # 初始化数据库
-async def init_db():
+async def init_db(mode: str = DB_STARTUP_MODE) -> bool:
+    """
+    初始化数据库，返回本次是否执行了 DDL
+
+    check 模式下版本一致只需一次查询；版本变化时由拿到锁的 worker 执行 create_all，
+    其余 worker 拿到锁后重新比对版本即可跳过。create_all 只创建缺失的表（连同其索引），
+    已有表新增的列和索引由 _migrate 补上；无法自动补上的列使启动失败，不会带着旧表结构继续运行。
+    """
+    if mode == "skip":
+        return False
+
+    if mode == "create":
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(_migrate)
+        return True
+
+    version = schema_version()
+    async with engine.connect() as conn:
+        if await _stored_version(conn) == version:
+            return False
+
     async with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _DDL_LOCK_KEY})
+        if await _stored_version(conn) == version:
+            return False
+        await conn.run_sync(schema_meta.metadata.create_all)
         await conn.run_sync(Base.metadata.create_all)
+        changes = await conn.run_sync(_migrate)
+        if changes:
+            logger.warning("已为已有表补充列和索引: %s", ", ".join(changes))
+        missing = await conn.run_sync(_missing_columns)
+        if missing:
+            raise RuntimeError(f"数据库表缺少列，需手动迁移: {', '.join(missing)}")
+        await conn.execute(delete(schema_meta))
+        await conn.execute(insert(schema_meta).values(id=1, version=version, updated_at=datetime.utcnow()))
+    return True
+
+
+async def warm_up_pool(size: int = DB_POOL_WARMUP):
+    """预先建立连接，避免第一批请求承担建连开销"""
+    async def ping(e):
+        async with e.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping(engine) for _ in range(size)))
+    if read_engine is not engine:
+        await asyncio.gather(*(ping(read_engine) for _ in range(SQLITE_READERS)))
 
-# 获取数据库会话
+
+async def close_db():
+    """关闭写连接并释放所有连接池"""
+    if writer is not None:
+        await writer.close()
+    for e in engines:
+        await e.dispose()
+
+
+def run_after_commit(db: AsyncSession, fn: Callable[[], None]):
+    """本次事务提交成功后执行回调（如同步进程内缓存）；回滚则丢弃"""
+    db.info.setdefault("after_commit", []).append(fn)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session):
+    callbacks = session.info.pop("after_commit", [])
+    defer = session.info.get("defer_after_commit")
+    if defer is not None:
+        # 组提交写入器的会话：提交的只是 SAVEPOINT，等真正 COMMIT 后再执行
+        defer(callbacks)
+        return
+    for fn in callbacks:
+        fn()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_commit(session):
+    session.info.pop("after_commit", None)
+
+
+# 获取数据库会话：请求内只 flush，由这里统一提交一次。
+# 路由使用 Depends(get_db, scope="function")，保证在响应发出前提交
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    if writer is not None:
+        async with writer.session() as session:
+            yield session
+        return
+
     async with async_session_maker() as session:
         try:
             yield session
@@ -43,3 +393,21 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             raise
         finally:
             await session.close()
+
+
+# 后台任务的写会话（SQLite tuned 模式下与请求共用写队列，调用方自行 commit；不可嵌套）
+@asynccontextmanager
+async def write_session() -> AsyncGenerator[AsyncSession, None]:
+    if writer is not None:
+        async with writer.session() as session:
+            yield session
+        return
+
+    async with async_session_maker() as session:
+        yield session
+
+
+# 只读会话（SQLite tuned 模式下走只读连接池，不进入写队列）
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    async with read_session_maker() as session:
+        yield session
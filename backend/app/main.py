@@ -5,22 +5,34 @@ Ocean Flame Fish Game Backend
 
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
+import logging
 import uvicorn
 
-from app.routers import auth, game, admin
-from app.database import init_db
+from app.routers import auth, game, admin, export
+from app.database import engines
+from app.services import metrics, startup
+from app.services.query_profiler import install_query_profiler, QueryProfilerMiddleware
+from app.services.idempotency import IdempotencyMiddleware
+from app.services.structured_log import configure_logging, shutdown_logging, RequestLoggingMiddleware
+
+# 日志经队列由后台线程输出 JSON，需在其他模块记录日志前安装
+configure_logging()
+logger = logging.getLogger("app")
 
 # 应用生命周期管理
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动时初始化数据库
-    await init_db()
-    print("🐟 海鲜养殖乐园后端启动成功!")
+    # 启动时初始化数据库并预热连接池和缓存
+    configure_logging()
+    await startup.startup()
+    logger.info("海鲜养殖乐园后端启动成功", extra={"cold_start_seconds": startup.state["cold_start_seconds"]})
     yield
     # 关闭时清理资源
-    print("👋 后端服务关闭")
+    await startup.shutdown()
+    logger.info("后端服务关闭")
+    shutdown_logging()
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -39,10 +51,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# SQL 慢查询 / N+1 分析
+for db_engine in engines:
+    install_query_profiler(db_engine)
+app.add_middleware(QueryProfilerMiddleware)
+
+# 弱网重试的写接口支持 Idempotency-Key
+app.add_middleware(
+    IdempotencyMiddleware,
+    paths=[
+        r"/api/game/fish/feed/\d+",
+        r"/api/game/fish/harvest/\d+",
+        r"/api/admin/coupon/verify",
+    ],
+)
+
+# request_id 与访问日志（最外层，覆盖幂等回放等所有响应）
+app.add_middleware(RequestLoggingMiddleware)
+
 # 注册路由
 app.include_router(auth.router, prefix="/api/auth", tags=["认证"])
 app.include_router(game.router, prefix="/api/game", tags=["游戏"])
 app.include_router(admin.router, prefix="/api/admin", tags=["管理"])
+app.include_router(export.router, prefix="/api/admin/export", tags=["管理"])
 
 # 根路由
 @app.get("/")
@@ -58,6 +89,18 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "ocean-flame-fish"}
 
+# 就绪检查（uvicorn 在启动流程完成后才接受连接，503 只出现在关闭过程中）
+@app.get("/ready")
+async def readiness_check():
+    if not startup.state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting", **startup.state})
+    return {"status": "ready", **startup.state}
+
+# 进程内指标
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
+
 # 全局异常处理
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -1,2 +1,2 @@
 # 模型初始化
-from app.models.models import User, Fish, Coupon, FeedingRecord, AdminUser, FishType, FishStatus
+from app.models.models import User, Fish, Coupon, FeedingRecord, AdminUser, GuestIdentity, ArchivedUser, CouponRollup, FishCatalogue, OutboxEvent, OutboxCheckpoint, Campaign, FishType, FishStatus
@@ -2,13 +2,16 @@
 数据模型定义
 """
 
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey, LargeBinary, Index, DDL, event, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
 
 from app.database import Base
 
+# PostgreSQL 上 txid 列的默认值：写入事务的 id
+TXID_DEFAULT = "pg_current_xact_id()::text::bigint"
+
 
 class FishType(str, enum.Enum):
     QINGJIANG = "qingjiang"  # 清江鱼
@@ -89,10 +92,15 @@ class Coupon(Base):
     
     expires_at = Column(DateTime, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    campaign_id = Column(Integer, nullable=True)  # 批量发放活动 id（收获所得为空，周榜只计收获）
+    # 写入事务的 id（仅 PostgreSQL，由列默认值填充；升级前的旧行为空，只在全量重建时读取）
+    txid = Column(BigInteger, nullable=True, info={"pg_default": TXID_DEFAULT})
     
     # 关系
     owner = relationship("User", back_populates="coupons")
 
+    __table_args__ = (Index("ix_coupons_txid_id", "txid", "id"),)
+
 
 class FeedingRecord(Base):
     """喂食记录（用于防作弊）"""
@@ -120,3 +128,119 @@ class AdminUser(Base):
     
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class GuestIdentity(Base):
+    """延迟落库的游客身份（首次写操作时才与用户行绑定）"""
+    __tablename__ = "guest_identities"
+
+    guest_id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivedUser(Base):
+    """冷归档的长期不活跃游客（用户及其鱼、喂食记录、优惠券压缩为一行）"""
+    __tablename__ = "archived_users"
+
+    user_id = Column(Integer, primary_key=True)
+    payload = Column(LargeBinary, nullable=False)  # zlib 压缩的 JSON
+    row_count = Column(Integer, default=0)
+    
+    last_active_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CouponRollup(Base):
+    """优惠券发放/核销小时汇总（按门店），发放和核销时增量维护"""
+    __tablename__ = "coupon_rollups"
+
+    bucket = Column(DateTime, primary_key=True)  # 整点（UTC）
+    store_id = Column(String(50), primary_key=True, default="")  # 发放无门店，记为 ""
+    
+    issued_count = Column(Integer, default=0, nullable=False)
+    issued_value = Column(Integer, default=0, nullable=False)
+    redeemed_count = Column(Integer, default=0, nullable=False)
+    redeemed_value = Column(Integer, default=0, nullable=False)
+
+
+class FishCatalogue(Base):
+    """鱼类配置（运营可在线调整，各 worker 按版本热加载）"""
+    __tablename__ = "fish_catalogue"
+
+    fish_type = Column(SQLEnum(FishType), primary_key=True)
+    name = Column(String(50), nullable=False)
+    growth_time = Column(Integer, nullable=False)  # 成长天数
+    value = Column(Integer, nullable=False)  # 优惠券价值
+    
+    is_active = Column(Boolean, default=True)  # 是否开放领养
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class OutboxEvent(Base):
+    """游戏事件发件箱（与业务写入同一事务追加，由中继批量投递给各消费者）"""
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String(50), nullable=False)  # fish.fed, fish.harvested, coupon.redeemed ...
+    user_id = Column(Integer, nullable=True, index=True)
+    payload = Column(String, nullable=False)  # JSON
+    # 写入事务的 id（仅 PostgreSQL，由列默认值填充；升级时旧事件回填 0，按原 id 顺序继续投递）
+    txid = Column(BigInteger, nullable=True, info={"pg_default": TXID_DEFAULT, "pg_backfill": 0})
+    
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (Index("ix_outbox_events_txid_id", "txid", "id"),)
+
+
+def _default_txid(table):
+    """PostgreSQL 上由数据库填写 txid 列，读取方据此判断行所在事务是否已结束（已有表由 init_db 补列时设置）"""
+    event.listen(
+        table,
+        "after_create",
+        DDL(
+            f"ALTER TABLE {table.name} ALTER COLUMN txid SET DEFAULT {TXID_DEFAULT}"
+        ).execute_if(dialect="postgresql"),
+    )
+
+
+_default_txid(OutboxEvent.__table__)
+_default_txid(Coupon.__table__)
+
+
+class OutboxCheckpoint(Base):
+    """各消费者已处理到的事件 id（PostgreSQL 上按 (事务 id, 事件 id) 推进）"""
+    __tablename__ = "outbox_checkpoints"
+
+    consumer = Column(String(50), primary_key=True)
+    last_event_id = Column(Integer, default=0, nullable=False)
+    last_txid = Column(BigInteger, default=0, nullable=False)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Campaign(Base):
+    """批量发放活动（按用户 id 游标分批发放鱼或优惠券，游标与每批发放同一事务推进）"""
+    __tablename__ = "campaigns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    grant_type = Column(String(10), nullable=False)  # fish, coupon
+    fish_type = Column(SQLEnum(FishType), nullable=False)
+    coupon_value = Column(Integer, nullable=True)  # 优惠券金额，空则取鱼类配置
+    coupon_days = Column(Integer, default=7)  # 优惠券有效天数
+    
+    # 用户筛选条件
+    active_since = Column(String(10), nullable=True)  # last_feed_date >= 该日期
+    registered_before = Column(DateTime, nullable=True)
+    
+    status = Column(String(20), default="pending", index=True)  # pending, running, done, cancelled
+    last_user_id = Column(Integer, default=0, nullable=False)
+    target_count = Column(Integer, default=0)  # 创建时符合条件的用户数
+    granted_count = Column(Integer, default=0)
+    
+    created_by = Column(String(50), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
@@ -2,16 +2,20 @@
 管理后台 API（店员核销等）
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from pydantic import BaseModel
+from sqlalchemy import select, func, update
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from datetime import datetime
-import hashlib
+from datetime import date, datetime, timedelta
 
-from app.database import get_db
-from app.models.models import Coupon, User, AdminUser
+from app.database import get_db, get_read_db, write_session, run_after_commit
+from app.models.models import Coupon, User, AdminUser, FishCatalogue, FishType, Campaign
+from app.services.passwords import verify_password, verify_unknown_user, PasswordHasherBusy
+from app.services.archival import restore_user
+from app.services.rollups import query_timeseries
+from app.services.outbox import record_event
+from app.services import catalogue, pond_engine, coupon_filter, campaigns
 
 router = APIRouter()
 
@@ -41,6 +45,24 @@ class VerifyCouponResponse(BaseModel):
     fish_type: Optional[str] = None
 
 
+class RestoreUserRequest(BaseModel):
+    admin_id: int
+
+
+class RestoreUserResponse(BaseModel):
+    success: bool
+    message: str
+    rows_restored: int = 0
+
+
+class UpdateFishTypeRequest(BaseModel):
+    admin_id: int
+    name: Optional[str] = None
+    growth_time: Optional[int] = Field(default=None, gt=0)  # 成长天数
+    value: Optional[int] = Field(default=None, gt=0)  # 优惠券价值
+    is_active: Optional[bool] = None
+
+
 class CouponStats(BaseModel):
     total_issued: int
     total_used: int
@@ -54,30 +76,91 @@ class DashboardStats(BaseModel):
     coupon_stats: CouponStats
 
 
+class TimeseriesPoint(BaseModel):
+    bucket: datetime
+    store_id: Optional[str] = None
+    issued_count: int
+    issued_value: int
+    redeemed_count: int
+    redeemed_value: int
+
+
+class TimeseriesResponse(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    points: List[TimeseriesPoint]
+
+
+class CreateCampaignRequest(BaseModel):
+    admin_id: int
+    name: str
+    grant_type: str  # fish, coupon
+    fish_type: str
+    coupon_value: Optional[int] = Field(default=None, gt=0)  # 空则取鱼类配置
+    coupon_days: int = Field(default=7, gt=0)  # 优惠券有效天数
+    active_since: Optional[date] = None
+    registered_before: Optional[datetime] = None
+
+
+class CampaignActionRequest(BaseModel):
+    admin_id: int
+
+
+class CampaignResponse(BaseModel):
+    id: int
+    name: str
+    grant_type: str
+    fish_type: str
+    status: str
+    target_count: int
+    granted_count: int
+    last_user_id: int
+    progress: float
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
 @router.post("/login", response_model=AdminLoginResponse)
 async def admin_login(
     request: AdminLoginRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """管理员登录"""
-    # 密码哈希
-    password_hash = hashlib.sha256(request.password.encode()).hexdigest()
-    
+    """管理员登录（只读查询；仅升级旧哈希时短暂进入写会话，bcrypt 期间不占写队列）"""
     result = await db.execute(
         select(AdminUser).where(
             AdminUser.username == request.username,
-            AdminUser.password_hash == password_hash,
             AdminUser.is_active == True
         )
     )
     admin = result.scalar_one_or_none()
     
-    if not admin:
+    # 密码校验在线程池中进行，不阻塞事件循环；用户名不存在时同样做一次校验
+    ok, new_hash = (False, None)
+    try:
+        if admin:
+            ok, new_hash = await verify_password(admin.username, request.password, admin.password_hash)
+        else:
+            ok = await verify_unknown_user(request.password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="登录请求过多，请稍后重试")
+    
+    if not ok:
         return AdminLoginResponse(
             success=False,
             message="用户名或密码错误"
         )
     
+    # 旧版 sha256 哈希升级为 bcrypt（期间密码被修改过则不覆盖）
+    if new_hash:
+        async with write_session() as write_db:
+            await write_db.execute(
+                update(AdminUser)
+                .where(AdminUser.id == admin.id, AdminUser.password_hash == admin.password_hash)
+                .values(password_hash=new_hash)
+            )
+            await write_db.commit()
+    
     return AdminLoginResponse(
         success=True,
         message="登录成功",
@@ -89,7 +172,7 @@ async def admin_login(
 @router.post("/coupon/verify", response_model=VerifyCouponResponse)
 async def verify_coupon(
     request: VerifyCouponRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db, scope="function")
 ):
     """核销优惠券"""
     # 验证管理员
@@ -97,6 +180,13 @@ async def verify_coupon(
     if not admin or not admin.is_active:
         raise HTTPException(status_code=403, detail="无权限")
     
+    # 一定不存在的券码不查库（先验证管理员，避免未授权请求借此探测券码）
+    if not coupon_filter.might_exist(request.code):
+        return VerifyCouponResponse(
+            success=False,
+            message="优惠券不存在"
+        )
+    
     # 查找优惠券
     result = await db.execute(
         select(Coupon).where(Coupon.code == request.code.upper())
@@ -104,6 +194,7 @@ async def verify_coupon(
     coupon = result.scalar_one_or_none()
     
     if not coupon:
+        coupon_filter.record_false_positive()
         return VerifyCouponResponse(
             success=False,
             message="优惠券不存在"
@@ -125,8 +216,14 @@ async def verify_coupon(
     coupon.used = True
     coupon.used_at = datetime.utcnow()
     coupon.used_by = admin.username
+    record_event(
+        db, "coupon.redeemed", coupon.user_id,
+        coupon_id=coupon.id, fish_type=coupon.fish_type, value=coupon.value,
+        store_id=admin.store_id, used_by=admin.username, used_at=coupon.used_at,
+    )
     
-    await db.commit()
+    if pond_engine.engine is not None:
+        run_after_commit(db, lambda: pond_engine.engine.coupon_redeemed(coupon.user_id, coupon.id))
     
     return VerifyCouponResponse(
         success=True,
@@ -139,15 +236,22 @@ async def verify_coupon(
 @router.get("/coupon/check/{code}", response_model=VerifyCouponResponse)
 async def check_coupon(
     code: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """查询优惠券状态（不核销）"""
+    if not coupon_filter.might_exist(code):
+        return VerifyCouponResponse(
+            success=False,
+            message="优惠券不存在"
+        )
+    
     result = await db.execute(
         select(Coupon).where(Coupon.code == code.upper())
     )
     coupon = result.scalar_one_or_none()
     
     if not coupon:
+        coupon_filter.record_false_positive()
         return VerifyCouponResponse(
             success=False,
             message="优惠券不存在"
@@ -177,8 +281,33 @@ async def check_coupon(
     )
 
 
+@router.post("/users/{user_id}/restore", response_model=RestoreUserResponse)
+async def restore_archived_user(
+    user_id: int,
+    request: RestoreUserRequest,
+    db: AsyncSession = Depends(get_db, scope="function")
+):
+    """从冷归档恢复回归的游客"""
+    admin = await db.get(AdminUser, request.admin_id)
+    if not admin or not admin.is_active:
+        raise HTTPException(status_code=403, detail="无权限")
+    
+    rows = await restore_user(db, user_id)
+    if rows is None:
+        return RestoreUserResponse(
+            success=False,
+            message="没有该用户的归档"
+        )
+    
+    return RestoreUserResponse(
+        success=True,
+        message="用户已恢复",
+        rows_restored=rows
+    )
+
+
 @router.get("/stats", response_model=DashboardStats)
-async def get_dashboard_stats(db: AsyncSession = Depends(get_db)):
+async def get_dashboard_stats(db: AsyncSession = Depends(get_read_db)):
     """获取仪表盘统计数据"""
     # 用户总数
     result = await db.execute(select(func.count(User.id)))
@@ -216,3 +345,154 @@ async def get_dashboard_stats(db: AsyncSession = Depends(get_db)):
             total_value_used=total_value_used,
         )
     )
+
+
+@router.get("/stats/timeseries", response_model=TimeseriesResponse)
+async def get_stats_timeseries(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    store_id: Optional[str] = None,
+    by_store: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """按小时/天、门店统计优惠券发放和核销（读汇总表，默认最近 7 天）"""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=7)
+    
+    points = await query_timeseries(db, start, end, granularity, store_id, by_store)
+    
+    return TimeseriesResponse(
+        granularity=granularity,
+        start=start,
+        end=end,
+        points=[TimeseriesPoint(**p) for p in points]
+    )
+
+
+@router.put("/catalogue/{fish_type}")
+async def update_fish_type(
+    fish_type: str,
+    request: UpdateFishTypeRequest,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db, scope="function")
+):
+    """在线调整鱼类配置（成长天数、优惠券价值等），各 worker 热加载"""
+    admin = await db.get(AdminUser, request.admin_id)
+    if not admin or not admin.is_active or admin.role != "admin":
+        raise HTTPException(status_code=403, detail="无权限")
+    
+    try:
+        fish_type = FishType(fish_type.lower())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的鱼类型")
+    
+    entry = await db.get(FishCatalogue, fish_type)
+    if not entry:
+        raise HTTPException(status_code=404, detail="鱼类配置不存在")
+    
+    for field in ("name", "growth_time", "value", "is_active"):
+        value = getattr(request, field)
+        if value is not None:
+            setattr(entry, field, value)
+    entry.updated_at = datetime.utcnow()
+    await db.flush()
+    
+    # 提交后（响应发出后）再重载并通知其他 worker
+    background_tasks.add_task(catalogue.publish_change)
+    
+    return {
+        "success": True,
+        "fish_type": entry.fish_type.value,
+        "name": entry.name,
+        "growth_time": entry.growth_time,
+        "value": entry.value,
+        "is_active": bool(entry.is_active),
+    }
+
+
+def _campaign_response(campaign: Campaign) -> CampaignResponse:
+    return CampaignResponse(
+        id=campaign.id,
+        name=campaign.name,
+        grant_type=campaign.grant_type,
+        fish_type=campaign.fish_type.value,
+        status=campaign.status,
+        target_count=campaign.target_count,
+        granted_count=campaign.granted_count,
+        last_user_id=campaign.last_user_id,
+        progress=round(campaign.granted_count / campaign.target_count, 4) if campaign.target_count else 1.0,
+        created_at=campaign.created_at,
+        finished_at=campaign.finished_at,
+    )
+
+
+@router.post("/campaigns", response_model=CampaignResponse)
+async def create_campaign(
+    request: CreateCampaignRequest,
+    db: AsyncSession = Depends(get_db, scope="function")
+):
+    """创建批量发放活动（后台分批执行，可用 GET 查询进度）"""
+    admin = await db.get(AdminUser, request.admin_id)
+    if not admin or not admin.is_active or admin.role != "admin":
+        raise HTTPException(status_code=403, detail="无权限")
+    
+    if request.grant_type not in campaigns.GRANT_TYPES:
+        raise HTTPException(status_code=400, detail="发放类型只能是 fish 或 coupon")
+    try:
+        fish_type = FishType(request.fish_type.lower())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的鱼类型")
+    
+    campaign = Campaign(
+        name=request.name,
+        grant_type=request.grant_type,
+        fish_type=fish_type,
+        coupon_value=request.coupon_value,
+        coupon_days=request.coupon_days,
+        active_since=request.active_since.isoformat() if request.active_since else None,
+        registered_before=request.registered_before,
+        status="pending",
+        last_user_id=0,
+        granted_count=0,
+        created_by=admin.username,
+    )
+    campaign.target_count = await campaigns.count_segment(db, campaign)
+    db.add(campaign)
+    await db.flush()
+    
+    return _campaign_response(campaign)
+
+
+@router.get("/campaigns/{campaign_id}", response_model=CampaignResponse)
+async def get_campaign(
+    campaign_id: int,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """查询批量发放进度"""
+    campaign = await db.get(Campaign, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="活动不存在")
+    return _campaign_response(campaign)
+
+
+@router.post("/campaigns/{campaign_id}/cancel", response_model=CampaignResponse)
+async def cancel_campaign(
+    campaign_id: int,
+    request: CampaignActionRequest,
+    db: AsyncSession = Depends(get_db, scope="function")
+):
+    """停止批量发放（已发放的不回收）"""
+    admin = await db.get(AdminUser, request.admin_id)
+    if not admin or not admin.is_active or admin.role != "admin":
+        raise HTTPException(status_code=403, detail="无权限")
+    
+    campaign = await db.get(Campaign, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="活动不存在")
+    if campaign.status in campaigns.ACTIVE_STATUSES:
+        campaign.status = "cancelled"
+        campaign.finished_at = datetime.utcnow()
+        await db.flush()
+    
+    return _campaign_response(campaign)
@@ -4,18 +4,28 @@
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy import select
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timedelta
+from jose import jwt, JWTError
 import secrets
-import hashlib
+import os
 
-from app.database import get_db
-from app.models.models import User
+from app.database import get_db, get_read_db
+from app.models.models import User, GuestIdentity
 
 router = APIRouter()
 
+# 签名令牌密钥（多 worker 必须一致）
+SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
+TOKEN_ALGORITHM = "HS256"
+TOKEN_EXPIRE_DAYS = 30
+
+# 新用户默认每日饲料（与 User.daily_feed_count 默认值一致）
+DEFAULT_DAILY_FEED = 10
+
 
 # Pydantic 模型
 class UserCreate(BaseModel):
@@ -24,7 +34,7 @@ class UserCreate(BaseModel):
 
 
 class UserResponse(BaseModel):
-    id: int
+    id: Optional[int] = None  # 未落库的游客为空
     username: str
     phone: Optional[str]
     daily_feed_count: int
@@ -65,10 +75,78 @@ def verify_token(token: str) -> Optional[int]:
     return token_data["user_id"]
 
 
+class TokenIdentity(BaseModel):
+    """令牌解析结果：已落库用户有 user_id，未落库游客只有 guest_id"""
+    user_id: Optional[int] = None
+    guest_id: Optional[str] = None
+
+
+def create_signed_token(user_id: Optional[int] = None, guest_id: Optional[str] = None) -> str:
+    """生成无需服务端存储的签名令牌"""
+    payload = {"exp": datetime.utcnow() + timedelta(days=TOKEN_EXPIRE_DAYS)}
+    if user_id is not None:
+        payload["uid"] = user_id
+    if guest_id is not None:
+        payload["gid"] = guest_id
+    return jwt.encode(payload, SECRET_KEY, algorithm=TOKEN_ALGORITHM)
+
+
+def resolve_token(token: str) -> TokenIdentity:
+    """解析令牌（兼容旧的内存令牌），无效时抛出 401"""
+    user_id = verify_token(token)
+    if user_id:
+        return TokenIdentity(user_id=user_id)
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[TOKEN_ALGORITHM])
+    except JWTError:
+        payload = {}
+    if not payload.get("uid") and not payload.get("gid"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无效的令牌"
+        )
+    return TokenIdentity(user_id=payload.get("uid"), guest_id=payload.get("gid"))
+
+
+async def materialize_guest(db: AsyncSession, guest_id: str) -> User:
+    """写操作时为游客创建用户行（持旧令牌已落库、或并发重复落库时复用已有行）"""
+    result = await db.execute(
+        select(GuestIdentity.user_id).where(GuestIdentity.guest_id == guest_id)
+    )
+    user_id = result.scalar_one_or_none()
+    if user_id:
+        return await db.get(User, user_id)
+
+    user = User(username="访客")
+    try:
+        db.add(user)
+        await db.flush()
+        db.add(GuestIdentity(guest_id=guest_id, user_id=user.id))
+        await db.flush()
+    except IntegrityError:
+        # 另一个请求已抢先落库
+        await db.rollback()
+        result = await db.execute(
+            select(GuestIdentity.user_id).where(GuestIdentity.guest_id == guest_id)
+        )
+        return await db.get(User, result.scalar_one())
+    return user
+
+
+def guest_user_response() -> UserResponse:
+    """未落库游客的默认用户信息"""
+    return UserResponse(
+        username="访客",
+        phone=None,
+        daily_feed_count=DEFAULT_DAILY_FEED,
+        total_coupons_earned=0,
+    )
+
+
 @router.post("/register", response_model=TokenResponse)
 async def register(
     user_data: UserCreate,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db, scope="function")
 ):
     """用户注册（游客自动注册）"""
     # 创建新用户
@@ -77,8 +155,7 @@ async def register(
         phone=user_data.phone,
     )
     db.add(user)
-    await db.commit()
-    await db.refresh(user)
+    await db.flush()
     
     # 生成令牌
     token = generate_token(user.id)
@@ -90,35 +167,27 @@ async def register(
 
 
 @router.post("/login/guest", response_model=TokenResponse)
-async def guest_login(db: AsyncSession = Depends(get_db)):
-    """游客登录（自动创建账号）"""
-    user = User(username="访客")
-    db.add(user)
-    await db.commit()
-    await db.refresh(user)
-    
-    token = generate_token(user.id)
+async def guest_login():
+    """游客登录（只签发令牌，首次写操作时才创建账号）"""
+    token = create_signed_token(guest_id=secrets.token_hex(16))
     
     return TokenResponse(
         access_token=token,
-        user=UserResponse.model_validate(user)
+        user=guest_user_response()
     )
 
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user(
     token: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """获取当前用户信息"""
-    user_id = verify_token(token)
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="无效的令牌"
-        )
+    """获取当前用户信息（游客令牌不查库，落库后以写接口下发的新令牌为准）"""
+    identity = resolve_token(token)
+    if identity.user_id is None:
+        return guest_user_response()
     
-    result = await db.execute(select(User).where(User.id == user_id))
+    result = await db.execute(select(User).where(User.id == identity.user_id))
     user = result.scalar_one_or_none()
     
     if not user:
@@ -0,0 +1,201 @@
+"""
+数据导出 API（财务对账用）
+
+逐批从服务端游标读取并流式输出 CSV / NDJSON，内存占用与结果集大小无关。
+导出在整个下载期间占用一个只读连接，同时进行的导出数受 EXPORT_MAX_CONCURRENT 限制，
+超出时返回 429，玩家接口的只读连接不会被导出占满。
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from typing import AsyncIterator, Callable, Optional
+from datetime import datetime
+import csv
+import enum
+import io
+import json
+import os
+import threading
+
+from app.database import get_read_db, read_session_maker
+from app.models.models import Coupon, FeedingRecord, AdminUser
+from app.services import metrics
+
+router = APIRouter()
+
+# 每批从游标读取的行数
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+# 同时进行的导出数（SQLite tuned 模式下只读连接共 SQLITE_READERS 个）
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+# 导出发送完、出错或客户端断开后才释放名额
+_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def _acquire_slot() -> Callable[[], None]:
+    """占用一个导出名额，返回只生效一次的释放函数；名额用完时返回 429"""
+    if not _slots.acquire(blocking=False):
+        metrics.inc("export_rejected_total", help="并发导出过多被拒绝的请求数")
+        raise HTTPException(status_code=429, detail="导出任务过多，请稍后重试")
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            _slots.release()
+
+    return release
+
+
+async def _stream_rows(stmt, fmt: str, release: Callable[[], None]) -> AsyncIterator[str]:
+    """在生成器内部持有会话：响应开始发送时请求依赖里的会话已关闭"""
+    try:
+        async for chunk in _read_rows(stmt, fmt):
+            yield chunk
+    finally:
+        release()
+
+
+async def _read_rows(stmt, fmt: str) -> AsyncIterator[str]:
+    columns = [c.key for c in stmt.selected_columns]
+    async with read_session_maker() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        if fmt == "csv":
+            # BOM 便于 Excel 正确识别中文
+            buffer = io.StringIO()
+            buffer.write("\ufeff")
+            csv.writer(buffer).writerow(columns)
+            yield buffer.getvalue()
+
+        async for rows in result.partitions():
+            buffer = io.StringIO()
+            if fmt == "csv":
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow([_format_value(v) for v in row])
+            else:
+                for row in rows:
+                    record = {k: _format_value(v) for k, v in zip(columns, row)}
+                    buffer.write(json.dumps(record, ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+
+
+def _export_response(stmt, fmt: str, name: str) -> StreamingResponse:
+    filename = f"{name}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    release = _acquire_slot()
+    return StreamingResponse(
+        _stream_rows(stmt, fmt, release),
+        media_type=_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        # 响应没开始发送（生成器未启动）时也要释放
+        background=BackgroundTask(release),
+    )
+
+
+async def _require_admin(db: AsyncSession, admin_id: int):
+    admin = await db.get(AdminUser, admin_id)
+    if not admin or not admin.is_active or admin.role != "admin":
+        raise HTTPException(status_code=403, detail="无权限")
+
+
+def _store_usernames(store_id: str):
+    """门店下的店员用户名（Coupon.used_by 记录的是核销员工用户名）"""
+    return select(AdminUser.username).where(AdminUser.store_id == store_id)
+
+
+@router.get("/coupons")
+async def export_coupons(
+    admin_id: int,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    store_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """导出优惠券（按发放时间筛选；指定门店时只含该门店核销的券）"""
+    await _require_admin(db, admin_id)
+
+    stmt = select(
+        Coupon.id, Coupon.code, Coupon.user_id, Coupon.fish_type, Coupon.value,
+        Coupon.used, Coupon.used_at, Coupon.used_by, Coupon.expires_at, Coupon.created_at,
+    ).order_by(Coupon.id)
+    if start:
+        stmt = stmt.where(Coupon.created_at >= start)
+    if end:
+        stmt = stmt.where(Coupon.created_at < end)
+    if store_id:
+        stmt = stmt.where(Coupon.used_by.in_(_store_usernames(store_id)))
+
+    return _export_response(stmt, format, "coupons")
+
+
+@router.get("/redemptions")
+async def export_redemptions(
+    admin_id: int,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    store_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """导出核销记录（按核销时间筛选，附核销门店）"""
+    await _require_admin(db, admin_id)
+
+    stmt = (
+        select(
+            Coupon.code, Coupon.fish_type, Coupon.value, Coupon.used_at,
+            Coupon.used_by, AdminUser.store_id, Coupon.user_id, Coupon.created_at,
+        )
+        .outerjoin(AdminUser, AdminUser.username == Coupon.used_by)
+        .where(Coupon.used == True)
+        .order_by(Coupon.used_at, Coupon.id)
+    )
+    if start:
+        stmt = stmt.where(Coupon.used_at >= start)
+    if end:
+        stmt = stmt.where(Coupon.used_at < end)
+    if store_id:
+        stmt = stmt.where(AdminUser.store_id == store_id)
+
+    return _export_response(stmt, format, "redemptions")
+
+
+@router.get("/feeding-records")
+async def export_feeding_records(
+    admin_id: int,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """导出喂食记录（按喂食时间筛选）"""
+    await _require_admin(db, admin_id)
+
+    stmt = select(
+        FeedingRecord.id, FeedingRecord.user_id, FeedingRecord.fish_id,
+        FeedingRecord.ip_address, FeedingRecord.user_agent, FeedingRecord.created_at,
+    ).order_by(FeedingRecord.id)
+    if start:
+        stmt = stmt.where(FeedingRecord.created_at >= start)
+    if end:
+        stmt = stmt.where(FeedingRecord.created_at < end)
+
+    return _export_response(stmt, format, "feeding_records")
@@ -2,7 +2,7 @@
 游戏相关 API
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from pydantic import BaseModel
@@ -11,23 +11,16 @@ from datetime import datetime, timedelta
 import secrets
 import random
 
-from app.database import get_db
+from app.database import get_db, get_read_db, run_after_commit
 from app.models.models import User, Fish, Coupon, FeedingRecord, FishType, FishStatus
+from app.routers.auth import resolve_token, materialize_guest, create_signed_token
+from app.services.outbox import record_event
+from app.services import catalogue, pond_engine, leaderboard, showcase, coupon_filter
+from app.services.pond_engine import FeedOutcome
+from app.services.game_rules import DAILY_FEED_LIMIT, today, reset_daily_feed, apply_feed, feed_events
 
 router = APIRouter()
 
-# 鱼类配置
-FISH_CONFIG = {
-    FishType.QINGJIANG: {"name": "清江鱼", "growth_time": 3, "value": 50},
-    FishType.LINGBO: {"name": "凌波鱼", "growth_time": 4, "value": 80},
-    FishType.BASHA: {"name": "巴沙鱼", "growth_time": 5, "value": 100},
-    FishType.JINMU: {"name": "金目鲈", "growth_time": 7, "value": 150},
-}
-
-# 每日饲料限制
-DAILY_FEED_LIMIT = 10
-
-
 # Pydantic 模型
 class FishResponse(BaseModel):
     id: int
@@ -57,6 +50,14 @@ class CouponResponse(BaseModel):
         from_attributes = True
 
 
+class FishTypeResponse(BaseModel):
+    fish_type: str
+    name: str
+    growth_time: int
+    value: int
+    is_active: bool
+
+
 class AddFishRequest(BaseModel):
     fish_type: str
 
@@ -80,22 +81,63 @@ class GameState(BaseModel):
     daily_feed_count: int
 
 
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    username: str
+    coupons: int
+
+
+class LeaderboardPage(BaseModel):
+    period: str
+    total: int
+    entries: List[LeaderboardEntry]
+
+
+class LeaderboardRank(BaseModel):
+    period: str
+    user_id: int
+    rank: Optional[int] = None
+    coupons: int
+
+
+@router.get("/catalogue", response_model=List[FishTypeResponse])
+async def get_catalogue():
+    """获取鱼类配置（内存快照，不查库）"""
+    return [
+        FishTypeResponse(
+            fish_type=spec.fish_type.value,
+            name=spec.name,
+            growth_time=spec.growth_time,
+            value=spec.value,
+            is_active=spec.is_active,
+        )
+        for spec in catalogue.snapshot().values()
+    ]
+
+
 @router.get("/state/{user_id}", response_model=GameState)
 async def get_game_state(
     user_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """获取用户游戏状态"""
-    # 检查并重置每日饲料
+    """获取用户游戏状态（只读，不进入写队列）"""
+    if pond_engine.engine is not None:
+        pond = await pond_engine.engine.get_state(user_id, db)
+        if pond is None:
+            raise HTTPException(status_code=404, detail="用户不存在")
+        return GameState(
+            fishes=[FishResponse.model_validate(f) for f in pond.fishes.values()],
+            coupons=[CouponResponse.model_validate(c) for c in pond.coupons.values()],
+            daily_feed_count=pond.user.daily_feed_count
+        )
+    
     user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    if user.last_feed_date != today:
-        user.daily_feed_count = DAILY_FEED_LIMIT
-        user.last_feed_date = today
-        await db.commit()
+    # 跨天的饲料重置在下次喂食时落库，这里只按重置后的值返回
+    daily_feed_count = user.daily_feed_count if user.last_feed_date == today() else DAILY_FEED_LIMIT
     
     # 获取鱼列表
     result = await db.execute(
@@ -112,15 +154,50 @@ async def get_game_state(
     return GameState(
         fishes=[FishResponse.model_validate(f) for f in fishes],
         coupons=[CouponResponse.model_validate(c) for c in coupons],
-        daily_feed_count=user.daily_feed_count
+        daily_feed_count=daily_feed_count
     )
 
 
+@router.get("/me/state", response_model=GameState)
+async def get_my_game_state(
+    token: str,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    按令牌获取游戏状态：只看令牌，游客令牌（没有 uid）直接返回初始状态、不查库。
+    游客落库时写接口已通过 X-Access-Token 下发带 uid 的新令牌；仍持旧令牌的客户端
+    下次写操作时按游客身份找回已落库的用户并再次下发新令牌。
+    """
+    identity = resolve_token(token)
+    if identity.user_id is None:
+        return GameState(fishes=[], coupons=[], daily_feed_count=DAILY_FEED_LIMIT)
+    return await get_game_state(identity.user_id, db)
+
+
+@router.post("/me/fish/add", response_model=FishResponse)
+async def add_my_fish(
+    token: str,
+    request: AddFishRequest,
+    response: Response,
+    db: AsyncSession = Depends(get_db, scope="function")
+):
+    """按令牌添加一条鱼；游客令牌时落库（旧令牌找回已落库的用户），并通过 X-Access-Token 下发新令牌"""
+    identity = resolve_token(token)
+    user_id = identity.user_id
+    if user_id is None:
+        user = await materialize_guest(db, identity.guest_id)
+        user_id = user.id
+        response.headers["X-Access-Token"] = create_signed_token(
+            user_id=user_id, guest_id=identity.guest_id
+        )
+    return await add_fish(user_id, request, db)
+
+
 @router.post("/fish/add/{user_id}", response_model=FishResponse)
 async def add_fish(
     user_id: int,
     request: AddFishRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db, scope="function")
 ):
     """添加一条新鱼"""
     try:
@@ -128,6 +205,9 @@ async def add_fish(
     except ValueError:
         raise HTTPException(status_code=400, detail="无效的鱼类型")
     
+    if not catalogue.get_spec(fish_type).is_active:
+        raise HTTPException(status_code=400, detail="该鱼类暂未开放")
+    
     user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
@@ -141,8 +221,11 @@ async def add_fish(
     )
     
     db.add(fish)
-    await db.commit()
-    await db.refresh(fish)
+    await db.flush()
+    record_event(db, "fish.added", user_id, fish_id=fish.id, fish_type=fish_type)
+    
+    if pond_engine.engine is not None:
+        run_after_commit(db, lambda: pond_engine.engine.fish_added(fish))
     
     return FishResponse.model_validate(fish)
 
@@ -151,9 +234,12 @@ async def add_fish(
 async def feed_fish(
     fish_id: int,
     request: Request,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db, scope="function")
 ):
     """喂食一条鱼"""
+    if pond_engine.engine is not None:
+        return await _feed_in_memory(fish_id, request, db)
+    
     fish = await db.get(Fish, fish_id)
     if not fish:
         raise HTTPException(status_code=404, detail="鱼不存在")
@@ -168,10 +254,7 @@ async def feed_fish(
     user = await db.get(User, fish.user_id)
     
     # 检查每日饲料限制
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    if user.last_feed_date != today:
-        user.daily_feed_count = DAILY_FEED_LIMIT
-        user.last_feed_date = today
+    reset_daily_feed(user)
     
     if user.daily_feed_count <= 0:
         return FeedResult(
@@ -181,18 +264,10 @@ async def feed_fish(
         )
     
     # 喂食
-    fish.hunger = min(100, fish.hunger + 30)
-    fish.growth += 10
-    user.daily_feed_count -= 1
-    
-    # 检查成长
-    config = FISH_CONFIG[fish.fish_type]
-    if fish.growth >= config["growth_time"] * 10 and fish.status == FishStatus.BABY:
-        fish.status = FishStatus.ADULT
-    
-    # 恢复饥饿状态
-    if fish.status == FishStatus.HUNGRY and fish.hunger > 30:
-        fish.status = FishStatus.ADULT if fish.growth >= config["growth_time"] * 10 else FishStatus.BABY
+    status_before = fish.status
+    apply_feed(fish, user)
+    for event_type, payload in feed_events(fish, user, status_before):
+        record_event(db, event_type, fish.user_id, **payload)
     
     # 记录喂食
     record = FeedingRecord(
@@ -203,9 +278,6 @@ async def feed_fish(
     )
     db.add(record)
     
-    await db.commit()
-    await db.refresh(fish)
-    
     return FeedResult(
         success=True,
         message="喂食成功！",
@@ -214,12 +286,47 @@ async def feed_fish(
     )
 
 
+async def _feed_in_memory(fish_id: int, request: Request, db: AsyncSession) -> FeedResult:
+    """内存引擎喂食（喂食记录随后批量写回）"""
+    outcome, fish, remaining = await pond_engine.engine.feed(
+        fish_id,
+        db,
+        ip_address=request.client.host if request.client else None,
+        user_agent=request.headers.get("user-agent"),
+    )
+    if outcome == FeedOutcome.NOT_FOUND:
+        raise HTTPException(status_code=404, detail="鱼不存在")
+    if outcome == FeedOutcome.DEAD:
+        return FeedResult(success=False, message="这条鱼已经死了", remaining_feed=0)
+    if outcome == FeedOutcome.NO_FEED:
+        return FeedResult(success=False, message="今日饲料已用完，明天再来吧！", remaining_feed=0)
+    return FeedResult(
+        success=True,
+        message="喂食成功！",
+        fish=FishResponse.model_validate(fish),
+        remaining_feed=remaining
+    )
+
+
 @router.post("/fish/harvest/{fish_id}", response_model=HarvestResult)
 async def harvest_fish(
     fish_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db, scope="function")
 ):
     """收获成年鱼，获得优惠券"""
+    if pond_engine.engine is None:
+        return await _harvest(fish_id, db)
+    
+    # 优惠券同步落库：先写回该用户内存中的脏数据，再在同一事务里收获
+    user_id = await pond_engine.engine.owner_of(fish_id, db)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="鱼不存在")
+    async with pond_engine.engine.synchronous(user_id, db):
+        return await _harvest(fish_id, db)
+
+
+async def _harvest(fish_id: int, db: AsyncSession) -> HarvestResult:
+    """收获逻辑（只 flush，由请求依赖或内存引擎提交）"""
     fish = await db.get(Fish, fish_id)
     if not fish:
         raise HTTPException(status_code=404, detail="鱼不存在")
@@ -230,15 +337,17 @@ async def harvest_fish(
             message="只能收获成年鱼"
         )
     
-    config = FISH_CONFIG[fish.fish_type]
+    spec = catalogue.get_spec(fish.fish_type)
     
     # 生成优惠券
+    now = datetime.utcnow()
     coupon = Coupon(
         user_id=fish.user_id,
         code=f"OF{secrets.token_hex(4).upper()}",
         fish_type=fish.fish_type,
-        value=config["value"],
-        expires_at=datetime.utcnow() + timedelta(days=7),
+        value=spec.value,
+        expires_at=now + timedelta(days=7),
+        created_at=now,
     )
     
     db.add(coupon)
@@ -249,12 +358,19 @@ async def harvest_fish(
     
     # 删除鱼
     await db.delete(fish)
-    await db.commit()
-    await db.refresh(coupon)
+    await db.flush()
+    record_event(
+        db, "fish.harvested", fish.user_id,
+        fish_id=fish_id, fish_type=fish.fish_type,
+        coupon_id=coupon.id, value=coupon.value, issued_at=now,
+    )
+    user_id, code = fish.user_id, coupon.code
+    run_after_commit(db, lambda: coupon_filter.add([code]))
+    run_after_commit(db, lambda: leaderboard.record_harvest(user_id, now))
     
     return HarvestResult(
         success=True,
-        message=f"获得 ¥{config['value']} 优惠券！",
+        message=f"获得 ¥{spec.value} 优惠券！",
         coupon=CouponResponse.model_validate(coupon)
     )
 
@@ -262,7 +378,7 @@ async def harvest_fish(
 @router.get("/coupons/{user_id}", response_model=List[CouponResponse])
 async def get_user_coupons(
     user_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """获取用户优惠券列表"""
     result = await db.execute(
@@ -271,3 +387,82 @@ async def get_user_coupons(
     coupons = result.scalars().all()
     
     return [CouponResponse.model_validate(c) for c in coupons]
+
+
+def _check_period(period: str):
+    if period not in leaderboard.PERIODS:
+        raise HTTPException(status_code=400, detail="period 只能是 all 或 week")
+
+
+@router.get("/leaderboard", response_model=LeaderboardPage)
+async def get_leaderboard(
+    period: str = "all",
+    offset: int = 0,
+    limit: int = 20,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """优惠券排行榜（all 总榜 / week 本周榜），按名次分页"""
+    _check_period(period)
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), 100)
+    top, total = await leaderboard.get_top(period, offset, limit)
+    
+    names = {}
+    if top:
+        # 只按主键取本页用户名
+        result = await db.execute(
+            select(User.id, User.username).where(User.id.in_([user_id for user_id, _ in top]))
+        )
+        names = dict(result.all())
+    
+    return LeaderboardPage(
+        period=period,
+        total=total,
+        entries=[
+            LeaderboardEntry(rank=offset + i + 1, user_id=user_id, username=names.get(user_id, ""), coupons=score)
+            for i, (user_id, score) in enumerate(top)
+        ],
+    )
+
+
+@router.get("/leaderboard/rank/{user_id}", response_model=LeaderboardRank)
+async def get_leaderboard_rank(user_id: int, period: str = "all"):
+    """查询用户在排行榜中的名次（不查库，未上榜时 rank 为空）"""
+    _check_period(period)
+    rank, score = await leaderboard.get_rank(period, user_id)
+    return LeaderboardRank(period=period, user_id=user_id, rank=rank, coupons=score)
+
+
+def _serve_snapshot(snapshot: Optional[showcase.Snapshot], request: Request) -> Response:
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="精选鱼塘不存在")
+    # 压缩与未压缩是不同的表示，ETag 各不相同
+    gzipped = "gzip" in request.headers.get("accept-encoding", "")
+    etag = snapshot.gzip_etag if gzipped else snapshot.etag
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={showcase.SHOWCASE_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+        "X-Showcase-Version": str(snapshot.version),
+    }
+    # If-None-Match 按弱比较（忽略 W/ 前缀，反向代理可能把 ETag 改成弱 ETag）
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    if if_none_match.strip() == "*" or etag in tags:
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(snapshot.gzipped, media_type="application/json", headers=headers)
+    return Response(snapshot.body, media_type="application/json", headers=headers)
+
+
+@router.get("/showcase")
+async def get_showcase(request: Request):
+    """精选鱼塘列表（预构建的快照，不查库）"""
+    return _serve_snapshot(showcase.current(), request)
+
+
+@router.get("/showcase/{user_id}")
+async def get_showcase_pond(user_id: int, request: Request):
+    """单个精选鱼塘（预构建的快照，不查库）"""
+    return _serve_snapshot(showcase.pond(user_id), request)
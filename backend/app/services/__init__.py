@@ -0,0 +1 @@
+# 服务初始化
@@ -0,0 +1,208 @@
+"""
+不活跃游客冷归档
+
+挑选长期不活跃的游客（无手机号/openid、优惠券全部未核销且已过期），
+把用户及其鱼、喂食记录、优惠券、游客身份压缩成 archived_users 中的一行，
+再分批从热表删除。用户回归时可通过 restore_user 原样恢复（保留原 id）。
+有核销记录的游客不归档，核销数据始终留在 coupons 表中（导出、统计和汇总重建都依赖它）。
+
+命令行：
+    python -m app.services.archival --days 180 --batch 500
+"""
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, exists, or_
+from sqlalchemy.types import DateTime, Enum
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+import argparse
+import asyncio
+import enum
+import json
+import zlib
+
+from app.database import write_session, run_after_commit
+from app.models.models import User, Fish, Coupon, FeedingRecord, GuestIdentity, ArchivedUser
+from app.services import coupon_filter
+
+# 归档内容中各表的键及恢复顺序（先父后子）
+_TABLES = [
+    ("users", User),
+    ("guest_identities", GuestIdentity),
+    ("fishes", Fish),
+    ("feeding_records", FeedingRecord),
+    ("coupons", Coupon),
+]
+
+
+def _row_to_dict(obj) -> dict:
+    data = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, enum.Enum):
+            value = value.value
+        data[column.key] = value
+    return data
+
+
+def _dict_to_row(model, data: dict):
+    values = {}
+    for column in model.__table__.columns:
+        if column.key == "txid":
+            # 由数据库按恢复事务重新填写，其他 worker 的券码过滤器据此增量同步
+            continue
+        value = data.get(column.key)
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, Enum) and column.type.enum_class:
+            value = column.type.enum_class(value)
+        values[column.key] = value
+    return model(**values)
+
+
+def _inactive_conditions(cutoff: datetime) -> tuple:
+    """不活跃游客的判定条件"""
+    now = datetime.utcnow()
+    return (
+        User.phone.is_(None),
+        User.openid.is_(None),
+        User.updated_at < cutoff,
+        ~exists().where(Fish.user_id == User.id, Fish.updated_at >= cutoff),
+        # 只归档过期未用的优惠券：有已核销或仍有效的券的用户留在热表
+        ~exists().where(
+            Coupon.user_id == User.id,
+            or_(Coupon.used == True, Coupon.expires_at >= now),
+        ),
+    )
+
+
+def _inactive_guests_query(cutoff: datetime, after_id: int, limit: int):
+    """不活跃游客（按 id 键集分页）；PostgreSQL 上锁住选中的用户，正在写入的用户跳过"""
+    return (
+        select(User)
+        .where(User.id > after_id, *_inactive_conditions(cutoff))
+        .order_by(User.id)
+        .limit(limit)
+        .with_for_update(of=User, skip_locked=True)
+    )
+
+
+async def _archive_batch(db: AsyncSession, users: list, cutoff: datetime) -> Tuple[int, int]:
+    """
+    归档一批用户并从热表删除，返回 (归档用户数, 归档行数)
+
+    子表行读取时加锁（PostgreSQL），之后按同样的条件重新检查：挑选之后才提交的写入
+    （新鱼、喂食、发券）会让用户留在热表，归档和删除的都只是确认仍不活跃的用户。
+    SQLite 上整批在写连接上执行，期间没有其他写入。
+    """
+    user_ids = [u.id for u in users]
+    children = []
+    for name, model in _TABLES[1:]:
+        result = await db.execute(
+            select(model).where(model.user_id.in_(user_ids)).with_for_update()
+        )
+        children.append((name, list(result.scalars())))
+
+    result = await db.execute(
+        select(User.id).where(User.id.in_(user_ids), *_inactive_conditions(cutoff))
+    )
+    still_inactive = set(result.scalars())
+    users = [u for u in users if u.id in still_inactive]
+    if not users:
+        return 0, 0
+    user_ids = [u.id for u in users]
+
+    rows = {uid: {name: [] for name, _ in _TABLES} for uid in user_ids}
+    for user in users:
+        rows[user.id]["users"].append(_row_to_dict(user))
+    for name, objs in children:
+        for obj in objs:
+            if obj.user_id in still_inactive:
+                rows[obj.user_id][name].append(_row_to_dict(obj))
+
+    total = 0
+    for user in users:
+        data = rows[user.id]
+        count = sum(len(v) for v in data.values())
+        total += count
+        db.add(ArchivedUser(
+            user_id=user.id,
+            payload=zlib.compress(json.dumps(data, ensure_ascii=False).encode()),
+            row_count=count,
+            last_active_at=user.updated_at,
+        ))
+
+    # 先删子表再删用户
+    for _, model in reversed(_TABLES[1:]):
+        await db.execute(delete(model).where(model.user_id.in_(user_ids)))
+    await db.execute(delete(User).where(User.id.in_(user_ids)))
+    return len(users), total
+
+
+async def archive_inactive_guests(
+    inactive_days: int = 180,
+    batch_size: int = 500,
+    max_batches: Optional[int] = None,
+) -> dict:
+    """分批归档不活跃游客，每批独立提交（SQLite 上在写连接上执行）"""
+    cutoff = datetime.utcnow() - timedelta(days=inactive_days)
+    after_id = 0
+    batches = users_archived = rows_archived = 0
+
+    while max_batches is None or batches < max_batches:
+        async with write_session() as db:
+            result = await db.execute(_inactive_guests_query(cutoff, after_id, batch_size))
+            users = list(result.scalars())
+            if not users:
+                break
+            after_id = users[-1].id
+            archived, rows = await _archive_batch(db, users, cutoff)
+            await db.commit()
+        batches += 1
+        users_archived += archived
+        rows_archived += rows
+
+    return {
+        "batches": batches,
+        "users_archived": users_archived,
+        "rows_archived": rows_archived,
+        "last_user_id": after_id,
+    }
+
+
+async def restore_user(db: AsyncSession, user_id: int) -> Optional[int]:
+    """从归档恢复用户（调用方负责提交），返回恢复的行数；没有归档时返回 None"""
+    archived = await db.get(ArchivedUser, user_id)
+    if not archived:
+        return None
+
+    data = json.loads(zlib.decompress(archived.payload))
+    for name, model in _TABLES:
+        for row in data.get(name, []):
+            db.add(_dict_to_row(model, row))
+        # 按父子顺序逐表写入，满足外键约束
+        await db.flush()
+    # 归档的券码都已过期；其他 worker 的过滤器在 PostgreSQL 上由增量同步补上（按 txid），
+    # SQLite 上保留原 id，在下次全量重建时补上
+    codes = [row["code"] for row in data.get("coupons", [])]
+    run_after_commit(db, lambda: coupon_filter.add(codes))
+
+    await db.delete(archived)
+    return archived.row_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="归档长期不活跃的游客")
+    parser.add_argument("--days", type=int, default=180, help="多少天无活动视为不活跃")
+    parser.add_argument("--batch", type=int, default=500, help="每批处理的用户数")
+    parser.add_argument("--max-batches", type=int, default=None, help="最多处理批数")
+    args = parser.parse_args()
+
+    summary = asyncio.run(archive_inactive_guests(args.days, args.batch, args.max_batches))
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+批量发放活动（如“上周玩过的用户每人送一条金目鲈”）
+
+活动创建后由后台任务分批执行，每批在一个事务里：
+1. 锁定活动行（PostgreSQL 上 FOR UPDATE SKIP LOCKED，多 worker 时同一活动只有一个在跑）
+2. 按用户 id 游标（keyset）取下一批符合条件的用户，不用 OFFSET
+3. 用多行 INSERT 写入鱼或优惠券（优惠券码整批生成、一次查询排除已存在的码），并追加对应事件
+4. 推进游标和已发放数
+
+游标与发放在同一事务提交，进程崩溃后从上次提交的游标继续，不会重复发放。
+发放的优惠券带 campaign_id，不计入用户的 total_coupons_earned 和周榜（不影响排行榜），但计入优惠券发放汇总。
+
+命令行（在 worker 之外执行或补跑）：
+    python -m app.services.campaigns --run 3
+"""
+
+from datetime import datetime, timedelta
+from typing import List
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import secrets
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, func
+from sqlalchemy.exc import IntegrityError
+
+from app.database import write_session, read_session_maker, run_after_commit
+from app.models.models import Campaign, User, Fish, Coupon, FishStatus
+from app.services import catalogue, coupon_filter, metrics, pond_engine
+from app.services.outbox import event_row, record_events
+from app.services.startup import register_background
+
+logger = logging.getLogger("app.campaigns")
+
+# 每批发放的用户数（多行 INSERT 的行数）
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "1000"))
+# 单批因券码冲突回滚后的最多重试次数
+CAMPAIGN_BATCH_RETRIES = 3
+# 没有进行中的活动时的轮询间隔（秒）
+CAMPAIGN_POLL_SECONDS = float(os.getenv("CAMPAIGN_POLL_SECONDS", "5"))
+
+GRANT_TYPES = ("fish", "coupon")
+ACTIVE_STATUSES = ("pending", "running")
+
+
+def segment_filter(campaign: Campaign) -> list:
+    """活动的用户筛选条件"""
+    conditions = []
+    if campaign.active_since:
+        conditions.append(User.last_feed_date >= campaign.active_since)
+    if campaign.registered_before:
+        conditions.append(User.created_at < campaign.registered_before)
+    return conditions
+
+
+async def count_segment(db: AsyncSession, campaign: Campaign) -> int:
+    result = await db.execute(select(func.count(User.id)).where(*segment_filter(campaign)))
+    return result.scalar_one()
+
+
+async def _allocate_codes(db: AsyncSession, n: int) -> List[str]:
+    """整批生成不重复的券码，每轮一次查询排除已存在的码"""
+    codes = set()
+    while len(codes) < n:
+        candidates = {f"OF{secrets.token_hex(4).upper()}" for _ in range(n - len(codes))} - codes
+        result = await db.execute(select(Coupon.code).where(Coupon.code.in_(candidates)))
+        codes |= candidates - set(result.scalars())
+    return list(codes)
+
+
+async def _grant_fish(db: AsyncSession, campaign: Campaign, user_ids: List[int], now: datetime):
+    rows = [
+        {
+            "user_id": user_id,
+            "fish_type": campaign.fish_type,
+            "status": FishStatus.BABY,
+            "hunger": 100.0,
+            "health": 100.0,
+            "growth": 0.0,
+            "pos_x": random.uniform(10, 90),
+            "pos_y": random.uniform(20, 80),
+            "created_at": now,
+            "updated_at": now,
+        }
+        for user_id in user_ids
+    ]
+    result = await db.execute(
+        insert(Fish).returning(
+            Fish.id, Fish.user_id, Fish.fish_type, Fish.status, Fish.hunger, Fish.health,
+            Fish.growth, Fish.pos_x, Fish.pos_y, Fish.created_at,
+        ),
+        rows,
+    )
+    fishes = result.all()
+    await record_events(db, [
+        event_row("fish.added", f.user_id, {"fish_id": f.id, "fish_type": f.fish_type, "campaign_id": campaign.id}, now)
+        for f in fishes
+    ])
+    if pond_engine.engine is not None:
+        def add_to_ponds():
+            for fish in fishes:
+                pond_engine.engine.fish_added(fish)
+        run_after_commit(db, add_to_ponds)
+
+
+async def _grant_coupons(db: AsyncSession, campaign: Campaign, user_ids: List[int], now: datetime):
+    value = campaign.coupon_value or catalogue.get_spec(campaign.fish_type).value
+    codes = await _allocate_codes(db, len(user_ids))
+    rows = [
+        {
+            "user_id": user_id,
+            "code": code,
+            "fish_type": campaign.fish_type,
+            "value": value,
+            "used": False,
+            "expires_at": now + timedelta(days=campaign.coupon_days),
+            "created_at": now,
+            "campaign_id": campaign.id,
+        }
+        for user_id, code in zip(user_ids, codes)
+    ]
+    result = await db.execute(
+        insert(Coupon).returning(
+            Coupon.id, Coupon.user_id, Coupon.code, Coupon.fish_type, Coupon.value,
+            Coupon.used, Coupon.expires_at, Coupon.created_at,
+        ),
+        rows,
+    )
+    coupons = result.all()
+    await record_events(db, [
+        event_row(
+            "coupon.granted", c.user_id,
+            {"coupon_id": c.id, "fish_type": c.fish_type, "value": c.value, "issued_at": now, "campaign_id": campaign.id},
+            now,
+        )
+        for c in coupons
+    ])
+    run_after_commit(db, lambda: coupon_filter.add(codes))
+    if pond_engine.engine is not None:
+        def add_to_ponds():
+            for coupon in coupons:
+                pond_engine.engine.coupon_added(coupon.user_id, coupon)
+        run_after_commit(db, add_to_ponds)
+
+
+async def run_batch(campaign_id: int, batch_size: int = CAMPAIGN_BATCH_SIZE) -> bool:
+    """执行一批，返回是否还有剩余"""
+    async with write_session() as db:
+        result = await db.execute(
+            select(Campaign).where(Campaign.id == campaign_id).with_for_update(skip_locked=True)
+        )
+        campaign = result.scalar_one_or_none()
+        if campaign is None or campaign.status not in ACTIVE_STATUSES:
+            # 不存在、已结束，或其他 worker 正在执行
+            return False
+
+        result = await db.execute(
+            select(User.id)
+            .where(User.id > campaign.last_user_id, *segment_filter(campaign))
+            .order_by(User.id)
+            .limit(batch_size)
+        )
+        user_ids = list(result.scalars())
+        now = datetime.utcnow()
+        if not user_ids:
+            campaign.status = "done"
+            campaign.finished_at = now
+            await db.commit()
+            logger.info("活动 %s 发放完成，共 %s 人", campaign_id, campaign.granted_count)
+            return False
+
+        if campaign.grant_type == "fish":
+            await _grant_fish(db, campaign, user_ids, now)
+        else:
+            await _grant_coupons(db, campaign, user_ids, now)
+
+        campaign.status = "running"
+        campaign.last_user_id = user_ids[-1]
+        campaign.granted_count += len(user_ids)
+        granted, target = campaign.granted_count, campaign.target_count
+        await db.commit()
+
+    labels = {"campaign": str(campaign_id)}
+    metrics.inc("campaign_grants_total", len(user_ids), labels, help="批量活动已发放数")
+    metrics.set_gauge(
+        "campaign_progress", granted / target if target else 1.0, labels, help="批量活动进度（已发放/目标人数）"
+    )
+    return True
+
+
+async def run_campaign(campaign_id: int, batch_size: int = CAMPAIGN_BATCH_SIZE) -> int:
+    """执行到结束，返回本次执行的批数"""
+    batches = 0
+    retries = 0
+    while True:
+        try:
+            more = await run_batch(campaign_id, batch_size)
+        except IntegrityError:
+            # 券码与同时发放的码撞上，整批回滚后重试
+            retries += 1
+            if retries > CAMPAIGN_BATCH_RETRIES:
+                raise
+            logger.warning("活动 %s 批次冲突，重试", campaign_id)
+            continue
+        retries = 0
+        if not more:
+            return batches
+        batches += 1
+        # 让出事件循环，避免长时间占用写连接
+        await asyncio.sleep(0)
+
+
+async def _active_campaigns() -> List[int]:
+    async with read_session_maker() as db:
+        result = await db.execute(
+            select(Campaign.id).where(Campaign.status.in_(ACTIVE_STATUSES)).order_by(Campaign.id)
+        )
+        return list(result.scalars())
+
+
+@register_background
+async def run_campaigns():
+    """执行待发放和中断的活动（重启后从游标继续）"""
+    while True:
+        try:
+            for campaign_id in await _active_campaigns():
+                await run_campaign(campaign_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("批量发放失败")
+        await asyncio.sleep(CAMPAIGN_POLL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="执行批量发放活动（可重复执行，从上次进度继续）")
+    parser.add_argument("--run", type=int, required=True, help="活动 id")
+    parser.add_argument("--batch", type=int, default=CAMPAIGN_BATCH_SIZE, help="每批发放的用户数")
+    args = parser.parse_args()
+
+    async def run():
+        # 未指定金额的优惠券取鱼类配置中的价值
+        await catalogue.reload(force=True)
+        batches = await run_campaign(args.run, args.batch)
+        async with read_session_maker() as db:
+            campaign = await db.get(Campaign, args.run)
+            return {
+                "campaign_id": args.run,
+                "batches": batches,
+                "status": campaign.status if campaign else None,
+                "granted_count": campaign.granted_count if campaign else 0,
+            }
+
+    print(json.dumps(asyncio.run(run()), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
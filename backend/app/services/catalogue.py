@@ -0,0 +1,145 @@
+"""
+鱼类配置目录
+
+配置存放在 fish_catalogue 表中，每个 worker 持有一份不可变的内存快照，
+喂食/收获路径上的查找只是一次字典访问，不产生额外查询。
+配置变更后通过 Redis pub/sub 通知各 worker 立即重载；
+未配置 Redis 时按 CATALOGUE_POLL_SECONDS 轮询版本（行数 + 最后更新时间）。
+重载时先构建完整的新快照再整体替换引用，请求不会看到半更新的状态。
+"""
+
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+import asyncio
+import logging
+import os
+
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+
+from app.database import async_session_maker
+from app.models.models import FishCatalogue, FishType
+from app.services.redis_client import get_redis
+from app.services.startup import register_warmup, register_background
+
+logger = logging.getLogger("app.catalogue")
+
+# 版本轮询间隔（秒）
+CATALOGUE_POLL_SECONDS = float(os.getenv("CATALOGUE_POLL_SECONDS", "30"))
+# 配置变更通知频道
+CATALOGUE_CHANNEL = "fish_catalogue:changed"
+
+# 默认鱼类配置（首次启动时写入数据库）
+FISH_CONFIG = {
+    FishType.QINGJIANG: {"name": "清江鱼", "growth_time": 3, "value": 50},
+    FishType.LINGBO: {"name": "凌波鱼", "growth_time": 4, "value": 80},
+    FishType.BASHA: {"name": "巴沙鱼", "growth_time": 5, "value": 100},
+    FishType.JINMU: {"name": "金目鲈", "growth_time": 7, "value": 150},
+}
+
+
+@dataclass(frozen=True)
+class FishSpec:
+    fish_type: FishType
+    name: str
+    growth_time: int
+    value: int
+    is_active: bool = True
+
+
+def _build(specs) -> Mapping[FishType, FishSpec]:
+    return MappingProxyType({spec.fish_type: spec for spec in specs})
+
+
+_snapshot: Mapping[FishType, FishSpec] = _build(
+    FishSpec(fish_type=t, **c) for t, c in FISH_CONFIG.items()
+)
+_version: Optional[Tuple] = None
+
+
+def get_spec(fish_type: FishType) -> FishSpec:
+    """查找鱼类配置（纯内存）"""
+    return _snapshot[fish_type]
+
+
+def snapshot() -> Mapping[FishType, FishSpec]:
+    """当前完整配置快照（只读）"""
+    return _snapshot
+
+
+async def reload(force: bool = False) -> bool:
+    """版本变化时重新加载，返回是否发生了替换"""
+    global _snapshot, _version
+    async with async_session_maker() as db:
+        result = await db.execute(
+            select(func.count(), func.max(FishCatalogue.updated_at)).select_from(FishCatalogue)
+        )
+        version = tuple(result.one())
+        if version == _version and not force:
+            return False
+        result = await db.execute(select(FishCatalogue))
+        rows = result.scalars().all()
+
+    specs = {t: FishSpec(fish_type=t, **c) for t, c in FISH_CONFIG.items()}
+    for row in rows:
+        specs[row.fish_type] = FishSpec(
+            fish_type=row.fish_type,
+            name=row.name,
+            growth_time=row.growth_time,
+            value=row.value,
+            is_active=bool(row.is_active),
+        )
+    _snapshot = _build(specs.values())
+    _version = version
+    return True
+
+
+@register_warmup
+async def load_catalogue():
+    """启动时补齐缺失的默认配置并加载快照"""
+    async with async_session_maker() as db:
+        result = await db.execute(select(FishCatalogue.fish_type))
+        existing = set(result.scalars())
+        missing = [t for t in FISH_CONFIG if t not in existing]
+        if missing:
+            db.add_all(FishCatalogue(fish_type=t, **FISH_CONFIG[t]) for t in missing)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # 其他 worker 已同时写入
+                await db.rollback()
+    await reload(force=True)
+
+
+async def publish_change():
+    """通知所有 worker 重载（本 worker 立即重载）"""
+    await reload()
+    redis = get_redis()
+    if redis is not None:
+        await redis.publish(CATALOGUE_CHANNEL, "reload")
+
+
+@register_background
+async def watch_catalogue():
+    """订阅变更通知；没有 Redis 或订阅断开时退回轮询"""
+    while True:
+        redis = get_redis()
+        try:
+            if redis is None:
+                await asyncio.sleep(CATALOGUE_POLL_SECONDS)
+                await reload()
+                continue
+            async with redis.pubsub() as pubsub:
+                await pubsub.subscribe(CATALOGUE_CHANNEL)
+                while True:
+                    await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=CATALOGUE_POLL_SECONDS
+                    )
+                    # 超时也检查一次版本，防止漏掉通知
+                    await reload()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("鱼类配置重载失败")
+            await asyncio.sleep(CATALOGUE_POLL_SECONDS)
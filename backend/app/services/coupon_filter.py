@@ -0,0 +1,239 @@
+"""
+优惠券码布隆过滤器（负缓存）
+
+每个 worker 在内存中维护一个覆盖全部已发放券码的布隆过滤器，查询/核销前先查过滤器：
+不在过滤器里的券码一定不存在，直接拒绝、不查库；在过滤器里的才去数据库确认。
+暴力猜码和店员输错码因此不再打到数据库。
+
+过滤器只增不删（归档删除的券码会留在过滤器里，只是多一次查库）：
+- 启动时从 coupons 表按 id 分批全量构建，容量取实际券码数的 2 倍（不少于 COUPON_FILTER_MIN_CAPACITY），
+  之后每 COUPON_FILTER_REBUILD_SECONDS 秒或券码数超过容量时重建（扩容）
+- 本 worker 发放的券码在提交后立即加入
+- 其他 worker 发放的券码由后台每 COUPON_FILTER_SYNC_SECONDS 秒增量同步：
+  SQLite 单写连接按 id 顺序提交，游标为券码 id；PostgreSQL 的 id 不按提交顺序可见，
+  游标改为 (txid, id)（与发件箱中继相同），只读取 txid 小于当前快照 xmin 的行，
+  即所在事务已结束、之后不会再有更小游标的行出现
+- 构建完成前不做拒绝，全部照常查库
+
+指标：coupon_filter_rejected_total（直接拒绝）、coupon_filter_false_positives_total
+（过滤器放行但库里没有）、coupon_filter_false_positive_rate（实测假阳性率）、
+coupon_filter_estimated_fp_rate（按当前填充度估算的假阳性率）。
+"""
+
+from typing import Iterable, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import math
+import os
+
+from sqlalchemy import select, func, text, tuple_, literal, BigInteger, Integer
+
+from app.database import engine, read_session_maker
+from app.models.models import Coupon
+from app.services import metrics
+from app.services.startup import register_warmup, register_background
+
+logger = logging.getLogger("app.coupon_filter")
+
+# 目标假阳性率
+COUPON_FILTER_FP_RATE = float(os.getenv("COUPON_FILTER_FP_RATE", "0.001"))
+# 最小容量（券码数）
+COUPON_FILTER_MIN_CAPACITY = int(os.getenv("COUPON_FILTER_MIN_CAPACITY", "100000"))
+# 增量同步间隔、全量重建间隔（秒）
+COUPON_FILTER_SYNC_SECONDS = float(os.getenv("COUPON_FILTER_SYNC_SECONDS", "1"))
+COUPON_FILTER_REBUILD_SECONDS = float(os.getenv("COUPON_FILTER_REBUILD_SECONDS", "3600"))
+
+_BATCH_SIZE = 10000
+
+
+class BloomFilter:
+    """按容量和目标假阳性率确定位数 m 与哈希个数 k，k 个位置由双重哈希生成"""
+
+    def __init__(self, capacity: int, fp_rate: float = COUPON_FILTER_FP_RATE):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-self.capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, code: str):
+        digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, code: str):
+        for p in self._positions(code):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, code: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(code))
+
+    def estimated_fp_rate(self) -> float:
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+_filter: Optional[BloomFilter] = None
+# 重建期间新发放的券码同时写入正在构建的过滤器
+_building: Optional[BloomFilter] = None
+# 增量同步游标 (txid, id)；SQLite 上 txid 恒为 0
+_cursor: Tuple[int, int] = (0, 0)
+
+
+def _normalize(code: str) -> str:
+    return code.strip().upper()
+
+
+def might_exist(code: str) -> bool:
+    """False 表示券码一定不存在；过滤器尚未构建时总是 True"""
+    if _filter is None:
+        return True
+    if _normalize(code) in _filter:
+        return True
+    metrics.inc("coupon_filter_rejected_total", help="布隆过滤器直接拒绝的券码查询数")
+    _update_fp_rate()
+    return False
+
+
+def record_false_positive():
+    """过滤器放行但数据库中不存在时调用"""
+    metrics.inc("coupon_filter_false_positives_total", help="布隆过滤器放行但不存在的券码数")
+    _update_fp_rate()
+
+
+def _update_fp_rate():
+    false_positives = metrics.get("coupon_filter_false_positives_total")
+    negatives = false_positives + metrics.get("coupon_filter_rejected_total")
+    if negatives:
+        metrics.set_gauge(
+            "coupon_filter_false_positive_rate", false_positives / negatives,
+            help="不存在的券码中被过滤器放行的比例",
+        )
+
+
+def add(codes: Iterable[str]):
+    """加入新发放的券码（提交后调用）"""
+    codes = [_normalize(code) for code in codes]
+    for target in (_filter, _building):
+        if target is not None:
+            for code in codes:
+                target.add(code)
+    if _filter is not None:
+        _report()
+
+
+def _report():
+    metrics.set_gauge("coupon_filter_codes", _filter.count, help="布隆过滤器中的券码数")
+    metrics.set_gauge("coupon_filter_bytes", len(_filter.bits), help="布隆过滤器占用字节数")
+    metrics.set_gauge(
+        "coupon_filter_estimated_fp_rate", _filter.estimated_fp_rate(),
+        help="按填充度估算的布隆过滤器假阳性率",
+    )
+
+
+def _postgres() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+async def _snapshot_xmin(db) -> int:
+    """当前快照 xmin：小于它的事务都已提交或回滚"""
+    result = await db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint"))
+    return result.scalar_one()
+
+
+async def rebuild() -> int:
+    """从数据库全量构建，返回券码数"""
+    global _filter, _building, _cursor
+    async with read_session_maker() as db:
+        # 扫描前取 xmin：在此之前结束的事务写入的券码扫描一定能读到，其余的交给增量同步
+        xmin = await _snapshot_xmin(db) if _postgres() else 0
+        result = await db.execute(select(func.count()).select_from(Coupon))
+        _building = BloomFilter(max(COUPON_FILTER_MIN_CAPACITY, result.scalar_one() * 2))
+        try:
+            last_id = 0
+            while True:
+                result = await db.execute(
+                    select(Coupon.id, Coupon.code)
+                    .where(Coupon.id > last_id)
+                    .order_by(Coupon.id)
+                    .limit(_BATCH_SIZE)
+                )
+                rows = result.all()
+                if not rows:
+                    break
+                for row in rows:
+                    _building.add(row.code)
+                last_id = rows[-1].id
+            # PostgreSQL 上游标 (xmin, 0)：下一轮从 txid >= xmin 的行开始补读
+            _filter, _cursor = _building, (xmin, 0) if xmin else (0, last_id)
+        finally:
+            _building = None
+    _report()
+    return _filter.count
+
+
+async def sync() -> int:
+    """按游标增量加入其他 worker 新发放的券码，返回新增数"""
+    global _cursor
+    if _filter is None:
+        return 0
+    async with read_session_maker() as db:
+        if _postgres():
+            xmin = await _snapshot_xmin(db)
+            query = (
+                select(Coupon.id, Coupon.code, Coupon.txid)
+                .where(
+                    Coupon.txid < xmin,
+                    tuple_(Coupon.txid, Coupon.id)
+                    > tuple_(literal(_cursor[0], BigInteger), literal(_cursor[1], Integer)),
+                )
+                .order_by(Coupon.txid, Coupon.id)
+            )
+        else:
+            query = (
+                select(Coupon.id, Coupon.code, literal(0).label("txid"))
+                .where(Coupon.id > _cursor[1])
+                .order_by(Coupon.id)
+            )
+        result = await db.execute(query.limit(_BATCH_SIZE))
+        rows = result.all()
+    added = 0
+    for row in rows:
+        if row.code not in _filter:
+            _filter.add(row.code)
+            added += 1
+    if rows:
+        _cursor = (rows[-1].txid, rows[-1].id)
+    if added:
+        _report()
+    return added
+
+
+@register_warmup
+async def build_coupon_filter():
+    await rebuild()
+
+
+@register_background
+async def maintain_coupon_filter():
+    """增量同步；到期或超出容量时全量重建"""
+    loop = asyncio.get_running_loop()
+    last_rebuild = loop.time()
+    while True:
+        await asyncio.sleep(COUPON_FILTER_SYNC_SECONDS)
+        try:
+            if (
+                _filter is None
+                or _filter.count > _filter.capacity
+                or loop.time() - last_rebuild > COUPON_FILTER_REBUILD_SECONDS
+            ):
+                await rebuild()
+                last_rebuild = loop.time()
+            else:
+                await sync()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("券码过滤器同步失败")
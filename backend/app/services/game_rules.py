@@ -0,0 +1,58 @@
+"""
+养鱼规则（数据库路径和内存引擎共用）
+
+函数只读写对象属性，ORM 模型和内存状态对象都可以传入。
+"""
+
+from datetime import datetime
+from typing import List, Tuple
+
+from app.models.models import FishStatus
+from app.services import catalogue
+
+# 每日饲料限制
+DAILY_FEED_LIMIT = 10
+
+
+def today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def reset_daily_feed(user) -> bool:
+    """跨天重置每日饲料，返回是否发生了重置"""
+    day = today()
+    if user.last_feed_date == day:
+        return False
+    user.daily_feed_count = DAILY_FEED_LIMIT
+    user.last_feed_date = day
+    return True
+
+
+def apply_feed(fish, user):
+    """喂食一次：更新饥饿度、成长值和状态，扣减饲料（调用方先检查余量）"""
+    fish.hunger = min(100, fish.hunger + 30)
+    fish.growth += 10
+    user.daily_feed_count -= 1
+
+    # 检查成长
+    spec = catalogue.get_spec(fish.fish_type)
+    if fish.growth >= spec.growth_time * 10 and fish.status == FishStatus.BABY:
+        fish.status = FishStatus.ADULT
+
+    # 恢复饥饿状态
+    if fish.status == FishStatus.HUNGRY and fish.hunger > 30:
+        fish.status = FishStatus.ADULT if fish.growth >= spec.growth_time * 10 else FishStatus.BABY
+
+
+def feed_events(fish, user, status_before) -> List[Tuple[str, dict]]:
+    """一次喂食产生的事件 (类型, 内容)"""
+    events = [("fish.fed", {
+        "fish_id": fish.id,
+        "fish_type": fish.fish_type,
+        "growth": fish.growth,
+        "hunger": fish.hunger,
+        "remaining_feed": user.daily_feed_count,
+    })]
+    if status_before == FishStatus.BABY and fish.status == FishStatus.ADULT:
+        events.append(("fish.grown", {"fish_id": fish.id, "fish_type": fish.fish_type}))
+    return events
@@ -0,0 +1,313 @@
+"""
+Idempotency-Key 支持（喂食、收获、核销等会被弱网客户端重试的写接口）
+
+客户端对同一次操作的所有重试携带相同的 Idempotency-Key 请求头：
+
+- 第一次请求正常执行（事务在响应发出前提交），响应按键缓存 IDEMPOTENCY_TTL_SECONDS 秒：
+  进程内 LRU（最多 IDEMPOTENCY_CACHE_SIZE 条），配置了 REDIS_URL 时同时写入 Redis 供其他 worker 使用
+- 之后的重试直接回放缓存的状态码、响应头和响应体（带 Idempotent-Replayed: true），不进路由、不查库
+- 并发的重复请求合并：本进程内等待第一个请求的结果；跨 worker 时用 Redis 锁，
+  等待 IDEMPOTENCY_LOCK_SECONDS 秒仍未完成返回 409
+- 键按调用方（Authorization 请求头或 token 查询参数）和路径隔离，不同用户碰巧用了相同的键互不影响；
+  同一调用方在同一路径上用同一个键发送不同的请求体返回 422
+- 5xx 以及 401/403/408/409/429 不缓存，客户端可以用同一个键重试
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qs
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+from app.services import metrics
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger("app.idempotency")
+
+# 响应缓存时长（秒）
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# 进程内最多缓存的响应数
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# 跨 worker 处理锁的时长（秒），也是重复请求的最长等待时间
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "30"))
+
+MAX_KEY_LENGTH = 255
+
+_KEY_PREFIX = "idempotency:"
+_NOT_CACHED = {401, 403, 408, 409, 429}
+_POLL_SECONDS = 0.05
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+    expires_at: float
+
+    def dumps(self) -> str:
+        return json.dumps({
+            "fingerprint": self.fingerprint,
+            "status": self.status,
+            "headers": self.headers,
+            "body": self.body.decode("latin-1"),
+            "expires_at": self.expires_at,
+        })
+
+    @classmethod
+    def loads(cls, raw: str) -> "StoredResponse":
+        data = json.loads(raw)
+        return cls(
+            fingerprint=data["fingerprint"],
+            status=data["status"],
+            headers=[tuple(h) for h in data["headers"]],
+            body=data["body"].encode("latin-1"),
+            expires_at=data["expires_at"],
+        )
+
+
+class ResponseCache:
+    """进程内 LRU，按过期时间惰性淘汰"""
+
+    def __init__(self, capacity: int = IDEMPOTENCY_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries: "OrderedDict[str, StoredResponse]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        stored = self.entries.get(key)
+        if stored is None:
+            return None
+        if stored.expires_at <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return stored
+
+    def put(self, key: str, stored: StoredResponse):
+        self.entries[key] = stored
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+_cache = ResponseCache()
+# 本进程正在处理的键 → 结果（处理失败或不缓存时为 None）
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+async def _send_json(send, status: int, detail: str, code: Optional[int] = None):
+    body = json.dumps({"error": detail, "code": code or status}, ensure_ascii=False).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _replay(send, stored: StoredResponse):
+    headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in stored.headers]
+    headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": stored.status, "headers": headers})
+    await send({"type": "http.response.body", "body": stored.body})
+
+
+async def _lookup(key: str) -> Optional[StoredResponse]:
+    stored = _cache.get(key)
+    if stored is not None:
+        return stored
+    redis = get_redis()
+    if redis is None:
+        return None
+    try:
+        raw = await redis.get(_KEY_PREFIX + key)
+    except Exception:
+        # Redis 不可用时退化为只用进程内缓存
+        logger.exception("读取幂等响应失败")
+        return None
+    if raw is None:
+        return None
+    stored = StoredResponse.loads(raw)
+    _cache.put(key, stored)
+    return stored
+
+
+async def _store(key: str, stored: StoredResponse):
+    _cache.put(key, stored)
+    redis = get_redis()
+    if redis is not None:
+        try:
+            await redis.set(_KEY_PREFIX + key, stored.dumps(), ex=IDEMPOTENCY_TTL_SECONDS)
+        except Exception:
+            logger.exception("写入幂等响应失败")
+
+
+def _scoped_key(scope, idempotency_key: str) -> str:
+    """按调用方和路径隔离的存储键（凭据只以哈希形式出现在键里）"""
+    caller = b""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            caller = value
+            break
+    if not caller:
+        tokens = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token")
+        if tokens:
+            caller = tokens[0].encode("latin-1")
+    return hashlib.sha256(
+        caller + b"\n" + scope["path"].encode() + b"\n" + idempotency_key.encode("latin-1")
+    ).hexdigest()
+
+
+class IdempotencyMiddleware:
+    """对匹配的 POST 路径启用 Idempotency-Key（paths 为完整匹配的正则）"""
+
+    def __init__(self, app, paths: List[str]):
+        self.app = app
+        self.paths: List[Pattern] = [re.compile(p) for p in paths]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = None
+        for name, value in scope["headers"]:
+            if name == b"idempotency-key":
+                idempotency_key = value.decode("latin-1").strip()
+                break
+        if not idempotency_key or not any(p.fullmatch(scope["path"]) for p in self.paths):
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, "Idempotency-Key 过长")
+            return
+        idempotency_key = _scoped_key(scope, idempotency_key)
+
+        # 读出请求体计算指纹，之后原样交给路由
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        fingerprint = hashlib.sha256(
+            scope["method"].encode() + b" " + scope["path"].encode() + b"\n" + body
+        ).hexdigest()
+
+        async def replay_receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        while True:
+            stored = await _lookup(idempotency_key)
+            if stored is None:
+                pending = _inflight.get(idempotency_key)
+                if pending is None:
+                    break
+                # 本进程内的并发重复请求：等第一个请求完成后回放
+                metrics.inc("idempotency_coalesced_total", help="合并的并发重复请求数")
+                stored = await asyncio.shield(pending)
+                if stored is None:
+                    # 第一个请求失败或结果不缓存，本次自己执行
+                    continue
+            if stored.fingerprint != fingerprint:
+                await _send_json(send, 422, "Idempotency-Key 已用于不同的请求")
+                return
+            metrics.inc("idempotency_replays_total", help="按幂等键回放的响应数")
+            await _replay(send, stored)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        _inflight[idempotency_key] = future
+        stored = None
+        try:
+            if not await self._acquire(idempotency_key):
+                # 其他 worker 在处理，等它写入结果
+                stored = await self._wait_remote(idempotency_key)
+                if stored is None:
+                    await _send_json(send, 409, "相同 Idempotency-Key 的请求正在处理")
+                elif stored.fingerprint != fingerprint:
+                    await _send_json(send, 422, "Idempotency-Key 已用于不同的请求")
+                    stored = None
+                else:
+                    await _replay(send, stored)
+                return
+            try:
+                stored = await self._execute(scope, replay_receive, send, fingerprint)
+                if stored is not None:
+                    await _store(idempotency_key, stored)
+            finally:
+                await self._release(idempotency_key)
+        finally:
+            del _inflight[idempotency_key]
+            future.set_result(stored)
+
+    async def _execute(self, scope, receive, send, fingerprint: str) -> Optional[StoredResponse]:
+        """执行路由并截取响应，可缓存时返回 StoredResponse"""
+        start = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, receive, capture)
+
+        status = start.get("status", 500)
+        if status >= 500 or status in _NOT_CACHED:
+            return None
+        return StoredResponse(
+            fingerprint=fingerprint,
+            status=status,
+            headers=[(k.decode("latin-1"), v.decode("latin-1")) for k, v in start.get("headers", [])],
+            body=b"".join(chunks),
+            expires_at=time.time() + IDEMPOTENCY_TTL_SECONDS,
+        )
+
+    async def _acquire(self, key: str) -> bool:
+        redis = get_redis()
+        if redis is None:
+            return True
+        try:
+            return bool(await redis.set(_KEY_PREFIX + "lock:" + key, "1", nx=True, ex=IDEMPOTENCY_LOCK_SECONDS))
+        except Exception:
+            logger.exception("获取幂等锁失败")
+            return True
+
+    async def _release(self, key: str):
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.delete(_KEY_PREFIX + "lock:" + key)
+            except Exception:
+                logger.exception("释放幂等锁失败")
+
+    async def _wait_remote(self, key: str) -> Optional[StoredResponse]:
+        redis = get_redis()
+        deadline = time.monotonic() + IDEMPOTENCY_LOCK_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(_POLL_SECONDS)
+            stored = await _lookup(key)
+            if stored is not None:
+                return stored
+            try:
+                locked = await redis.exists(_KEY_PREFIX + "lock:" + key)
+            except Exception:
+                # Redis 不可用时无法确认对方是否还在处理，让客户端重试
+                logger.exception("查询幂等锁失败")
+                return None
+            if not locked:
+                # 对方处理完但结果不缓存（失败），让客户端重试
+                return None
+        return None
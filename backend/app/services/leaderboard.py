@@ -0,0 +1,333 @@
+"""
+优惠券排行榜（总榜 + 周榜）
+
+排名存放在有序集合里：配置了 REDIS_URL 时用 Redis ZSET（各 worker 共享），
+否则用进程内可索引跳表。两者的名次查询、分页取前 N 名都是 O(log n)，不查 users 表。
+
+- 收获提交成功后对总榜和当周榜 +1（增量维护）
+- 后台每 LEADERBOARD_REBUILD_SECONDS 秒从数据库重建一次，修正漏记/多记：
+  总榜按 users.total_coupons_earned，周榜按当周收获所得的优惠券（campaign_id 为空）计数，
+  与收获时的增量一致，活动发放的券不计入
+- 同分时按用户 id 的字符串序排列（与 Redis 一致）
+
+多 worker 且未配置 Redis 时，各 worker 的跳表只包含本进程的增量，需等下次重建才一致。
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import random
+
+from sqlalchemy import select, func
+
+from app.database import read_session_maker
+from app.models.models import User, Coupon
+from app.services import metrics
+from app.services.redis_client import get_redis
+from app.services.startup import register_warmup, register_background
+
+logger = logging.getLogger("app.leaderboard")
+
+# 从数据库重建的间隔（秒）
+LEADERBOARD_REBUILD_SECONDS = float(os.getenv("LEADERBOARD_REBUILD_SECONDS", "300"))
+# Redis 中周榜保留的周数
+LEADERBOARD_KEEP_WEEKS = int(os.getenv("LEADERBOARD_KEEP_WEEKS", "5"))
+
+_KEY_PREFIX = "leaderboard:"
+_REBUILD_LOCK = "leaderboard:rebuild_lock"
+
+PERIODS = ("all", "week")
+
+
+def week_of(when: datetime) -> str:
+    year, week, _ = when.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def week_range(when: datetime) -> Tuple[datetime, datetime]:
+    start = (when - timedelta(days=when.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=7)
+
+
+def board_name(period: str, when: Optional[datetime] = None) -> str:
+    if period == "all":
+        return "all"
+    return f"week:{week_of(when or datetime.utcnow())}"
+
+
+class SkipList:
+    """可索引跳表：按 (score, member) 升序，每层记录跨度，支持按名次定位"""
+
+    MAX_LEVEL = 32
+
+    class _Node:
+        __slots__ = ("key", "next", "width")
+
+        def __init__(self, key, level):
+            self.key = key
+            self.next = [None] * level
+            self.width = [1] * level
+
+    def __init__(self):
+        self.head = self._Node(None, self.MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.25:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [None] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = rank[i + 1] if i + 1 < self.level else 0
+            while node.next[i] is not None and node.next[i].key < key:
+                rank[i] += node.width[i]
+                node = node.next[i]
+            update[i] = node
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.width[i] = self.size + 1
+            self.level = level
+
+        new = self._Node(key, level)
+        for i in range(level):
+            new.next[i] = update[i].next[i]
+            update[i].next[i] = new
+            new.width[i] = update[i].width[i] - (rank[0] - rank[i])
+            update[i].width[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):
+            update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key) -> bool:
+        update = [None] * self.MAX_LEVEL
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+        for i in range(self.level):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.level -= 1
+        self.size -= 1
+        return True
+
+    def rank(self, key) -> Optional[int]:
+        """升序名次（从 0 开始）"""
+        position = 0
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key <= key:
+                position += node.width[i]
+                node = node.next[i]
+            if node.key == key:
+                return position - 1
+        return None
+
+    def iter_from(self, index: int):
+        """从升序第 index 个开始顺序遍历"""
+        node = self.head
+        position = index + 1
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.width[i] <= position:
+                position -= node.width[i]
+                node = node.next[i]
+        while node is not None and node is not self.head:
+            yield node.key
+            node = node.next[0]
+
+
+class MemoryBoard:
+    """进程内有序集合（语义同 Redis ZSET，名次按分数降序）"""
+
+    def __init__(self):
+        self.scores: Dict[str, float] = {}
+        self.index = SkipList()
+
+    def incr(self, member: str, amount: float = 1):
+        old = self.scores.get(member)
+        if old is not None:
+            self.index.remove((old, member))
+        score = (old or 0) + amount
+        self.scores[member] = score
+        self.index.insert((score, member))
+
+    def rev_rank(self, member: str) -> Optional[int]:
+        score = self.scores.get(member)
+        if score is None:
+            return None
+        return self.index.size - 1 - self.index.rank((score, member))
+
+    def rev_range(self, offset: int, limit: int) -> List[Tuple[str, float]]:
+        """降序第 offset 名起的 limit 个"""
+        entries = []
+        last = self.index.size - 1 - offset
+        if last < 0 or limit <= 0:
+            return entries
+        first = max(0, last - limit + 1)
+        for score, member in self.index.iter_from(first):
+            entries.append((member, score))
+            if len(entries) == last - first + 1:
+                break
+        entries.reverse()
+        return entries
+
+
+_boards: Dict[str, MemoryBoard] = {}
+_pending: set = set()
+
+
+async def _incr(when: datetime, user_id: int):
+    redis = get_redis()
+    names = [board_name("all"), board_name("week", when)]
+    if redis is None:
+        for name in names:
+            _boards.setdefault(name, MemoryBoard()).incr(str(user_id))
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        for name in names:
+            pipe.zincrby(_KEY_PREFIX + name, 1, str(user_id))
+        pipe.expire(_KEY_PREFIX + names[1], LEADERBOARD_KEEP_WEEKS * 7 * 86400)
+        await pipe.execute()
+
+
+def record_harvest(user_id: int, when: datetime):
+    """收获提交后调用：异步给总榜和当周榜加分（失败只记日志，等重建修正）"""
+    async def run():
+        try:
+            await _incr(when, user_id)
+        except Exception:
+            logger.exception("排行榜加分失败")
+
+    task = asyncio.get_running_loop().create_task(run())
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def get_rank(period: str, user_id: int) -> Tuple[Optional[int], int]:
+    """返回 (名次从 1 开始，未上榜为 None, 分数)"""
+    name = board_name(period)
+    member = str(user_id)
+    redis = get_redis()
+    if redis is None:
+        board = _boards.get(name)
+        if board is None or member not in board.scores:
+            return None, 0
+        return board.rev_rank(member) + 1, int(board.scores[member])
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zrevrank(_KEY_PREFIX + name, member)
+        pipe.zscore(_KEY_PREFIX + name, member)
+        rank, score = await pipe.execute()
+    if rank is None:
+        return None, 0
+    return rank + 1, int(score or 0)
+
+
+async def get_top(period: str, offset: int, limit: int) -> Tuple[List[Tuple[int, int]], int]:
+    """返回 ([(用户 id, 分数)], 上榜总人数)"""
+    name = board_name(period)
+    redis = get_redis()
+    if redis is None:
+        board = _boards.get(name)
+        if board is None:
+            return [], 0
+        return [(int(m), int(s)) for m, s in board.rev_range(offset, limit)], board.index.size
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(_KEY_PREFIX + name, offset, offset + limit - 1, withscores=True)
+        pipe.zcard(_KEY_PREFIX + name)
+        entries, total = await pipe.execute()
+    return [(int(m), int(s)) for m, s in entries], total
+
+
+async def rebuild() -> Dict[str, int]:
+    """从数据库重建总榜和当周榜，返回各榜人数"""
+    now = datetime.utcnow()
+    start, end = week_range(now)
+    async with read_session_maker() as db:
+        result = await db.execute(
+            select(User.id, User.total_coupons_earned).where(User.total_coupons_earned > 0)
+        )
+        overall = result.all()
+        result = await db.execute(
+            select(Coupon.user_id, func.count())
+            .where(Coupon.created_at >= start, Coupon.created_at < end, Coupon.campaign_id.is_(None))
+            .group_by(Coupon.user_id)
+        )
+        weekly = result.all()
+
+    boards = {board_name("all"): overall, board_name("week", now): weekly}
+    redis = get_redis()
+    if redis is None:
+        for name, rows in boards.items():
+            board = MemoryBoard()
+            for user_id, score in rows:
+                board.incr(str(user_id), score)
+            _boards[name] = board
+        # 只保留总榜和当周榜
+        for name in list(_boards):
+            if name not in boards:
+                del _boards[name]
+    else:
+        # 先写临时键再 RENAME，读请求不会看到半成品
+        for name, rows in boards.items():
+            key = _KEY_PREFIX + name
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.delete(key + ":rebuild")
+                if rows:
+                    pipe.zadd(key + ":rebuild", {str(user_id): score for user_id, score in rows})
+                    pipe.rename(key + ":rebuild", key)
+                else:
+                    pipe.delete(key)
+                if name != "all":
+                    pipe.expire(key, LEADERBOARD_KEEP_WEEKS * 7 * 86400)
+                await pipe.execute()
+
+    sizes = {name: len(rows) for name, rows in boards.items()}
+    metrics.set_gauge("leaderboard_entries", sizes[board_name("all")], help="总榜上榜人数")
+    return sizes
+
+
+@register_warmup
+async def load_leaderboard():
+    """启动时构建排行榜（Redis 中已有总榜时跳过，交给定时重建）"""
+    redis = get_redis()
+    if redis is not None and await redis.exists(_KEY_PREFIX + board_name("all")):
+        return
+    await rebuild()
+
+
+@register_background
+async def rebuild_periodically():
+    while True:
+        await asyncio.sleep(LEADERBOARD_REBUILD_SECONDS)
+        try:
+            redis = get_redis()
+            # 多 worker 时同一周期只由一个 worker 重建
+            if redis is not None and not await redis.set(
+                _REBUILD_LOCK, "1", nx=True, ex=int(LEADERBOARD_REBUILD_SECONDS * 0.9) or 1
+            ):
+                continue
+            await rebuild()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("排行榜重建失败")
@@ -0,0 +1,60 @@
+"""
+进程内指标（Prometheus 文本格式）
+
+每个 worker 各自计数，由 /metrics 暴露给采集端汇总
+"""
+
+from typing import Dict, Optional, Tuple
+import threading
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+_counters: Dict[_Key, float] = {}
+_gauges: Dict[_Key, float] = {}
+_help: Dict[str, str] = {}
+
+
+def _key(name: str, labels: Optional[dict]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def inc(name: str, amount: float = 1, labels: Optional[dict] = None, help: str = ""):
+    """计数器累加"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+        if help:
+            _help.setdefault(name, help)
+
+
+def set_gauge(name: str, value: float, labels: Optional[dict] = None, help: str = ""):
+    """设置瞬时值"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+        if help:
+            _help.setdefault(name, help)
+
+
+def get(name: str, labels: Optional[dict] = None) -> float:
+    """读取当前值（计数器或瞬时值）"""
+    key = _key(name, labels)
+    with _lock:
+        return _counters.get(key, _gauges.get(key, 0))
+
+
+def render() -> str:
+    """输出 Prometheus 文本格式"""
+    lines = []
+    with _lock:
+        for kind, values in (("counter", _counters), ("gauge", _gauges)):
+            seen = set()
+            for (name, labels), value in sorted(values.items()):
+                if name not in seen:
+                    seen.add(name)
+                    if name in _help:
+                        lines.append(f"# HELP {name} {_help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,349 @@
+"""
+游戏事件发件箱（transactional outbox）
+
+业务代码在修改数据的同一事务里追加事件（record_event），事务回滚则事件一起消失，
+不会出现“数据改了但事件没发”或反过来的情况。事务真正提交后（run_after_commit）唤醒后台中继，
+中继按 id 顺序分批读取事件，投递给各消费者并记录检查点：
+
+- 进程内消费者（register_consumer 注册）在同一个数据库事务里处理事件并推进检查点，
+  处理结果与检查点一起提交，恰好一次。
+- Redis Streams 消费者（配置了 REDIS_URL 时启用）把事件 XADD 到 OUTBOX_STREAM，
+  至少一次，下游按事件 id 去重。外部投递不在数据库事务里进行：先从只读会话读取已提交的事件，
+  投递后再在写会话里按比较并交换推进检查点（SQLite tuned 模式下写会话可能看到同组尚未
+  COMMIT 的事件，不能据此对外投递）。
+
+每个消费者独立推进，某个消费者失败不影响其他消费者。多 worker 时检查点行用
+SELECT ... FOR UPDATE SKIP LOCKED 加锁，同一批事件只会被一个 worker 投递。
+
+SQLite 写事务串行，id 顺序即提交顺序，检查点按事件 id 推进。PostgreSQL 的自增 id
+按插入分配、按提交可见，较小的 id 可能晚提交：每条事件记录写入事务的 id（txid 列，
+由数据库默认值填充，需 PostgreSQL 13+），中继只读取 txid 小于当前快照 xmin 的事件
+（这些事务都已结束，不会再有新事件出现），按 (txid, id) 排序并推进检查点。
+长事务会推迟其后事件的投递，但不会丢失事件。
+
+事件类型：fish.added, fish.fed, fish.grown, fish.harvested, coupon.granted, coupon.redeemed
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import json
+import logging
+import os
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy import event, select, update, delete, insert, func, text, tuple_, literal, BigInteger, Integer
+from sqlalchemy.exc import IntegrityError
+
+from app.database import engine, async_session_maker, read_session_maker, write_session, run_after_commit
+from app.models.models import OutboxEvent, OutboxCheckpoint
+from app.services import metrics
+from app.services.redis_client import get_redis
+from app.services.startup import register_warmup, register_background
+
+logger = logging.getLogger("app.outbox")
+
+# 每批投递的事件数
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+# 没有新事件通知时的轮询间隔（秒）
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+# 所有消费者都已处理的事件保留时长（小时），之后清理
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "72"))
+# Redis Stream 名称和近似最大长度
+OUTBOX_STREAM = os.getenv("OUTBOX_STREAM", "game:events")
+OUTBOX_STREAM_MAXLEN = int(os.getenv("OUTBOX_STREAM_MAXLEN", "100000"))
+
+_PRUNE_INTERVAL_SECONDS = 600
+
+
+@dataclass
+class Event:
+    id: int
+    event_type: str
+    user_id: Optional[int]
+    payload: dict
+    created_at: datetime
+
+
+@dataclass
+class Consumer:
+    name: str
+    # 进程内消费者 async (db, events)；外部消费者 async (events)
+    handler: Callable[..., Awaitable[None]]
+    event_types: Optional[Set[str]] = None
+    external: bool = False
+
+
+_consumers: Dict[str, Consumer] = {}
+# 在中继所在的事件循环里创建
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, "value"):
+        return value.value
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def event_row(event_type: str, user_id: Optional[int], payload: dict, created_at: Optional[datetime] = None) -> dict:
+    """构造一行事件（供批量写入使用）"""
+    return {
+        "event_type": event_type,
+        "user_id": user_id,
+        "payload": json.dumps(payload, ensure_ascii=False, default=_json_default),
+        "created_at": created_at or datetime.utcnow(),
+    }
+
+
+def record_event(db: AsyncSession, event_type: str, user_id: Optional[int], **payload):
+    """在当前事务中追加一条事件（随业务数据一起提交）"""
+    db.add(OutboxEvent(**event_row(event_type, user_id, payload)))
+    _notify_after_commit(db)
+
+
+async def record_events(db: AsyncSession, rows: List[dict]):
+    """在当前事务中批量追加事件"""
+    if rows:
+        await db.execute(insert(OutboxEvent), rows)
+        _notify_after_commit(db)
+
+
+def notify():
+    """唤醒中继（有新事件提交时调用）"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def _notify_after_commit(db: AsyncSession):
+    # 组提交写入器上释放 SAVEPOINT 不算提交，等真正 COMMIT 后才唤醒中继；每个事务只登记一次
+    if not db.info.get("outbox_pending"):
+        db.info["outbox_pending"] = True
+        run_after_commit(db, notify)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _reset_pending(session):
+    session.info.pop("outbox_pending", None)
+
+
+def register_consumer(name: str, event_types: Optional[Set[str]] = None):
+    """注册进程内消费者（装饰器），处理函数签名为 async (db, events)"""
+    def decorator(fn):
+        _consumers[name] = Consumer(name, fn, set(event_types) if event_types else None)
+        return fn
+    return decorator
+
+
+async def _publish_to_stream(events: List[Event]):
+    redis = get_redis()
+    async with redis.pipeline(transaction=False) as pipe:
+        for e in events:
+            pipe.xadd(
+                OUTBOX_STREAM,
+                {
+                    "id": e.id,
+                    "type": e.event_type,
+                    "user_id": "" if e.user_id is None else e.user_id,
+                    "payload": json.dumps(e.payload, ensure_ascii=False),
+                    "created_at": e.created_at.isoformat(),
+                },
+                maxlen=OUTBOX_STREAM_MAXLEN,
+                approximate=True,
+            )
+        await pipe.execute()
+
+
+def _decode(row: OutboxEvent) -> Event:
+    return Event(row.id, row.event_type, row.user_id, json.loads(row.payload), row.created_at)
+
+
+async def _snapshot_xmin(db: AsyncSession) -> Optional[int]:
+    """PostgreSQL 上当前快照的 xmin（小于它的事务都已提交或回滚），其他数据库为 None"""
+    if engine.dialect.name != "postgresql":
+        return None
+    result = await db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint"))
+    return result.scalar_one()
+
+
+def _next_batch(checkpoint: OutboxCheckpoint, xmin: Optional[int]):
+    """检查点之后的一批事件"""
+    if xmin is not None:
+        stmt = select(OutboxEvent).where(
+            OutboxEvent.txid < xmin,
+            tuple_(OutboxEvent.txid, OutboxEvent.id)
+            > tuple_(literal(checkpoint.last_txid, BigInteger), literal(checkpoint.last_event_id, Integer)),
+        ).order_by(OutboxEvent.txid, OutboxEvent.id)
+    else:
+        stmt = select(OutboxEvent).where(OutboxEvent.id > checkpoint.last_event_id).order_by(OutboxEvent.id)
+    return stmt.limit(OUTBOX_BATCH_SIZE)
+
+
+def _matching(consumer: Consumer, rows: List[OutboxEvent]) -> List[Event]:
+    return [
+        _decode(row) for row in rows
+        if consumer.event_types is None or row.event_type in consumer.event_types
+    ]
+
+
+async def deliver(consumer: Consumer) -> int:
+    """给一个消费者投递一批事件并推进检查点，返回扫过的事件数"""
+    if consumer.external:
+        return await _deliver_external(consumer)
+
+    async with write_session() as db:
+        # 先取快照 xmin（加锁前本事务还没有分配 txid）
+        xmin = await _snapshot_xmin(db)
+        result = await db.execute(
+            select(OutboxCheckpoint)
+            .where(OutboxCheckpoint.consumer == consumer.name)
+            .with_for_update(skip_locked=True)
+        )
+        checkpoint = result.scalar_one_or_none()
+        if checkpoint is None:
+            # 其他 worker 正在投递
+            return 0
+
+        result = await db.execute(_next_batch(checkpoint, xmin))
+        rows = result.scalars().all()
+        if not rows:
+            return 0
+
+        events = _matching(consumer, rows)
+        if events:
+            await consumer.handler(db, events)
+        checkpoint.last_event_id = rows[-1].id
+        if xmin is not None:
+            checkpoint.last_txid = rows[-1].txid
+        await db.commit()
+
+    _delivered(consumer, events, rows)
+    return len(rows)
+
+
+async def _deliver_external(consumer: Consumer) -> int:
+    """
+    外部消费者：从只读会话读取已提交的一批事件，在数据库事务之外投递，
+    再按比较并交换推进检查点（检查点已被其他 worker 推进时放弃，下游按事件 id 去重）
+    """
+    async with read_session_maker() as db:
+        xmin = await _snapshot_xmin(db)
+        checkpoint = await db.get(OutboxCheckpoint, consumer.name)
+        if checkpoint is None:
+            return 0
+        result = await db.execute(_next_batch(checkpoint, xmin))
+        rows = result.scalars().all()
+    if not rows:
+        return 0
+
+    events = _matching(consumer, rows)
+    if events:
+        await consumer.handler(events)
+
+    values = {"last_event_id": rows[-1].id}
+    if xmin is not None:
+        values["last_txid"] = rows[-1].txid
+    async with write_session() as db:
+        result = await db.execute(
+            update(OutboxCheckpoint)
+            .where(
+                OutboxCheckpoint.consumer == consumer.name,
+                OutboxCheckpoint.last_event_id == checkpoint.last_event_id,
+                OutboxCheckpoint.last_txid == checkpoint.last_txid,
+            )
+            .values(**values, updated_at=datetime.utcnow())
+        )
+        await db.commit()
+    if result.rowcount == 0:
+        return 0
+
+    _delivered(consumer, events, rows)
+    return len(rows)
+
+
+def _delivered(consumer: Consumer, events: List[Event], rows: List[OutboxEvent]):
+    labels = {"consumer": consumer.name}
+    metrics.inc("outbox_events_delivered_total", len(events), labels, help="已投递的事件数")
+    metrics.set_gauge("outbox_checkpoint", rows[-1].id, labels, help="消费者检查点（事件 id）")
+
+
+async def relay_once() -> int:
+    """每个消费者投递一批，返回最大的单个消费者批次大小"""
+    largest = 0
+    for consumer in list(_consumers.values()):
+        try:
+            largest = max(largest, await deliver(consumer))
+        except Exception:
+            metrics.inc("outbox_delivery_errors_total", labels={"consumer": consumer.name}, help="事件投递失败次数")
+            logger.exception("事件投递失败: %s", consumer.name)
+    return largest
+
+
+async def prune() -> int:
+    """删除所有已注册消费者都处理过、且超过保留时长的事件"""
+    postgres = engine.dialect.name == "postgresql"
+    position = OutboxCheckpoint.last_txid if postgres else OutboxCheckpoint.last_event_id
+    async with write_session() as db:
+        result = await db.execute(
+            select(func.min(position)).where(OutboxCheckpoint.consumer.in_(list(_consumers)))
+        )
+        floor = result.scalar_one_or_none()
+        if not floor:
+            return 0
+        # PostgreSQL 上检查点所在事务的事件可能还没投递完，只删更早事务的事件
+        delivered = OutboxEvent.txid < floor if postgres else OutboxEvent.id <= floor
+        result = await db.execute(
+            delete(OutboxEvent).where(
+                delivered,
+                OutboxEvent.created_at < datetime.utcnow() - timedelta(hours=OUTBOX_RETENTION_HOURS),
+            )
+        )
+        await db.commit()
+    return result.rowcount
+
+
+@register_warmup
+async def ensure_checkpoints():
+    """启用 Redis Streams 消费者，并为新消费者建立检查点（从头开始消费）"""
+    if get_redis() is not None:
+        _consumers.setdefault("redis_stream", Consumer("redis_stream", _publish_to_stream, external=True))
+
+    async with async_session_maker() as db:
+        result = await db.execute(select(OutboxCheckpoint.consumer))
+        existing = set(result.scalars())
+        missing = [name for name in _consumers if name not in existing]
+        if missing:
+            db.add_all(OutboxCheckpoint(consumer=name, last_event_id=0) for name in missing)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # 其他 worker 已同时写入
+                await db.rollback()
+
+
+@register_background
+async def run_relay():
+    """中继主循环：有积压时连续投递，追上后等待提交通知或轮询"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    last_prune = loop.time()
+    while True:
+        _wakeup.clear()
+        moved = await relay_once()
+        if loop.time() - last_prune > _PRUNE_INTERVAL_SECONDS:
+            last_prune = loop.time()
+            try:
+                await prune()
+            except Exception:
+                logger.exception("事件清理失败")
+        if moved >= OUTBOX_BATCH_SIZE:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,159 @@
+"""
+管理员密码哈希服务
+
+- bcrypt 计算放在有界线程池中执行（bcrypt 会释放 GIL），慢登录不会阻塞事件循环；
+  执行中加排队的任务超过 PASSWORD_HASH_QUEUE 个时直接抛出 PasswordHasherBusy，不无限排队
+- 用户名不存在时对占位哈希做一次同样的校验，响应时间不暴露用户名是否存在
+- 旧版无盐 sha256 哈希在下次登录成功时透明升级为 bcrypt
+- 短时缓存验证成功的凭据，店员反复登录不重复消耗 CPU
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+import time
+
+import bcrypt
+
+from app.services import metrics
+from app.services.startup import register_warmup
+
+# bcrypt 计算轮数
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+# 哈希线程池大小
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# 最多同时执行加排队的哈希任务数，超出时拒绝
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "16"))
+# 验证缓存有效期（秒）和容量
+PASSWORD_CACHE_TTL = int(os.getenv("PASSWORD_CACHE_TTL", "300"))
+PASSWORD_CACHE_SIZE = int(os.getenv("PASSWORD_CACHE_SIZE", "1024"))
+
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+_BCRYPT_ROUNDS = re.compile(r"^\$2[aby]\$(\d{2})\$")
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+# 任务在线程中执行完才释放名额（请求被取消也不会提前释放）
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+# 用户名不存在时用来校验的占位哈希（启动时生成，轮数与当前配置一致）
+_dummy_hash: Optional[str] = None
+
+
+class PasswordHasherBusy(Exception):
+    """哈希线程池已满"""
+
+# 缓存键用进程内随机密钥做 HMAC，内存中不保留可离线爆破的密码摘要
+_cache_key_secret = secrets.token_bytes(32)
+_verified: "OrderedDict[bytes, float]" = OrderedDict()
+
+
+def _encode(password: str) -> bytes:
+    # bcrypt 只使用前 72 字节
+    return password.encode()[:72]
+
+
+def _hash_sync(password: str) -> str:
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(PASSWORD_BCRYPT_ROUNDS)).decode()
+
+
+def _check_sync(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(_encode(password), password_hash.encode())
+
+
+async def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        metrics.inc("password_hash_rejected_total", help="哈希线程池已满被拒绝的任务数")
+        raise PasswordHasherBusy()
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return await asyncio.wrap_future(future)
+
+
+def _cache_key(username: str, password: str, password_hash: str) -> bytes:
+    message = "\0".join((username, password, password_hash)).encode()
+    return hmac.new(_cache_key_secret, message, hashlib.sha256).digest()
+
+
+def _cache_hit(key: bytes) -> bool:
+    expires = _verified.get(key)
+    if expires is None:
+        return False
+    if expires < time.monotonic():
+        del _verified[key]
+        return False
+    return True
+
+
+def _cache_store(key: bytes):
+    _verified[key] = time.monotonic() + PASSWORD_CACHE_TTL
+    _verified.move_to_end(key)
+    while len(_verified) > PASSWORD_CACHE_SIZE:
+        _verified.popitem(last=False)
+
+
+def _needs_rehash(password_hash: str) -> bool:
+    match = _BCRYPT_ROUNDS.match(password_hash)
+    return match is None or int(match.group(1)) < PASSWORD_BCRYPT_ROUNDS
+
+
+async def hash_password(password: str) -> str:
+    """生成 bcrypt 哈希"""
+    return await _run(_hash_sync, password)
+
+
+async def verify_password(username: str, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """
+    验证密码
+
+    返回 (是否通过, 新哈希)；新哈希不为 None 时调用方应写回数据库
+    （旧版 sha256 或 bcrypt 轮数低于当前配置）。
+    """
+    key = _cache_key(username, password, password_hash)
+    if _cache_hit(key):
+        return True, None
+
+    if _LEGACY_SHA256.match(password_hash):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        ok = hmac.compare_digest(legacy, password_hash)
+    else:
+        try:
+            ok = await _run(_check_sync, password, password_hash)
+        except ValueError:
+            ok = False
+
+    if not ok:
+        return False, None
+
+    new_hash = None
+    if _needs_rehash(password_hash):
+        try:
+            new_hash = await hash_password(password)
+        except PasswordHasherBusy:
+            # 繁忙时本次不升级，下次登录再升级
+            pass
+    _cache_store(_cache_key(username, password, new_hash or password_hash))
+    return True, new_hash
+
+
+async def verify_unknown_user(password: str) -> bool:
+    """用户名不存在时调用：对占位哈希做一次校验后返回 False"""
+    if _dummy_hash is not None:
+        await _run(_check_sync, password, _dummy_hash)
+    return False
+
+
+@register_warmup
+async def build_dummy_hash():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await hash_password(secrets.token_urlsafe(16))
@@ -0,0 +1,443 @@
+"""
+内存鱼塘状态引擎（可选，POND_ENGINE=memory 开启）
+
+活跃用户的鱼塘（每日饲料计数、鱼、未核销优惠券）常驻内存，按用户 id 分片，
+每个用户一把 asyncio 锁串行化操作。查询状态和喂食完全在内存中完成，
+脏数据由后台任务每 POND_FLUSH_SECONDS 秒批量写回，空闲或超出容量的鱼塘写回后淘汰。
+
+持久性约定：
+- 喂食（饲料计数、成长值、喂食记录、喂食事件）是回写（write-behind）的：进程崩溃最多丢失
+  最近一个刷新周期内已确认的喂食。每次刷新在一个事务里按 用户 → 鱼 → 喂食记录 → 事件
+  的顺序写入，要么全部生效要么全部不生效；写入失败时脏标记和记录放回内存下次重试。
+  写回的都是绝对值，重复写入是幂等的。
+- 新鱼直接写库（需要数据库分配的 id），成功后才放入内存。
+- 优惠券永远同步持久化：收获时先在同一事务里写回该用户的脏数据，再执行原有的
+  收获逻辑并提交，提交成功后才从内存中淘汰该鱼塘（下次访问重新加载）。
+  核销只改数据库，并同步移除内存中对应的优惠券。
+
+一致性要求：同一用户的请求必须落在同一个进程上（单 worker，或按用户 id
+做粘性路由），否则多个进程各自持有的内存状态会互相覆盖。
+"""
+
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, insert, bindparam
+
+from app.database import write_session
+from app.models.models import User, Fish, Coupon, FeedingRecord, FishType, FishStatus
+from app.services import game_rules, metrics, outbox
+from app.services.startup import register_background
+
+logger = logging.getLogger("app.pond")
+
+POND_ENGINE = os.getenv("POND_ENGINE", "db")
+POND_SHARDS = int(os.getenv("POND_SHARDS", "64"))
+# 每个分片最多常驻的鱼塘数
+POND_SHARD_CAPACITY = int(os.getenv("POND_SHARD_CAPACITY", "2000"))
+# 写回间隔和空闲淘汰时间（秒）
+POND_FLUSH_SECONDS = float(os.getenv("POND_FLUSH_SECONDS", "2"))
+POND_IDLE_SECONDS = float(os.getenv("POND_IDLE_SECONDS", "600"))
+
+
+@dataclass
+class UserState:
+    id: int
+    daily_feed_count: int
+    last_feed_date: Optional[str]
+    total_coupons_earned: int
+
+
+@dataclass
+class FishState:
+    id: int
+    user_id: int
+    fish_type: FishType
+    status: FishStatus
+    hunger: float
+    health: float
+    growth: float
+    pos_x: float
+    pos_y: float
+    created_at: datetime
+
+
+@dataclass
+class CouponState:
+    id: int
+    code: str
+    fish_type: FishType
+    value: int
+    used: bool
+    expires_at: datetime
+    created_at: datetime
+
+
+def _copy(model_obj, state_cls):
+    return state_cls(**{f.name: getattr(model_obj, f.name) for f in fields(state_cls)})
+
+
+@dataclass
+class Pond:
+    user: UserState
+    fishes: Dict[int, FishState]
+    coupons: Dict[int, CouponState]
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    user_dirty: bool = False
+    dirty_fish: Set[int] = field(default_factory=set)
+    pending_records: List[dict] = field(default_factory=list)
+    pending_events: List[dict] = field(default_factory=list)
+    # 正在写回时置位，收获等同步写操作需等待其完成
+    flushing: Optional[asyncio.Event] = None
+    evicted: bool = False
+    last_access: float = field(default_factory=time.monotonic)
+
+    @property
+    def dirty(self) -> bool:
+        return self.user_dirty or bool(self.dirty_fish) or bool(self.pending_records) or bool(self.pending_events)
+
+
+@dataclass
+class _Batch:
+    pond: Pond
+    user: Optional[dict]
+    fishes: List[dict]
+    records: List[dict]
+    events: List[dict]
+
+
+class FeedOutcome:
+    NOT_FOUND = "not_found"
+    DEAD = "dead"
+    NO_FEED = "no_feed"
+    OK = "ok"
+
+
+class PondEngine:
+    def __init__(self, shards: int = POND_SHARDS):
+        self.shards: List["OrderedDict[int, Pond]"] = [OrderedDict() for _ in range(shards)]
+        self.shard_locks = [asyncio.Lock() for _ in range(shards)]
+        self.fish_owner: Dict[int, int] = {}
+
+    def _shard(self, user_id: int) -> int:
+        return user_id % len(self.shards)
+
+    # ---------- 加载 ----------
+
+    async def _load(self, user_id: int, db: AsyncSession) -> Optional[Pond]:
+        """用请求自己的会话加载，能看到本进程已确认但尚在组提交队列中的写入"""
+        user = await db.get(User, user_id)
+        if not user:
+            return None
+        result = await db.execute(select(Fish).where(Fish.user_id == user_id))
+        fishes = result.scalars().all()
+        result = await db.execute(
+            select(Coupon).where(Coupon.user_id == user_id, Coupon.used == False)
+        )
+        coupons = result.scalars().all()
+        pond = Pond(
+            user=_copy(user, UserState),
+            fishes={f.id: _copy(f, FishState) for f in fishes},
+            coupons={c.id: _copy(c, CouponState) for c in coupons},
+        )
+        # 之后以内存为准，不在会话里留下会过期的对象
+        for obj in (user, *fishes, *coupons):
+            db.expunge(obj)
+        return pond
+
+    async def _get(self, user_id: int, db: AsyncSession) -> Optional[Pond]:
+        index = self._shard(user_id)
+        shard = self.shards[index]
+        pond = shard.get(user_id)
+        if pond is None:
+            async with self.shard_locks[index]:
+                pond = shard.get(user_id)
+                if pond is None:
+                    pond = await self._load(user_id, db)
+                    if pond is None:
+                        return None
+                    shard[user_id] = pond
+                    for fish_id in pond.fishes:
+                        self.fish_owner[fish_id] = user_id
+                    metrics.inc("pond_engine_loads_total", help="从数据库加载的鱼塘数")
+        shard.move_to_end(user_id)
+        pond.last_access = time.monotonic()
+        return pond
+
+    @asynccontextmanager
+    async def _locked(self, user_id: int, db: AsyncSession):
+        """取得并锁定鱼塘；若等待期间被淘汰则重新加载"""
+        while True:
+            pond = await self._get(user_id, db)
+            if pond is None:
+                yield None
+                return
+            async with pond.lock:
+                if not pond.evicted:
+                    yield pond
+                    return
+
+    def _drop(self, user_id: int, pond: Pond):
+        pond.evicted = True
+        self.shards[self._shard(user_id)].pop(user_id, None)
+        for fish_id in pond.fishes:
+            self.fish_owner.pop(fish_id, None)
+
+    def resident(self, user_id: int) -> Optional[Pond]:
+        """返回常驻内存的鱼塘（不加载、不加锁，只读）"""
+        return self.shards[self._shard(user_id)].get(user_id)
+
+    # ---------- 读写操作 ----------
+
+    async def get_state(self, user_id: int, db: AsyncSession) -> Optional[Pond]:
+        """读取鱼塘（跨天时在内存中重置饲料）"""
+        async with self._locked(user_id, db) as pond:
+            if pond is not None and game_rules.reset_daily_feed(pond.user):
+                pond.user_dirty = True
+            return pond
+
+    async def feed(self, fish_id: int, db: AsyncSession, ip_address: Optional[str], user_agent: Optional[str]):
+        """喂食，返回 (结果, 鱼状态, 剩余饲料)"""
+        user_id = await self.owner_of(fish_id, db)
+        if user_id is None:
+            return FeedOutcome.NOT_FOUND, None, 0
+
+        async with self._locked(user_id, db) as pond:
+            fish = pond.fishes.get(fish_id) if pond else None
+            if fish is None:
+                return FeedOutcome.NOT_FOUND, None, 0
+            if fish.status == FishStatus.DEAD:
+                return FeedOutcome.DEAD, fish, 0
+
+            if game_rules.reset_daily_feed(pond.user):
+                pond.user_dirty = True
+            if pond.user.daily_feed_count <= 0:
+                return FeedOutcome.NO_FEED, fish, 0
+
+            status_before = fish.status
+            game_rules.apply_feed(fish, pond.user)
+            pond.pending_events.extend(
+                outbox.event_row(event_type, user_id, payload)
+                for event_type, payload in game_rules.feed_events(fish, pond.user, status_before)
+            )
+            pond.user_dirty = True
+            pond.dirty_fish.add(fish_id)
+            pond.pending_records.append({
+                "user_id": user_id,
+                "fish_id": fish_id,
+                "ip_address": ip_address,
+                "user_agent": user_agent,
+                "created_at": datetime.utcnow(),
+            })
+            return FeedOutcome.OK, fish, pond.user.daily_feed_count
+
+    def fish_added(self, fish: Fish):
+        """新鱼写库成功后放入已加载的鱼塘"""
+        pond = self.shards[self._shard(fish.user_id)].get(fish.user_id)
+        if pond is not None and not pond.evicted:
+            pond.fishes[fish.id] = _copy(fish, FishState)
+            self.fish_owner[fish.id] = fish.user_id
+
+    def coupon_added(self, user_id: int, coupon):
+        """批量发放的优惠券写库成功后放入已加载的鱼塘"""
+        pond = self.shards[self._shard(user_id)].get(user_id)
+        if pond is not None and not pond.evicted:
+            pond.coupons[coupon.id] = _copy(coupon, CouponState)
+
+    def coupon_redeemed(self, user_id: int, coupon_id: int):
+        """核销后移除内存中的优惠券"""
+        pond = self.shards[self._shard(user_id)].get(user_id)
+        if pond is not None:
+            pond.coupons.pop(coupon_id, None)
+
+    async def owner_of(self, fish_id: int, db: AsyncSession) -> Optional[int]:
+        user_id = self.fish_owner.get(fish_id)
+        if user_id is None:
+            result = await db.execute(select(Fish.user_id).where(Fish.id == fish_id))
+            user_id = result.scalar_one_or_none()
+        return user_id
+
+    @asynccontextmanager
+    async def synchronous(self, user_id: int, db: AsyncSession):
+        """
+        同步写操作（收获）：锁定鱼塘，把该用户的脏数据写入当前事务，
+        调用方在同一事务里继续写库（不要自行提交）；正常退出时提交并淘汰内存鱼塘，
+        下次访问重新加载。未常驻的用户在操作期间持有分片锁，防止被并发加载。
+        """
+        index = self._shard(user_id)
+        shard = self.shards[index]
+        while True:
+            pond = shard.get(user_id)
+            if pond is None:
+                async with self.shard_locks[index]:
+                    if user_id in shard:
+                        continue
+                    yield
+                    await db.commit()
+                    return
+
+            async with pond.lock:
+                if pond.evicted:
+                    continue
+                if pond.flushing is not None:
+                    # 等待进行中的写回，避免旧值覆盖本次提交（写回在取得写会话后才置位，
+                    # SQLite tuned 模式下本请求持有写锁时不会有进行中的写回）
+                    await pond.flushing.wait()
+                batch = self._take(pond)
+                try:
+                    await self._write(db, [batch])
+                    yield
+                    await db.commit()
+                except BaseException:
+                    self._restore(batch)
+                    raise
+                self._drop(user_id, pond)
+                return
+
+    # ---------- 写回与淘汰 ----------
+
+    def _take(self, pond: Pond) -> _Batch:
+        user = None
+        if pond.user_dirty:
+            user = {
+                "b_id": pond.user.id,
+                "daily_feed_count": pond.user.daily_feed_count,
+                "last_feed_date": pond.user.last_feed_date,
+                "total_coupons_earned": pond.user.total_coupons_earned,
+            }
+        fishes = [
+            {
+                "b_id": f.id,
+                "status": f.status,
+                "hunger": f.hunger,
+                "health": f.health,
+                "growth": f.growth,
+            }
+            for f in (pond.fishes.get(i) for i in pond.dirty_fish) if f is not None
+        ]
+        batch = _Batch(pond, user, fishes, pond.pending_records, pond.pending_events)
+        pond.user_dirty = False
+        pond.dirty_fish = set()
+        pond.pending_records = []
+        pond.pending_events = []
+        return batch
+
+    def _restore(self, batch: _Batch):
+        pond = batch.pond
+        pond.user_dirty = pond.user_dirty or batch.user is not None
+        pond.dirty_fish |= {f["b_id"] for f in batch.fishes}
+        pond.pending_records = batch.records + pond.pending_records
+        pond.pending_events = batch.events + pond.pending_events
+
+    async def _write(self, db: AsyncSession, batches: List[_Batch]):
+        """按 用户 → 鱼 → 喂食记录 → 事件 的顺序写入（不提交）"""
+        now = datetime.utcnow()
+        users = [dict(b.user, updated_at=now) for b in batches if b.user]
+        fishes = [dict(f, updated_at=now) for b in batches for f in b.fishes]
+        records = [r for b in batches for r in b.records]
+
+        if users:
+            users_table = User.__table__
+            await db.execute(
+                update(users_table).where(users_table.c.id == bindparam("b_id")).values(
+                    daily_feed_count=bindparam("daily_feed_count"),
+                    last_feed_date=bindparam("last_feed_date"),
+                    total_coupons_earned=bindparam("total_coupons_earned"),
+                    updated_at=bindparam("updated_at"),
+                ),
+                users,
+            )
+        if fishes:
+            fishes_table = Fish.__table__
+            await db.execute(
+                update(fishes_table).where(fishes_table.c.id == bindparam("b_id")).values(
+                    status=bindparam("status"),
+                    hunger=bindparam("hunger"),
+                    health=bindparam("health"),
+                    growth=bindparam("growth"),
+                    updated_at=bindparam("updated_at"),
+                ),
+                fishes,
+            )
+        if records:
+            await db.execute(insert(FeedingRecord.__table__), records)
+        await outbox.record_events(db, [e for b in batches for e in b.events])
+
+    async def flush(self, evict_idle: bool = True) -> int:
+        """写回所有脏鱼塘并淘汰空闲鱼塘，返回写回的鱼塘数"""
+        batches: List[_Batch] = []
+        if any(pond.dirty for shard in self.shards for pond in shard.values()):
+            try:
+                # 先进入写会话再认领脏数据：SQLite tuned 模式下收获在持有写锁时等待 flushing，
+                # 若先认领再排队等写锁，两边会互相等待
+                async with write_session() as db:
+                    batches = self._claim()
+                    if batches:
+                        await self._write(db, batches)
+                        await db.commit()
+            except Exception:
+                for batch in batches:
+                    self._restore(batch)
+                metrics.inc("pond_engine_flush_errors_total", help="鱼塘写回失败次数")
+                raise
+            finally:
+                for batch in batches:
+                    batch.pond.flushing.set()
+                    batch.pond.flushing = None
+            if batches:
+                metrics.inc("pond_engine_flushes_total", help="鱼塘写回次数")
+
+        if evict_idle:
+            self._evict()
+        metrics.set_gauge(
+            "pond_engine_resident", sum(len(s) for s in self.shards), help="常驻内存的鱼塘数"
+        )
+        return len(batches)
+
+    def _claim(self) -> List[_Batch]:
+        batches = []
+        for shard in self.shards:
+            for pond in shard.values():
+                # 正在处理同步写操作的鱼塘留到下一轮
+                if pond.dirty and not pond.lock.locked():
+                    batches.append(self._take(pond))
+                    pond.flushing = asyncio.Event()
+        return batches
+
+    def _evict(self):
+        deadline = time.monotonic() - POND_IDLE_SECONDS
+        for shard in self.shards:
+            for user_id, pond in list(shard.items()):
+                over_capacity = len(shard) > POND_SHARD_CAPACITY
+                if not over_capacity and pond.last_access > deadline:
+                    # OrderedDict 按访问顺序排列，后面的更新
+                    break
+                if pond.dirty or pond.lock.locked():
+                    continue
+                self._drop(user_id, pond)
+
+    async def run_flusher(self):
+        try:
+            while True:
+                await asyncio.sleep(POND_FLUSH_SECONDS)
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("鱼塘写回失败，下个周期重试")
+        finally:
+            # 关闭时把剩余的脏数据全部写回
+            await self.flush(evict_idle=False)
+
+
+engine = PondEngine() if POND_ENGINE == "memory" else None
+
+if engine is not None:
+    register_background(engine.run_flusher)
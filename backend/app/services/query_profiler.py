@@ -0,0 +1,178 @@
+"""
+SQL 查询分析器（慢查询日志 + N+1 检测）
+
+基于 SQLAlchemy 的 cursor 事件钩子，按请求采样：
+- 超过阈值的语句记录耗时、来源路由和参数形状（只记录类型，不记录值）
+- 同一请求内同一语句模板执行次数超过 N 次时告警（例如循环里的 db.get）
+- 测试中可用 query_budget() 固定某个接口的查询预算（只统计请求内执行的语句，
+  后台任务如事件中继、活动轮询、过滤器同步不计入；组提交写入器发出的 BEGIN/SAVEPOINT 等事务控制语句也不计入）
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+import logging
+import os
+import random
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger("app.sql")
+
+# 慢查询阈值（毫秒）
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# 请求采样率（0 ~ 1），未采样的请求不计时
+QUERY_PROFILE_SAMPLE_RATE = float(os.getenv("QUERY_PROFILE_SAMPLE_RATE", "1.0"))
+# 同一请求内同一语句模板的最大执行次数，超过即视为 N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+
+def route_template(scope: dict) -> str:
+    """请求的路由模板，如 "POST /api/game/fish/feed/{fish_id}"（路由匹配前为实际路径）"""
+    # 路由匹配后 Starlette 会把 route 写回 scope；
+    # 子路由的 route.path 可能不含前缀，按段数从实际路径补回
+    path = scope.get("path", "")
+    template = getattr(scope.get("route"), "path", None)
+    if template:
+        parts = path.split("/")
+        prefix = "/".join(parts[:len(parts) - len(template.split("/")) + 1])
+        path = prefix + template
+    return f"{scope.get('method', '')} {path}".strip()
+
+
+@dataclass
+class RequestQueryStats:
+    """单个请求的查询统计"""
+    scope: dict
+    sampled: bool
+    total: int = 0
+    templates: Counter = field(default_factory=Counter)
+
+    @property
+    def route(self) -> str:
+        return route_template(self.scope)
+
+
+@dataclass
+class QueryBudget:
+    """测试用查询计数器"""
+    limit: int
+    route: Optional[str] = None
+    count: int = 0
+    statements: list = field(default_factory=list)
+
+
+# 事务控制语句（与接口本身的查询无关，取决于所用的写入方式）
+_TRANSACTION_CONTROL = ("BEGIN", "SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+_current: ContextVar[Optional[RequestQueryStats]] = ContextVar("query_stats", default=None)
+_budgets: list = []
+
+
+def _params_shape(parameters, executemany: bool) -> str:
+    """参数形状：只保留类型，避免把用户数据写进日志"""
+    if executemany:
+        return f"executemany x{len(parameters)}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(v).__name__ for v in parameters) + ")"
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None and stats.sampled:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        # 请求之外（后台任务）的语句
+        return
+    route = stats.route
+
+    if _budgets and not statement.startswith(_TRANSACTION_CONTROL):
+        for budget in _budgets:
+            if budget.route is None or budget.route == route:
+                budget.count += 1
+                budget.statements.append(statement)
+
+    stats.total += 1
+    stats.templates[statement] += 1
+
+    started = getattr(context, "_query_start", None)
+    if started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning(
+            "slow query %.1fms route=%s params=%s sql=%s",
+            elapsed_ms, route, _params_shape(parameters, executemany), " ".join(statement.split()),
+        )
+
+
+def install_query_profiler(engine: AsyncEngine):
+    """在引擎上注册事件钩子"""
+    sync_engine = engine.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _report(stats: RequestQueryStats):
+    """请求结束时检查 N+1"""
+    for statement, count in stats.templates.items():
+        if count > N_PLUS_ONE_THRESHOLD:
+            logger.warning(
+                "possible N+1 route=%s count=%d total=%d sql=%s",
+                stats.route, count, stats.total, " ".join(statement.split()),
+            )
+
+
+class QueryProfilerMiddleware:
+    """为每个 HTTP 请求建立查询统计上下文"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats(
+            scope=scope,
+            sampled=random.random() < QUERY_PROFILE_SAMPLE_RATE,
+        )
+        token = _current.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            if stats.sampled:
+                _report(stats)
+
+
+@contextmanager
+def query_budget(limit: int, route: Optional[str] = None):
+    """
+    测试断言：代码块内的请求（可限定路由，如 "POST /api/game/fish/feed/{fish_id}"）
+    执行的 SQL 语句数不得超过 limit；请求之外的语句不计入
+    """
+    budget = QueryBudget(limit=limit, route=route)
+    _budgets.append(budget)
+    try:
+        yield budget
+    finally:
+        _budgets.remove(budget)
+    if budget.count > limit:
+        detail = "\n".join(" ".join(s.split()) for s in budget.statements)
+        raise AssertionError(
+            f"查询预算超限: {budget.count} > {limit} ({route or '全部路由'})\n{detail}"
+        )
@@ -0,0 +1,33 @@
+"""
+Redis 连接（可选）
+
+未配置 REDIS_URL 或未安装 redis 包时 get_redis() 返回 None，
+调用方应退回进程内实现。
+"""
+
+from typing import Optional
+import os
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover
+    aioredis = None
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+_client = None
+
+
+def get_redis() -> Optional["aioredis.Redis"]:
+    """共享的 Redis 客户端（自带连接池）"""
+    global _client
+    if _client is None and REDIS_URL and aioredis is not None:
+        _client = aioredis.from_url(REDIS_URL, decode_responses=True)
+    return _client
+
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,154 @@
+"""
+优惠券发放/核销时间分桶汇总
+
+汇总由事件发件箱的 rollups 消费者维护：fish.harvested / coupon.granted（批量活动发放）/
+coupon.redeemed 事件按桶合并后对 coupon_rollups 做 upsert 累加，与消费检查点在同一事务提交（恰好一次），不占用请求路径。
+时间序列查询只读汇总表，不扫描 coupons。按天聚合由小时桶合并而来。
+
+历史数据回填（只覆盖仍在热表中的优惠券，已冷归档的不计入）：
+    python -m app.services.rollups --rebuild
+"""
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete
+from datetime import datetime
+from typing import List, Optional
+import argparse
+import asyncio
+import json
+
+from app.database import engine, async_session_maker
+from app.models.models import Coupon, CouponRollup, AdminUser
+from app.services.outbox import Event, register_consumer
+
+_COUNTERS = ("issued_count", "issued_value", "redeemed_count", "redeemed_value")
+
+
+def hour_bucket(when: datetime) -> datetime:
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def _insert():
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def _accumulate(db: AsyncSession, bucket: datetime, store_id: str, **increments):
+    values = {name: increments.get(name, 0) for name in _COUNTERS}
+    stmt = _insert()(CouponRollup).values(bucket=bucket, store_id=store_id, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CouponRollup.bucket, CouponRollup.store_id],
+        set_={
+            name: getattr(CouponRollup, name) + getattr(stmt.excluded, name)
+            for name in _COUNTERS if name in increments
+        },
+    )
+    await db.execute(stmt)
+
+
+@register_consumer("rollups", event_types={"fish.harvested", "coupon.granted", "coupon.redeemed"})
+async def apply_events(db: AsyncSession, events: List[Event]):
+    """把一批发放/核销事件合并到各小时桶后写入"""
+    buckets = {}
+    for e in events:
+        if e.event_type in ("fish.harvested", "coupon.granted"):
+            key = (hour_bucket(datetime.fromisoformat(e.payload["issued_at"])), "")
+            prefix = "issued"
+        else:
+            key = (hour_bucket(datetime.fromisoformat(e.payload["used_at"])), e.payload.get("store_id") or "")
+            prefix = "redeemed"
+        counters = buckets.setdefault(key, {})
+        counters[f"{prefix}_count"] = counters.get(f"{prefix}_count", 0) + 1
+        counters[f"{prefix}_value"] = counters.get(f"{prefix}_value", 0) + e.payload["value"]
+
+    for (bucket, store_id), increments in buckets.items():
+        await _accumulate(db, bucket, store_id, **increments)
+
+
+async def query_timeseries(
+    db: AsyncSession,
+    start: datetime,
+    end: datetime,
+    granularity: str = "hour",
+    store_id: Optional[str] = None,
+    by_store: bool = False,
+) -> list:
+    """读取汇总表，按小时或天返回各桶的发放/核销数量和金额"""
+    stmt = select(CouponRollup).where(
+        CouponRollup.bucket >= hour_bucket(start),
+        CouponRollup.bucket < end,
+    )
+    if store_id is not None:
+        stmt = stmt.where(CouponRollup.store_id == store_id)
+    result = await db.execute(stmt.order_by(CouponRollup.bucket))
+
+    points = {}
+    for row in result.scalars():
+        bucket = row.bucket
+        if granularity == "day":
+            bucket = bucket.replace(hour=0)
+        key = (bucket, row.store_id if by_store else None)
+        point = points.setdefault(key, {name: 0 for name in _COUNTERS})
+        for name in _COUNTERS:
+            point[name] += getattr(row, name)
+
+    return [
+        {"bucket": bucket, "store_id": store, **counters}
+        for (bucket, store), counters in sorted(points.items(), key=lambda kv: (kv[0][0], kv[0][1] or ""))
+    ]
+
+
+async def rebuild_rollups() -> int:
+    """从 coupons 全量重建汇总表，返回写入的桶数"""
+    issued = {}
+    redeemed = {}
+    async with async_session_maker() as db:
+        result = await db.stream(select(Coupon.created_at, Coupon.value).execution_options(yield_per=5000))
+        async for created_at, value in result:
+            counters = issued.setdefault(hour_bucket(created_at), [0, 0])
+            counters[0] += 1
+            counters[1] += value
+
+        result = await db.stream(
+            select(Coupon.used_at, Coupon.value, AdminUser.store_id)
+            .outerjoin(AdminUser, AdminUser.username == Coupon.used_by)
+            .where(Coupon.used == True, Coupon.used_at.is_not(None))
+            .execution_options(yield_per=5000)
+        )
+        async for used_at, value, store_id in result:
+            counters = redeemed.setdefault((hour_bucket(used_at), store_id or ""), [0, 0])
+            counters[0] += 1
+            counters[1] += value
+
+        rows = {}
+        for bucket, (count, value) in issued.items():
+            rows[(bucket, "")] = CouponRollup(
+                bucket=bucket, store_id="", issued_count=count, issued_value=value,
+                redeemed_count=0, redeemed_value=0,
+            )
+        for key, (count, value) in redeemed.items():
+            row = rows.setdefault(key, CouponRollup(
+                bucket=key[0], store_id=key[1], issued_count=0, issued_value=0,
+            ))
+            row.redeemed_count = count
+            row.redeemed_value = value
+
+        await db.execute(delete(CouponRollup))
+        db.add_all(rows.values())
+        await db.commit()
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="优惠券汇总表维护")
+    parser.add_argument("--rebuild", action="store_true", help="从 coupons 全量重建")
+    args = parser.parse_args()
+    if args.rebuild:
+        print(json.dumps({"buckets": asyncio.run(rebuild_rollups())}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+精选鱼塘展示快照
+
+落地页“参观精选鱼塘”每个访客都会请求，因此不在请求里查库：后台每 SHOWCASE_REBUILD_SECONDS
+秒从数据库（开启内存鱼塘引擎时优先取常驻内存的状态，与 get_game_state 同源）构建一次快照，
+序列化为 JSON 并预先 gzip 压缩。快照不可变，重建时整体替换引用。
+
+- ETag 为内容哈希：JSON 按键排序、gzip 不写时间戳，内容不变则各 worker 的 ETag 一致；
+  gzip 表示的 ETag 加 -gz 后缀，与未压缩表示区分
+- 版本号只在内容变化时递增（本 worker 内计数，通过 X-Showcase-Version 响应头暴露）
+- 只展示鱼和收获总数，不包含优惠券码
+
+精选鱼塘由 SHOWCASE_USER_IDS 指定（逗号分隔），为空时取总榜前 SHOWCASE_SIZE 名。
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from sqlalchemy import select
+
+from app.database import read_session_maker
+from app.models.models import User, Fish
+from app.services import leaderboard, metrics, pond_engine
+from app.services.startup import register_warmup, register_background
+
+logger = logging.getLogger("app.showcase")
+
+# 精选鱼塘的用户 id（逗号分隔），为空时取总榜前几名
+SHOWCASE_USER_IDS = [int(x) for x in os.getenv("SHOWCASE_USER_IDS", "").split(",") if x.strip()]
+SHOWCASE_SIZE = int(os.getenv("SHOWCASE_SIZE", "6"))
+# 快照重建间隔（秒）
+SHOWCASE_REBUILD_SECONDS = float(os.getenv("SHOWCASE_REBUILD_SECONDS", "60"))
+# 浏览器/CDN 缓存时长（秒），过期后用 If-None-Match 复验
+SHOWCASE_MAX_AGE = int(os.getenv("SHOWCASE_MAX_AGE", "30"))
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    version: int
+    etag: str
+    body: bytes
+    gzipped: bytes
+    built_at: datetime
+
+    @property
+    def gzip_etag(self) -> str:
+        return self.etag[:-1] + '-gz"'
+
+
+_index: Optional[Snapshot] = None
+_ponds: Dict[int, Snapshot] = {}
+
+
+def current() -> Optional[Snapshot]:
+    """全部精选鱼塘的快照（尚未构建时为 None）"""
+    return _index
+
+
+def pond(user_id: int) -> Optional[Snapshot]:
+    """单个精选鱼塘的快照"""
+    return _ponds.get(user_id)
+
+
+def _fish_payload(fish) -> dict:
+    # ORM 对象和内存引擎的 FishState 字段同名
+    return {
+        "id": fish.id,
+        "fish_type": fish.fish_type.value,
+        "status": fish.status.value,
+        "hunger": fish.hunger,
+        "health": fish.health,
+        "growth": fish.growth,
+        "pos_x": fish.pos_x,
+        "pos_y": fish.pos_y,
+        "created_at": fish.created_at.isoformat(),
+    }
+
+
+def _freeze(content, previous: Optional[Snapshot], now: datetime) -> Snapshot:
+    body = json.dumps(content, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    if previous is not None and previous.etag == etag:
+        return previous
+    return Snapshot(
+        version=(previous.version + 1) if previous else 1,
+        etag=etag,
+        body=body,
+        gzipped=gzip.compress(body, compresslevel=9, mtime=0),
+        built_at=now,
+    )
+
+
+async def _featured() -> List[int]:
+    if SHOWCASE_USER_IDS:
+        return SHOWCASE_USER_IDS
+    top, _ = await leaderboard.get_top("all", 0, SHOWCASE_SIZE)
+    return [user_id for user_id, _ in top]
+
+
+async def rebuild() -> int:
+    """重建全部快照，返回精选鱼塘数"""
+    global _index, _ponds
+    user_ids = await _featured()
+    users = {}
+    fishes: Dict[int, list] = {user_id: [] for user_id in user_ids}
+    if user_ids:
+        async with read_session_maker() as db:
+            result = await db.execute(
+                select(User.id, User.username, User.total_coupons_earned).where(User.id.in_(user_ids))
+            )
+            users = {row.id: row for row in result.all()}
+            result = await db.execute(
+                select(Fish).where(Fish.user_id.in_(user_ids)).order_by(Fish.id)
+            )
+            for fish in result.scalars():
+                fishes[fish.user_id].append(fish)
+
+    now = datetime.utcnow()
+    ponds = []
+    for user_id in user_ids:
+        user = users.get(user_id)
+        if user is None:
+            continue
+        coupons_earned = user.total_coupons_earned
+        pond_fishes = fishes[user_id]
+        if pond_engine.engine is not None:
+            resident = pond_engine.engine.resident(user_id)
+            if resident is not None:
+                pond_fishes = sorted(resident.fishes.values(), key=lambda f: f.id)
+                coupons_earned = resident.user.total_coupons_earned
+        ponds.append({
+            "user_id": user_id,
+            "username": user.username,
+            "total_coupons_earned": coupons_earned,
+            "fishes": [_fish_payload(f) for f in pond_fishes],
+        })
+
+    new_ponds = {p["user_id"]: _freeze(p, _ponds.get(p["user_id"]), now) for p in ponds}
+    new_index = _freeze({"ponds": ponds}, _index, now)
+    _ponds, _index = new_ponds, new_index
+
+    metrics.set_gauge("showcase_ponds", len(ponds), help="精选鱼塘数")
+    metrics.set_gauge("showcase_version", new_index.version, help="精选鱼塘快照版本")
+    return len(ponds)
+
+
+@register_warmup
+async def build_showcase():
+    await rebuild()
+
+
+@register_background
+async def rebuild_periodically():
+    while True:
+        await asyncio.sleep(SHOWCASE_REBUILD_SECONDS)
+        try:
+            await rebuild()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("精选鱼塘快照重建失败")
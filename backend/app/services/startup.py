@@ -0,0 +1,67 @@
+"""
+Worker 启动流程与就绪状态
+
+启动顺序：schema 版本检查（必要时 DDL）→ 连接池预热 → 各缓存预热 → 启动后台任务 → 标记就绪。
+uvicorn 在启动流程完成后才开始接受连接，此前探针连不上端口；/ready 返回 200 表示已完成预热。
+关闭时先回到 503（仍在处理中的连接上的探针可见），再停止后台任务、释放连接。
+"""
+
+from typing import Awaitable, Callable, List
+import asyncio
+import time
+
+from app.database import init_db, warm_up_pool, close_db
+from app.services import metrics
+from app.services.redis_client import close_redis
+
+# 模块导入时间近似为 worker 进程开始加载应用的时间
+_IMPORTED_AT = time.perf_counter()
+
+_warmups: List[Callable[[], Awaitable[None]]] = []
+_background: List[Callable[[], Awaitable[None]]] = []
+_tasks: List[asyncio.Task] = []
+
+state = {
+    "ready": False,
+    "ddl_executed": None,
+    "cold_start_seconds": None,
+}
+
+
+def register_warmup(fn: Callable[[], Awaitable[None]]):
+    """注册启动时执行的缓存预热函数（可作装饰器使用）"""
+    _warmups.append(fn)
+    return fn
+
+
+def register_background(fn: Callable[[], Awaitable[None]]):
+    """注册随 worker 运行的后台协程（关闭时取消，可作装饰器使用）"""
+    _background.append(fn)
+    return fn
+
+
+async def startup():
+    """执行启动流程并记录冷启动耗时"""
+    state["ddl_executed"] = await init_db()
+    await warm_up_pool()
+    for warmup in _warmups:
+        await warmup()
+    for fn in _background:
+        _tasks.append(asyncio.create_task(fn(), name=fn.__qualname__))
+
+    elapsed = time.perf_counter() - _IMPORTED_AT
+    state["cold_start_seconds"] = round(elapsed, 3)
+    state["ready"] = True
+    metrics.set_gauge("app_cold_start_seconds", elapsed, help="Worker 从加载应用到就绪的耗时")
+    metrics.set_gauge("app_startup_ddl_executed", int(state["ddl_executed"]), help="本次启动是否执行了 DDL")
+
+
+async def shutdown():
+    """标记为未就绪，停止后台任务，释放连接"""
+    state["ready"] = False
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    await close_redis()
+    await close_db()
@@ -0,0 +1,216 @@
+"""
+结构化 JSON 日志（不阻塞事件循环）
+
+- 所有日志经根 logger 的队列 handler 放入有界队列，由后台线程序列化为一行 JSON 写到 stdout；
+  请求协程里只做参数合并，不做 I/O
+- 队列满时丢弃新记录并计入 log_records_dropped_total，不等待
+- 每个请求带 request_id（沿用 X-Request-ID 请求头，否则生成），写入日志并回写到响应头
+- 按路由采样：LOG_SAMPLE_RATES 中的高频接口（如喂食）只保留部分请求的 INFO 及以下日志
+  （同一请求的日志要么全保留要么全丢弃），WARNING 及以上始终保留
+- LOG_SQL=1 时输出 SQLAlchemy 语句日志（同样走队列和采样），替代 echo=True
+
+输出示例：
+    {"ts": "2025-01-01T00:00:00.000Z", "level": "INFO", "logger": "app.access", "msg": "request",
+     "request_id": "3f2a...", "route": "POST /api/game/fish/feed/{fish_id}", "status": 200, "duration_ms": 4.2}
+"""
+
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+from app.services import metrics
+from app.services.query_profiler import route_template
+
+# 日志级别
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# 队列容量（条），满了直接丢弃
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# 按路由的采样率，格式 "METHOD 路由模板=比例,..."
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "POST /api/game/fish/feed/{fish_id}=0.1")
+# 是否输出 SQL 语句
+LOG_SQL = os.getenv("LOG_SQL", "0") == "1"
+
+_REQUEST_ID_MAX_LENGTH = 64
+
+# LogRecord 自带的属性，其余的视为 extra 字段输出
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "route"}
+
+access_logger = logging.getLogger("app.access")
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        if "=" in item:
+            route, rate = item.rsplit("=", 1)
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+_sample_rates = parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+@dataclass
+class RequestContext:
+    request_id: str
+    scope: dict
+    sampled: Optional[bool] = None
+
+    def is_sampled(self) -> bool:
+        # 路由匹配后才知道模板，第一次记录日志时决定
+        if self.sampled is None:
+            rate = _sample_rates.get(route_template(self.scope), 1.0)
+            self.sampled = rate >= 1 or random.random() < rate
+        return self.sampled
+
+
+_context: ContextVar[Optional[RequestContext]] = ContextVar("log_context", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """一条记录一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("request_id", "route"):
+            value = getattr(record, key, None)
+            if value:
+                entry[key] = value
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestFilter(logging.Filter):
+    """附加 request_id / route，并按路由采样（在调用方线程执行）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = _context.get()
+        if ctx is None:
+            return True
+        if record.levelno < logging.WARNING and not ctx.is_sampled():
+            return False
+        record.request_id = ctx.request_id
+        record.route = route_template(ctx.scope)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """非阻塞入队，队列满时丢弃并计数"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只合并参数、展开异常（traceback 不能留到其他线程再格式化），JSON 序列化交给后台线程
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total", help="日志队列已满而丢弃的记录数")
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+_running = False
+
+
+def configure_logging():
+    """安装队列 handler 并启动写日志线程（可重复调用）"""
+    global _handler, _listener, _running
+    if _handler is None:
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _handler = DroppingQueueHandler(log_queue)
+        _handler.addFilter(RequestFilter())
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter())
+        _listener = QueueListener(log_queue, output)
+
+        root = logging.getLogger()
+        root.handlers = [_handler]
+        root.setLevel(LOG_LEVEL)
+        if LOG_SQL:
+            logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+    if not _running:
+        _listener.start()
+        _running = True
+
+
+def shutdown_logging():
+    """写完队列中剩余的日志后停止后台线程"""
+    global _running
+    if _running:
+        _listener.stop()
+        _running = False
+
+
+class RequestLoggingMiddleware:
+    """分配 request_id 并在请求结束时输出一条访问日志"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:_REQUEST_ID_MAX_LENGTH]
+                break
+        ctx = RequestContext(request_id=request_id or uuid.uuid4().hex, scope=scope)
+        token = _context.set(ctx)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", ctx.request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # 5xx 按 WARNING 记录，不受采样影响
+            access_logger.log(
+                logging.WARNING if status >= 500 else logging.INFO,
+                "request",
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                },
+            )
+            _context.reset(token)
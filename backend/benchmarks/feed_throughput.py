@@ -0,0 +1,165 @@
+"""
+喂食吞吐基准（SQLite）
+
+在进程内通过 ASGI 直接调用应用，用一个全新的 SQLite 文件库：
+预先写入 N 个用户各一条鱼，并发喂食（每条鱼喂满当日 10 次），
+同时有若干协程以固定节奏（每 READ_INTERVAL 秒一次）查询优惠券列表，模拟门店的读负载。
+
+参考结果（单核容器，ext4，fsync ≈ 0.05ms；默认参数 200 用户 / 50 并发 / 4 个查询协程，--runs 3）：
+
+    default  166.1–196.9 喂食/s  p50 181–211ms  p95 512–629ms  查询 20.0–21.6/s
+    tuned    137.3–210.5 喂食/s  p50 223–372ms  p95 300–499ms  查询 109.9–117.9/s
+
+进程内基准的喂食吞吐受限于 Python 自身的 CPU（单次喂食约 5ms），两种配置的喂食吞吐没有稳定差别；
+tuned 的收益只体现在查询吞吐（约 5 倍，查询不再被写事务阻塞）和写入尾延迟上。
+因此 SQLITE_PROFILE 默认仍为 default，读多写少或 fsync 慢的部署可按实测结果开启 tuned。
+
+应用内异常（如 default 配置下的 database is locked）按错误计数；单次运行超过 --timeout 秒
+或进程崩溃时该次结果记为 failed，其余配置照常对比。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.feed_throughput                     # 对比 default / tuned 两种配置
+    python -m benchmarks.feed_throughput --profile tuned --users 500 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 每个查询协程两次查询之间的间隔（秒）
+READ_INTERVAL = 0.025
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(users: int, concurrency: int, readers: int) -> dict:
+    # 必须在设置好环境变量之后再导入应用
+    import httpx
+    from sqlalchemy import insert
+
+    from app.main import app
+    from app.database import engine
+    from app.models.models import User, Fish, FishType
+    from app.services import startup
+
+    # 访问日志会与结果一起写到 stdout
+    logging.getLogger("app.access").setLevel(logging.WARNING)
+    await startup.startup()
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(insert(User), [{"id": i, "username": f"bench{i}"} for i in range(1, users + 1)])
+            await conn.execute(insert(Fish), [
+                {"id": i, "user_id": i, "fish_type": FishType.QINGJIANG} for i in range(1, users + 1)
+            ])
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for _ in range(10):
+            for fish_id in range(1, users + 1):
+                queue.put_nowait(fish_id)
+
+        latencies = []
+        errors = 0
+        reads = 0
+        done = asyncio.Event()
+        # 应用内异常（如 default 配置下的 database is locked）按 500 计入错误，不中断基准
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def feeder():
+                nonlocal errors
+                while not queue.empty():
+                    fish_id = queue.get_nowait()
+                    started = time.perf_counter()
+                    response = await client.post(f"/api/game/fish/feed/{fish_id}")
+                    latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200 or not response.json()["success"]:
+                        errors += 1
+
+            async def reader(n):
+                nonlocal reads
+                user_id = n % users + 1
+                while not done.is_set():
+                    response = await client.get(f"/api/game/coupons/{user_id}")
+                    if response.status_code == 200:
+                        reads += 1
+                    await asyncio.sleep(READ_INTERVAL)
+                    user_id = user_id % users + 1
+
+            reader_tasks = [asyncio.create_task(reader(n)) for n in range(readers)]
+            started = time.perf_counter()
+            await asyncio.gather(*(feeder() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            await asyncio.gather(*reader_tasks)
+    finally:
+        await startup.shutdown()
+
+    return {
+        "feeds": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "feeds_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "reads_per_second": round(reads / elapsed, 1),
+    }
+
+
+def _run_profile(profile: str, args) -> dict:
+    """每种配置在独立进程里运行（引擎在导入时按环境变量创建）；超时或崩溃时返回错误说明"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            SQLITE_PROFILE=profile,
+            DATABASE_URL=f"sqlite+aiosqlite:///{tmp}/bench.db",
+        )
+        try:
+            completed = subprocess.run(
+                [sys.executable, "-m", "benchmarks.feed_throughput", "--profile", profile,
+                 "--users", str(args.users), "--concurrency", str(args.concurrency),
+                 "--readers", str(args.readers), "--child"],
+                env=env, capture_output=True, text=True, timeout=args.timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return {"failed": f"超过 {args.timeout} 秒未完成"}
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines()
+        return {"failed": lines[-1] if lines else f"退出码 {completed.returncode}"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 喂食吞吐基准")
+    parser.add_argument("--profile", choices=["default", "tuned"], help="只跑一种配置")
+    parser.add_argument("--users", type=int, default=200, help="用户（鱼）数量，每条鱼喂 10 次")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发喂食协程数")
+    parser.add_argument("--readers", type=int, default=4, help="并发查询协程数")
+    parser.add_argument("--runs", type=int, default=1, help="每种配置重复次数")
+    parser.add_argument("--timeout", type=float, default=120, help="单次运行的超时（秒）")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = asyncio.run(run(args.users, args.concurrency, args.readers))
+        print(json.dumps(result))
+        return
+
+    for _ in range(args.runs):
+        for profile in [args.profile] if args.profile else ["default", "tuned"]:
+            print(profile, json.dumps(_run_profile(profile, args), ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+合成数据生成器（大规模数据集）
+
+按固定种子生成用户、鱼、优惠券和喂食记录，批量写入 DATABASE_URL 指向的库（SQLite 或 PostgreSQL），
+用于在真实数据量下检查索引、查询计划、分页和统计接口。相同的 --seed 与 --end 生成完全相同的数据。
+
+分布：
+- 用户分三类：一次性游客（约 70%，只来一天、喂几次）、普通玩家（约 25%，来几天）、
+  重度玩家（约 5%，几十天里每天几乎喂满）；注册时间在 --days 天内越近越密集
+- 喂食集中在午餐和晚餐时段，成长按 game_rules 的规则计算；成年的鱼按概率收获，
+  收获的鱼删除并生成 7 天有效的优惠券，之后按概率再领一条
+- 优惠券按用户类别以不同比例在过期前核销，核销人为各门店店员（--stores 个门店，每店 2 人），
+  其余的过期或仍在有效期内
+- 喂食记录与应用一致，收获后仍保留（指向已删除的鱼）；PostgreSQL 的外键不允许悬空记录，
+  只写入仍在鱼塘中的鱼的记录（记录 id 照常分配，留下空洞）
+- 不生成事件（outbox）；优惠券小时汇总在装载完成后从 coupons 全量重建
+
+写入方式：
+- 目标表必须为空（--reset 会先删除并重建全部表，包括管理员账号）
+- 按用户分块生成，主键显式分配（用户 id 随注册时间递增，其余表的 id 按用户顺序分配）；装载期间删除这四张表的二级索引，装载完成后重建
+- PostgreSQL 用 COPY（asyncpg copy_records_to_table），SQLite 每块一个事务、executemany 写入并关闭 synchronous
+- PostgreSQL 上装载完成后同步各表的自增序列
+
+参考结果（单核容器，SQLite，默认参数 100000 用户，约 530MB）：
+
+    users 100000  fishes 88789  coupons 331707（核销 121154，过期 176890）  feeding_records 2711860
+    用时 59.7s（含重建索引和汇总），约 65000 行/s
+
+用法（在 backend 目录下）：
+    DATABASE_URL=sqlite+aiosqlite:///./synthetic.db python -m benchmarks.synthetic_data --users 1000000
+    python -m benchmarks.synthetic_data --users 100000 --seed 7 --end 2025-06-01 --reset
+"""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple, Tuple
+import argparse
+import asyncio
+import enum
+import json
+import random
+import sys
+import time
+
+from sqlalchemy import select, insert, func, text
+
+from app.database import Base, engine, init_db
+from app.models.models import User, Fish, Coupon, FeedingRecord, AdminUser, FishType, FishStatus
+from app.services import catalogue, game_rules
+from app.services.passwords import hash_password
+from app.services.rollups import rebuild_rollups
+
+# 每块生成的用户数
+CHUNK_USERS = 5000
+# 一次到店（喂食加收获）最长持续的秒数
+VISIT_SECONDS = 1800
+# 每个用户鱼塘里最多同时养的鱼
+MAX_POND_SIZE = 5
+# 优惠券有效期（与收获接口一致）
+COUPON_DAYS = 7
+# 领到券后平均多久来店核销（秒）
+MEAN_REDEEM_DELAY = 1.5 * 86400
+
+# 鱼种权重（越贵的鱼越少人养）
+FISH_TYPE_WEIGHTS = {"qingjiang": 50, "lingbo": 25, "basha": 15, "jinmu": 10}
+# 各小时的到店权重（UTC+8 的午餐、晚餐高峰换算为 UTC）
+HOUR_WEIGHTS = [
+    8, 10, 12, 14, 12, 8, 4, 3,
+    4, 9, 13, 14, 10, 6, 3, 2,
+    1, 1, 1, 1, 1, 1, 2, 4,
+]
+USER_AGENTS = [
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 MicroMessenger/8.0.49",
+    "Mozilla/5.0 (Linux; Android 14; V2309A) AppleWebKit/537.36 Chrome/116.0 Mobile Safari/537.36 MicroMessenger/8.0.47",
+    "Mozilla/5.0 (Linux; Android 13; 22081212C) AppleWebKit/537.36 Chrome/112.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148 Safari/604.1",
+]
+
+
+class Segment(NamedTuple):
+    name: str
+    share: float
+    active_days: Tuple[int, int]    # 活跃天数范围
+    feeds_per_day: Tuple[int, int]  # 每个活跃日的喂食次数范围
+    harvest_rate: float             # 成年的鱼当天被收获的概率
+    readopt_rate: float             # 收获后再领一条的概率
+    redeem_rate: float              # 优惠券核销率（过期前）
+    phone_rate: float               # 绑定手机号的比例
+    openid_rate: float              # 绑定微信的比例
+
+
+SEGMENTS = (
+    Segment("guest", 0.70, (1, 1), (1, 5), 0.5, 0.1, 0.08, 0.02, 0.10),
+    Segment("casual", 0.25, (2, 8), (3, 10), 0.8, 0.6, 0.25, 0.30, 0.40),
+    Segment("heavy", 0.05, (20, 90), (8, 10), 0.95, 0.95, 0.45, 0.80, 0.70),
+)
+
+
+class Generator:
+    """顺序生成用户及其数据，所有随机数取自同一个种子（与分块大小无关）"""
+
+    def __init__(self, seed: int, users: int, end: datetime, days: int, staff: List[str], harvested_feeds: bool = True):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.start = end - timedelta(days=days)
+        self.end = end
+        self.days = days
+        self.staff = staff
+        self.harvested_feeds = harvested_feeds
+        self.fish_types = [FishType(t) for t in FISH_TYPE_WEIGHTS]
+        self.fish_weights = list(FISH_TYPE_WEIGHTS.values())
+        # 券码由券 id 经可逆置换得到，不重复也不需要记住已用的码
+        self.code_key = self.rng.getrandbits(32)
+        self.next_fish_id = 1
+        self.next_coupon_id = 1
+        self.next_record_id = 1
+        self.stats = {s.name: 0 for s in SEGMENTS}
+        self.stats.update(coupons_used=0, coupons_expired=0)
+
+    def _visit_time(self, day: int) -> datetime:
+        hour = self.rng.choices(range(24), HOUR_WEIGHTS)[0]
+        # 一次到店的喂食和收获不超过半小时，不跨过当天结束
+        seconds = min(hour * 3600 + self.rng.randrange(3600), 86400 - VISIT_SECONDS)
+        return self.start + timedelta(days=day, seconds=seconds)
+
+    def _adopt(self, pond: list, when: datetime):
+        rng = self.rng
+        pond.append(SimpleNamespace(
+            id=self.next_fish_id,
+            fish_type=rng.choices(self.fish_types, self.fish_weights)[0],
+            status=FishStatus.BABY,
+            hunger=100.0,
+            health=100.0,
+            growth=0.0,
+            pos_x=rng.uniform(10, 90),
+            pos_y=rng.uniform(20, 80),
+            created_at=when,
+            updated_at=when,
+        ))
+        self.next_fish_id += 1
+
+    def _coupon(self, user, segment: Segment, fish, when: datetime) -> dict:
+        rng = self.rng
+        coupon_id = self.next_coupon_id
+        self.next_coupon_id += 1
+        code = ((coupon_id * 0x9E3779B1) & 0xFFFFFFFF) ^ self.code_key
+        expires_at = when + timedelta(days=COUPON_DAYS)
+        row = {
+            "id": coupon_id,
+            "user_id": user.id,
+            "code": f"OF{code:08X}",
+            "fish_type": fish.fish_type,
+            "value": catalogue.get_spec(fish.fish_type).value,
+            "used": False,
+            "used_at": None,
+            "used_by": None,
+            "expires_at": expires_at,
+            "created_at": when,
+        }
+        if rng.random() < segment.redeem_rate:
+            used_at = when + timedelta(seconds=rng.expovariate(1 / MEAN_REDEEM_DELAY))
+            if used_at < expires_at and used_at < self.end:
+                row.update(used=True, used_at=used_at, used_by=rng.choice(self.staff))
+                self.stats["coupons_used"] += 1
+        if not row["used"] and expires_at < self.end:
+            self.stats["coupons_expired"] += 1
+        return row
+
+    def user(self, user_id: int, rows: Dict[str, list]):
+        rng = self.rng
+        segment = rng.choices(SEGMENTS, [s.share for s in SEGMENTS])[0]
+        self.stats[segment.name] += 1
+
+        # 用户 id 随注册日递增，注册日越近越密集
+        first_day = max(0, self.days - 1 - int(self.days * (1 - (user_id - 0.5) / self.users) ** 1.5))
+        span = self.days - first_day
+        active = min(rng.randint(*segment.active_days), span)
+        days = [first_day] + sorted(rng.sample(range(first_day + 1, self.days), active - 1))
+
+        created_at = self._visit_time(first_day)
+        user = SimpleNamespace(
+            id=user_id,
+            daily_feed_count=game_rules.DAILY_FEED_LIMIT,
+            total_coupons_earned=0,
+        )
+        ip_address = f"{rng.choice((36, 58, 112, 117, 183, 223))}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        user_agent = rng.choice(USER_AGENTS)
+        pond = []
+        feeds = []
+        self._adopt(pond, created_at)
+
+        when = created_at
+        for day in days:
+            if day != first_day:
+                when = max(when, self._visit_time(day))
+            user.daily_feed_count = game_rules.DAILY_FEED_LIMIT
+            for _ in range(min(rng.randint(*segment.feeds_per_day), game_rules.DAILY_FEED_LIMIT)):
+                when += timedelta(seconds=rng.randint(3, 90))
+                if not pond:
+                    self._adopt(pond, when)
+                fish = rng.choice(pond)
+                game_rules.apply_feed(fish, user)
+                fish.updated_at = when
+                feeds.append((when, fish.id))
+
+            for fish in list(pond):
+                if fish.status == FishStatus.ADULT and rng.random() < segment.harvest_rate:
+                    when += timedelta(seconds=rng.randint(5, 60))
+                    pond.remove(fish)
+                    rows["coupons"].append(self._coupon(user, segment, fish, when))
+                    user.total_coupons_earned += 1
+                    if rng.random() < segment.readopt_rate:
+                        self._adopt(pond, when)
+            if len(pond) < MAX_POND_SIZE and rng.random() < 0.05:
+                self._adopt(pond, when)
+
+        phone = f"139{user_id:08d}" if rng.random() < segment.phone_rate else None
+        rows["users"].append({
+            "id": user_id,
+            "openid": f"oSYN{user_id:024d}" if rng.random() < segment.openid_rate else None,
+            "phone": phone,
+            "username": f"用户{phone[-4:]}" if phone else "访客",
+            "avatar": None,
+            "daily_feed_count": user.daily_feed_count,
+            "last_feed_date": (self.start + timedelta(days=days[-1])).strftime("%Y-%m-%d"),
+            "total_coupons_earned": user.total_coupons_earned,
+            "created_at": created_at,
+            "updated_at": when,
+        })
+        for fish in pond:
+            rows["fishes"].append({
+                "id": fish.id,
+                "user_id": user_id,
+                "fish_type": fish.fish_type,
+                "status": fish.status,
+                "hunger": fish.hunger,
+                "health": fish.health,
+                "growth": fish.growth,
+                "pos_x": fish.pos_x,
+                "pos_y": fish.pos_y,
+                "created_at": fish.created_at,
+                "updated_at": fish.updated_at,
+            })
+        living = {fish.id for fish in pond}
+        for fed_at, fish_id in feeds:
+            if self.harvested_feeds or fish_id in living:
+                rows["feeding_records"].append({
+                    "id": self.next_record_id,
+                    "user_id": user_id,
+                    "fish_id": fish_id,
+                    "ip_address": ip_address,
+                    "user_agent": user_agent,
+                    "created_at": fed_at,
+                })
+            self.next_record_id += 1
+
+
+def _pg_value(value):
+    # COPY 绕过 SQLAlchemy，枚举列按成员名存储
+    return value.name if isinstance(value, enum.Enum) else value
+
+
+async def _load(conn, table, rows: list):
+    if not rows:
+        return
+    if conn.dialect.name == "postgresql":
+        columns = list(rows[0])
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            table.name,
+            columns=columns,
+            records=[tuple(_pg_value(row[c]) for c in columns) for row in rows],
+        )
+    else:
+        await conn.execute(insert(table), rows)
+
+
+async def _prepare(reset: bool):
+    """建表并确认目标表为空"""
+    if reset:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+        await init_db("create")
+    else:
+        await init_db()
+        async with engine.connect() as conn:
+            for model in (User, Fish, Coupon, FeedingRecord):
+                if await conn.scalar(select(func.count()).select_from(model)):
+                    sys.exit(f"{model.__tablename__} 表中已有数据，使用 --reset 清空后重新生成")
+
+
+async def _ensure_staff(stores: int) -> List[str]:
+    """每个门店两名店员（已存在的不重复创建），返回用户名"""
+    usernames = [f"store{s:02d}_staff{k}" for s in range(1, stores + 1) for k in (1, 2)]
+    async with engine.begin() as conn:
+        result = await conn.execute(select(AdminUser.username).where(AdminUser.username.in_(usernames)))
+        existing = set(result.scalars())
+        password_hash = await hash_password("staff123")
+        rows = [
+            {"username": name, "password_hash": password_hash, "role": "staff", "store_id": name.split("_")[0],
+             "is_active": True, "created_at": datetime.utcnow()}
+            for name in usernames if name not in existing
+        ]
+        if rows:
+            await conn.execute(insert(AdminUser), rows)
+    return usernames
+
+
+async def run(users: int, seed: int, end: datetime, days: int, stores: int, reset: bool) -> dict:
+    tables = [User.__table__, Fish.__table__, Coupon.__table__, FeedingRecord.__table__]
+    await _prepare(reset)
+    await catalogue.reload(force=True)
+    postgres = engine.dialect.name == "postgresql"
+    generator = Generator(seed, users, end, days, await _ensure_staff(stores), harvested_feeds=not postgres)
+    totals = {table.name: 0 for table in tables}
+    started = time.perf_counter()
+
+    async with engine.connect() as conn:
+        if not postgres:
+            await conn.exec_driver_sql("PRAGMA synchronous=OFF")
+            await conn.commit()
+
+        # 装载期间不维护二级索引，结束后一次性重建
+        for table in tables:
+            for index in table.indexes:
+                await conn.run_sync(index.drop, checkfirst=True)
+        await conn.commit()
+        try:
+            for first in range(1, users + 1, CHUNK_USERS):
+                rows = {table.name: [] for table in tables}
+                for user_id in range(first, min(first + CHUNK_USERS, users + 1)):
+                    generator.user(user_id, rows)
+                async with conn.begin():
+                    for table in tables:
+                        await _load(conn, table, rows[table.name])
+                for table in tables:
+                    totals[table.name] += len(rows[table.name])
+                print(
+                    f"{min(first + CHUNK_USERS - 1, users)}/{users} 用户  {time.perf_counter() - started:.1f}s",
+                    file=sys.stderr,
+                )
+        finally:
+            if conn.in_transaction():
+                await conn.rollback()
+            for table in tables:
+                for index in table.indexes:
+                    await conn.run_sync(index.create, checkfirst=True)
+            await conn.commit()
+        loaded = time.perf_counter() - started
+
+        if postgres:
+            for table in tables:
+                await conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+                ))
+            await conn.execute(text("ANALYZE"))
+        else:
+            await conn.exec_driver_sql("ANALYZE")
+        await conn.commit()
+
+    buckets = await rebuild_rollups()
+    await engine.dispose()
+    rows_total = sum(totals.values())
+    return {
+        "seed": seed,
+        "end": end.strftime("%Y-%m-%d"),
+        **totals,
+        "segments": {s.name: generator.stats[s.name] for s in SEGMENTS},
+        "coupons_used": generator.stats["coupons_used"],
+        "coupons_expired": generator.stats["coupons_expired"],
+        "rollup_buckets": buckets,
+        "seconds": round(time.perf_counter() - started, 1),
+        "rows_per_second": round(rows_total / loaded) if loaded else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成大规模合成数据并批量写入 DATABASE_URL")
+    parser.add_argument("--users", type=int, default=100000, help="用户数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--end", default=None, help="数据截止日期 YYYY-MM-DD（UTC，默认今天）")
+    parser.add_argument("--days", type=int, default=180, help="数据覆盖的天数")
+    parser.add_argument("--stores", type=int, default=20, help="门店数（每店两名店员核销）")
+    parser.add_argument("--reset", action="store_true", help="先删除并重建全部表")
+    args = parser.parse_args()
+
+    if args.end:
+        end = datetime.strptime(args.end, "%Y-%m-%d")
+    else:
+        end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    result = asyncio.run(run(args.users, args.seed, end, args.days, args.stores, args.reset))
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+测试配置
+
+导入应用前把数据库指向临时 SQLite 文件（未指定时用 tuned 配置：单写连接组提交 + 只读连接池，
+SQLITE_PROFILE=default 可测试驱动默认行为），
+并关闭 Redis，测试之间互不影响的状态由各测试自行准备。
+"""
+
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="ocean_flame_test_")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_tmp}/test.db"
+os.environ.setdefault("SQLITE_PROFILE", "tuned")
+os.environ.pop("REDIS_URL", None)
+os.environ.pop("POND_ENGINE", None)
+
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def client():
+    """启动完整应用（含预热和后台任务），同一测试文件内共用"""
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,65 @@
+"""
+管理员登录：未知用户名、哈希线程池限流、旧哈希升级
+"""
+
+import hashlib
+import threading
+
+from app import database
+from app.database import async_session_maker
+from app.models.models import AdminUser
+from app.services import passwords
+
+
+def test_unknown_username_still_checks_a_hash(client, monkeypatch):
+    checked = []
+    original = passwords._check_sync
+
+    def spy(password, password_hash):
+        checked.append(password_hash)
+        return original(password, password_hash)
+
+    monkeypatch.setattr(passwords, "_check_sync", spy)
+    response = client.post("/api/admin/login", json={"username": "nobody", "password": "guess"})
+    assert response.status_code == 200
+    assert response.json()["success"] is False
+    assert checked == [passwords._dummy_hash]
+
+
+def test_full_hash_pool_returns_503(client, monkeypatch):
+    monkeypatch.setattr(passwords, "_slots", threading.BoundedSemaphore(1))
+    passwords._slots.acquire()
+    response = client.post("/api/admin/login", json={"username": "nobody", "password": "guess"})
+    assert response.status_code == 503
+
+
+def test_legacy_hash_upgrade_does_not_hold_writer_during_bcrypt(client, monkeypatch):
+    monkeypatch.setattr(passwords, "PASSWORD_BCRYPT_ROUNDS", 4)
+    writer_held = []
+    original = passwords._hash_sync
+
+    def spy(password):
+        lock = database.writer._lock if database.writer is not None else None
+        writer_held.append(lock is not None and lock.locked())
+        return original(password)
+
+    monkeypatch.setattr(passwords, "_hash_sync", spy)
+
+    async def create_admin():
+        async with async_session_maker() as db:
+            admin = AdminUser(
+                username="legacy-staff", password_hash=hashlib.sha256(b"secret").hexdigest(), role="staff",
+            )
+            db.add(admin)
+            await db.commit()
+            return admin.id
+
+    async def stored_hash(admin_id):
+        async with async_session_maker() as db:
+            return (await db.get(AdminUser, admin_id)).password_hash
+
+    admin_id = client.portal.call(create_admin)
+    response = client.post("/api/admin/login", json={"username": "legacy-staff", "password": "secret"})
+    assert response.json()["success"] is True
+    assert writer_held == [False]
+    assert client.portal.call(stored_hash, admin_id).startswith("$2")
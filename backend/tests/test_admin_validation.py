@@ -0,0 +1,21 @@
+"""
+管理接口的请求校验
+"""
+
+import pytest
+
+
+@pytest.mark.parametrize("field", ["growth_time", "value"])
+@pytest.mark.parametrize("bad", [0, -1])
+def test_catalogue_update_rejects_non_positive(client, field, bad):
+    response = client.put("/api/admin/catalogue/qingjiang", json={"admin_id": 1, field: bad})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("field", ["coupon_value", "coupon_days"])
+@pytest.mark.parametrize("bad", [0, -1])
+def test_campaign_rejects_non_positive_coupon_terms(client, field, bad):
+    response = client.post("/api/admin/campaigns", json={
+        "admin_id": 1, "name": "回归礼", "grant_type": "coupon", "fish_type": "qingjiang", field: bad,
+    })
+    assert response.status_code == 422
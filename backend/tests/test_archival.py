@@ -0,0 +1,84 @@
+"""
+不活跃游客冷归档
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.database import async_session_maker
+from app.models.models import User, Fish, Coupon, ArchivedUser, FishType
+from app.services import archival
+from app.services.archival import archive_inactive_guests
+
+
+def test_only_guests_with_expired_unused_coupons_are_archived(client):
+    long_ago = datetime.utcnow() - timedelta(days=400)
+
+    async def scenario():
+        async with async_session_maker() as db:
+            expired = User(username="访客", created_at=long_ago, updated_at=long_ago)
+            redeemed = User(username="访客", created_at=long_ago, updated_at=long_ago)
+            db.add_all([expired, redeemed])
+            await db.flush()
+            coupon = dict(fish_type=FishType.QINGJIANG, value=50, expires_at=long_ago + timedelta(days=7), created_at=long_ago)
+            db.add_all([
+                Coupon(user_id=expired.id, code=f"OFARCH{expired.id:04d}", used=False, **coupon),
+                Coupon(
+                    user_id=redeemed.id, code=f"OFARCH{redeemed.id:04d}", used=True,
+                    used_at=long_ago + timedelta(days=1), used_by="staff", **coupon,
+                ),
+            ])
+            await db.commit()
+            ids = expired.id, redeemed.id
+
+        await archive_inactive_guests(inactive_days=180)
+
+        async with async_session_maker() as db:
+            archived = set((await db.execute(select(ArchivedUser.user_id))).scalars())
+            remaining = set((await db.execute(select(Coupon.user_id).where(Coupon.user_id.in_(ids)))).scalars())
+        return ids, archived, remaining
+
+    (expired_id, redeemed_id), archived, remaining = client.portal.call(scenario)
+    assert expired_id in archived
+    assert redeemed_id not in archived
+    # 核销记录仍在 coupons 表
+    assert remaining == {redeemed_id}
+
+
+def test_write_after_selection_keeps_user(client, monkeypatch):
+    long_ago = datetime.utcnow() - timedelta(days=400)
+
+    async def setup():
+        async with async_session_maker() as db:
+            idle = User(username="访客", created_at=long_ago, updated_at=long_ago)
+            returning = User(username="访客", created_at=long_ago, updated_at=long_ago)
+            db.add_all([idle, returning])
+            await db.commit()
+            return idle.id, returning.id
+
+    idle_id, returning_id = client.portal.call(setup)
+    archive_batch = archival._archive_batch
+
+    async def write_then_archive(db, users, cutoff):
+        # 挑选之后、加锁之前提交的写入：回归的游客又养了一条鱼
+        db.add(Fish(user_id=returning_id, fish_type=FishType.QINGJIANG))
+        await db.flush()
+        return await archive_batch(db, users, cutoff)
+
+    monkeypatch.setattr(archival, "_archive_batch", write_then_archive)
+
+    async def scenario():
+        await archive_inactive_guests(inactive_days=180)
+        ids = idle_id, returning_id
+        async with async_session_maker() as db:
+            archived = set((await db.execute(select(ArchivedUser.user_id).where(ArchivedUser.user_id.in_(ids)))).scalars())
+            users = set((await db.execute(select(User.id).where(User.id.in_(ids)))).scalars())
+            fishes = (await db.execute(select(Fish.user_id).where(Fish.user_id.in_(ids)))).scalars().all()
+        return archived, users, fishes
+
+    archived, users, fishes = client.portal.call(scenario)
+    assert archived == {idle_id}
+    # 用户和新鱼都留在热表
+    assert users == {returning_id}
+    assert fishes == [returning_id]
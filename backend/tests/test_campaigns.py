@@ -0,0 +1,70 @@
+"""
+批量发放活动：崩溃后从游标继续
+"""
+
+from datetime import datetime
+import asyncio
+
+import pytest
+from sqlalchemy import select, func
+
+from app.database import init_db, close_db, async_session_maker
+from app.models.models import User, Coupon, Campaign, FishType
+from app.services import campaigns
+
+
+async def _setup():
+    # 只有本测试的用户注册于 2000 年之前
+    long_ago = datetime(1999, 1, 1)
+    async with async_session_maker() as db:
+        users = [User(username="访客", created_at=long_ago) for _ in range(5)]
+        campaign = Campaign(
+            name="老用户回归", grant_type="coupon", fish_type=FishType.QINGJIANG,
+            coupon_value=10, registered_before=datetime(2000, 1, 1), target_count=5,
+        )
+        db.add_all(users + [campaign])
+        await db.commit()
+        return [u.id for u in users], campaign.id
+
+
+async def _state(campaign_id: int):
+    async with async_session_maker() as db:
+        campaign = await db.get(Campaign, campaign_id)
+        result = await db.execute(
+            select(Coupon.user_id, func.count())
+            .where(Coupon.campaign_id == campaign_id)
+            .group_by(Coupon.user_id)
+        )
+        return (campaign.status, campaign.last_user_id, campaign.granted_count), dict(result.all())
+
+
+def test_campaign_resumes_after_crash_without_duplicate_grants(monkeypatch):
+    grant_coupons = campaigns._grant_coupons
+
+    async def crash_after_insert(db, campaign, user_ids, now):
+        await grant_coupons(db, campaign, user_ids, now)
+        raise RuntimeError("进程在提交前崩溃")
+
+    async def scenario():
+        # 不启动应用，没有后台任务同时执行活动
+        await init_db()
+        user_ids, campaign_id = await _setup()
+
+        # 第一批提交，第二批写入后、提交前崩溃
+        assert await campaigns.run_batch(campaign_id, 2)
+        monkeypatch.setattr(campaigns, "_grant_coupons", crash_after_insert)
+        with pytest.raises(RuntimeError):
+            await campaigns.run_batch(campaign_id, 2)
+        crashed = await _state(campaign_id)
+
+        # 重启后从提交的游标继续
+        monkeypatch.setattr(campaigns, "_grant_coupons", grant_coupons)
+        batches = await campaigns.run_campaign(campaign_id, 2)
+        resumed = await _state(campaign_id)
+        await close_db()
+        return user_ids, crashed, batches, resumed
+
+    user_ids, crashed, batches, resumed = asyncio.run(scenario())
+    assert crashed == (("running", user_ids[1], 2), {user_ids[0]: 1, user_ids[1]: 1})
+    assert batches == 2
+    assert resumed == (("done", user_ids[-1], 5), {user_id: 1 for user_id in user_ids})
@@ -0,0 +1,37 @@
+"""
+券码布隆过滤器：增量同步与指标
+"""
+
+from datetime import datetime, timedelta
+
+from app.database import async_session_maker
+from app.models.models import User, Coupon, FishType
+from app.services import coupon_filter, metrics
+
+
+def test_add_updates_code_gauge(client):
+    before = metrics.get("coupon_filter_codes")
+    coupon_filter.add(["OFGAUGE0001", "OFGAUGE0002"])
+    assert metrics.get("coupon_filter_codes") == before + 2
+    assert coupon_filter.might_exist("ofgauge0001")
+
+
+def test_sync_picks_up_codes_from_other_workers(client):
+    code = "OFSYNC000001"
+
+    async def scenario():
+        # 直接落库，模拟其他 worker 发放（本进程没有调用 add）
+        async with async_session_maker() as db:
+            user = User(username="访客")
+            db.add(user)
+            await db.flush()
+            db.add(Coupon(
+                user_id=user.id, code=code, fish_type=FishType.QINGJIANG, value=50,
+                expires_at=datetime.utcnow() + timedelta(days=7),
+            ))
+            await db.commit()
+        return await coupon_filter.sync()
+
+    assert not coupon_filter.might_exist(code)
+    assert client.portal.call(scenario) >= 1
+    assert coupon_filter.might_exist(code)
@@ -0,0 +1,54 @@
+"""
+数据导出：流式输出与并发限制
+"""
+
+import threading
+
+import pytest
+
+from app.database import async_session_maker
+from app.models.models import AdminUser
+from app.routers import export
+
+
+@pytest.fixture(scope="module")
+def admin_id(client):
+    async def create():
+        async with async_session_maker() as db:
+            admin = AdminUser(username="export-admin", password_hash="!", role="admin")
+            db.add(admin)
+            await db.commit()
+            return admin.id
+
+    return client.portal.call(create)
+
+
+def test_export_streams_rows_and_releases_slot(client, admin_id, monkeypatch):
+    monkeypatch.setattr(export, "_slots", threading.BoundedSemaphore(1))
+
+    for fmt in ("csv", "ndjson"):
+        response = client.get("/api/admin/export/coupons", params={"admin_id": admin_id, "format": fmt})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith(export._MEDIA_TYPES[fmt].split(";")[0])
+    assert response.headers["content-disposition"].endswith('.ndjson"')
+    # 两次导出都结束后名额已归还
+    assert export._slots.acquire(blocking=False)
+
+
+def test_export_beyond_limit_is_rejected(client, admin_id, monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(export, "_slots", slots)
+
+    slots.acquire()
+    response = client.get("/api/admin/export/feeding-records", params={"admin_id": admin_id})
+    assert response.status_code == 429
+
+    slots.release()
+    response = client.get("/api/admin/export/feeding-records", params={"admin_id": admin_id})
+    assert response.status_code == 200
+    assert response.text.startswith("\ufeffid,user_id,fish_id")
+
+
+def test_export_requires_admin(client):
+    response = client.get("/api/admin/export/redemptions", params={"admin_id": 0})
+    assert response.status_code == 403
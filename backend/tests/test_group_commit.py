@@ -0,0 +1,102 @@
+"""
+SQLite 组提交写入器
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.database import writer, close_db, run_after_commit
+
+pytestmark = pytest.mark.skipif(writer is None, reason="仅 SQLite tuned 配置使用组提交写入器")
+
+
+def test_cancelled_waiter_does_not_stall_later_writes():
+    async def scenario():
+        held = asyncio.Event()
+        release = asyncio.Event()
+
+        async def holder():
+            async with writer.session() as session:
+                await session.execute(text("SELECT 1"))
+                held.set()
+                await release.wait()
+
+        async def waiter():
+            async with writer.session() as session:
+                await session.execute(text("SELECT 1"))
+
+        first = asyncio.create_task(holder())
+        await held.wait()
+        queued = asyncio.create_task(waiter())
+        while writer._waiting == 0:
+            await asyncio.sleep(0)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert writer._waiting == 0
+
+        release.set()
+        await asyncio.wait_for(first, 2)
+        await asyncio.wait_for(asyncio.gather(waiter(), waiter()), 2)
+        await close_db()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_last_waiter_flushes_pending_group():
+    async def scenario():
+        held = asyncio.Event()
+        release = asyncio.Event()
+
+        async def holder():
+            async with writer.session() as session:
+                await session.execute(text("SELECT 1"))
+                held.set()
+                await release.wait()
+
+        async def waiter():
+            async with writer.session() as session:
+                await session.execute(text("SELECT 1"))
+
+        first = asyncio.create_task(holder())
+        await held.wait()
+        queued = asyncio.create_task(waiter())
+        while writer._waiting == 0:
+            await asyncio.sleep(0)
+        # 持锁者退出时仍有人排队，不会提交；随后排队者被取消
+        release.set()
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        await asyncio.wait_for(first, 2)
+        await close_db()
+
+    asyncio.run(scenario())
+
+
+def test_after_commit_callbacks_wait_for_group_commit(monkeypatch):
+    calls = []
+
+    async def scenario():
+        async def failing_commit(self):
+            raise RuntimeError("disk I/O error")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(AsyncConnection, "commit", failing_commit)
+            with pytest.raises(RuntimeError):
+                async with writer.session() as session:
+                    await session.execute(text("SELECT 1"))
+                    run_after_commit(session, lambda: calls.append("rolled back"))
+                    await session.commit()
+                    assert calls == []
+
+        async with writer.session() as session:
+            await session.execute(text("SELECT 1"))
+            run_after_commit(session, lambda: calls.append("committed"))
+        await close_db()
+
+    asyncio.run(scenario())
+    assert calls == ["committed"]
@@ -0,0 +1,38 @@
+"""
+延迟落库的游客
+"""
+
+from app.services.query_profiler import query_budget
+
+
+def test_guest_reads_come_from_token_without_queries(client):
+    token = client.post("/api/auth/login/guest").json()["access_token"]
+
+    with query_budget(0, route="GET /api/game/me/state"):
+        state = client.get("/api/game/me/state", params={"token": token}).json()
+    assert state["fishes"] == []
+    with query_budget(0, route="GET /api/auth/me"):
+        me = client.get("/api/auth/me", params={"token": token}).json()
+    assert me["id"] is None
+
+
+def test_materialized_guest_reads_with_reissued_token(client):
+    token = client.post("/api/auth/login/guest").json()["access_token"]
+
+    response = client.post("/api/game/me/fish/add", params={"token": token}, json={"fish_type": "qingjiang"})
+    assert response.status_code == 200
+    fish_id = response.json()["id"]
+    new_token = response.headers["X-Access-Token"]
+
+    state = client.get("/api/game/me/state", params={"token": new_token}).json()
+    assert [f["id"] for f in state["fishes"]] == [fish_id]
+    me = client.get("/api/auth/me", params={"token": new_token}).json()
+    assert me["id"] is not None
+
+    # 持旧令牌再次写入：找回已落库的用户，不重复建号，并再次下发新令牌
+    response = client.post("/api/game/me/fish/add", params={"token": token}, json={"fish_type": "qingjiang"})
+    assert response.status_code == 200
+    reissued = response.headers["X-Access-Token"]
+    assert client.get("/api/auth/me", params={"token": reissued}).json()["id"] == me["id"]
+    state = client.get("/api/game/me/state", params={"token": new_token}).json()
+    assert sorted(f["id"] for f in state["fishes"]) == sorted([fish_id, response.json()["id"]])
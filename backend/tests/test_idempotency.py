@@ -0,0 +1,49 @@
+"""
+Idempotency-Key 中间件：回放与按调用方隔离
+"""
+
+import json
+
+from fastapi.testclient import TestClient
+
+from app.services.idempotency import IdempotencyMiddleware
+
+
+def _counting_app():
+    calls = []
+
+    async def app(scope, receive, send):
+        await receive()
+        calls.append(scope["path"])
+        body = json.dumps({"calls": len(calls)}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    return IdempotencyMiddleware(app, paths=[r"/op/\d+"]), calls
+
+
+def test_retry_is_replayed():
+    app, calls = _counting_app()
+    client = TestClient(app)
+    first = client.post("/op/1", headers={"Idempotency-Key": "k1", "Authorization": "Bearer a"})
+    retry = client.post("/op/1", headers={"Idempotency-Key": "k1", "Authorization": "Bearer a"})
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert len(calls) == 1
+
+
+def test_same_key_from_other_caller_or_path_is_not_shared():
+    app, calls = _counting_app()
+    client = TestClient(app)
+    client.post("/op/1", headers={"Idempotency-Key": "k2", "Authorization": "Bearer a"})
+    other_caller = client.post("/op/1", headers={"Idempotency-Key": "k2", "Authorization": "Bearer b"})
+    other_token = client.post("/op/1?token=c", headers={"Idempotency-Key": "k2"})
+    other_path = client.post("/op/2", headers={"Idempotency-Key": "k2", "Authorization": "Bearer a"})
+    for response in (other_caller, other_token, other_path):
+        assert response.status_code == 200
+        assert "idempotent-replayed" not in response.headers
+    assert len(calls) == 4
@@ -0,0 +1,37 @@
+"""
+排行榜：周榜重建只计收获所得的优惠券
+"""
+
+from app.database import async_session_maker
+from app.models.models import User, Fish, Campaign, FishType, FishStatus
+from app.services import campaigns, leaderboard
+
+
+def test_weekly_rebuild_ignores_campaign_coupons(client):
+    async def setup():
+        async with async_session_maker() as db:
+            harvester, recipient = User(username="访客"), User(username="访客")
+            db.add_all([harvester, recipient])
+            await db.flush()
+            fish = Fish(user_id=harvester.id, fish_type=FishType.QINGJIANG, status=FishStatus.ADULT)
+            campaign = Campaign(name="周末送券", grant_type="coupon", fish_type=FishType.JINMU, coupon_days=7)
+            db.add_all([fish, campaign])
+            await db.commit()
+            return harvester.id, recipient.id, fish.id, campaign.id
+
+    harvester_id, recipient_id, fish_id, campaign_id = client.portal.call(setup)
+    assert client.post(f"/api/game/fish/harvest/{fish_id}").json()["success"]
+
+    async def grant_and_rebuild():
+        await campaigns.run_campaign(campaign_id)
+        await leaderboard.rebuild()
+        return (
+            await leaderboard.get_rank("week", harvester_id),
+            await leaderboard.get_rank("week", recipient_id),
+            await leaderboard.get_rank("all", recipient_id),
+        )
+
+    harvester_week, recipient_week, recipient_all = client.portal.call(grant_and_rebuild)
+    assert harvester_week[1] == 1
+    assert recipient_week == (None, 0)
+    assert recipient_all == (None, 0)
@@ -0,0 +1,122 @@
+"""
+事件发件箱：检查点推进、外部投递与唤醒时机
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import select, func
+
+from app import database
+from app.database import init_db, close_db, write_session, async_session_maker, read_session_maker
+from app.models.models import OutboxEvent, OutboxCheckpoint
+from app.services import outbox
+from app.services.outbox import Consumer, deliver, record_event
+
+
+async def _checkpoint(name: str):
+    async with async_session_maker() as db:
+        db.add(OutboxCheckpoint(consumer=name, last_event_id=0))
+        await db.commit()
+
+
+async def _record(n: int, event_type: str = "test.event"):
+    async with write_session() as db:
+        for i in range(n):
+            record_event(db, event_type, None, n=i)
+        await db.commit()
+
+
+def test_in_process_consumer_advances_checkpoint():
+    async def scenario():
+        await init_db()
+        seen = []
+
+        async def handler(db, events):
+            seen.extend(e.payload["n"] for e in events)
+
+        consumer = Consumer("test_in_process", handler, {"test.event"})
+        await _checkpoint(consumer.name)
+
+        await _record(3)
+        first = await deliver(consumer)
+        again = await deliver(consumer)
+        await _record(2, "other.event")
+        await _record(1)
+        skipped_other = await deliver(consumer)
+        async with read_session_maker() as db:
+            checkpoint = await db.get(OutboxCheckpoint, consumer.name)
+            last_id = await db.scalar(select(func.max(OutboxEvent.id)))
+        await close_db()
+        return seen, first, again, skipped_other, checkpoint.last_event_id, last_id
+
+    seen, first, again, skipped_other, checkpoint_id, last_id = asyncio.run(scenario())
+    # 第一次从头扫描（可能包含其他测试留下的事件），之后只读新事件
+    assert first >= 3
+    assert again == 0
+    # 不订阅的事件类型也推进检查点，但不交给处理函数
+    assert skipped_other == 3
+    assert seen == [0, 1, 2, 0]
+    assert checkpoint_id == last_id
+
+
+def test_external_consumer_publishes_outside_write_transaction():
+    async def scenario():
+        await init_db()
+        published = []
+
+        async def publish(events):
+            # 不在写会话里：SQLite tuned 模式下不占写锁，事件都已提交
+            lock = database.writer._lock if database.writer is not None else None
+            published.append((len(events), lock is not None and lock.locked()))
+            async with read_session_maker() as db:
+                ids = [e.id for e in events]
+                visible = await db.scalar(select(func.count()).where(OutboxEvent.id.in_(ids)))
+            assert visible == len(ids)
+
+        consumer = Consumer("test_external", publish, external=True)
+        await _checkpoint(consumer.name)
+        await _record(2)
+        delivered = await deliver(consumer)
+        again = await deliver(consumer)
+        await close_db()
+        return published, delivered, again
+
+    published, delivered, again = asyncio.run(scenario())
+    assert delivered >= 2
+    assert again == 0
+    assert published and all(not held for _, held in published)
+
+
+@pytest.mark.skipif(database.writer is None, reason="仅 SQLite tuned 配置使用组提交写入器")
+def test_relay_is_woken_only_after_group_commit():
+    async def scenario():
+        await init_db()
+        outbox._wakeup = asyncio.Event()
+        recorded = asyncio.Event()
+        observed = []
+
+        async def first():
+            async with write_session() as db:
+                record_event(db, "test.event", None)
+                await db.commit()
+                recorded.set()
+                # 等第二个请求排上队，本次释放 SAVEPOINT 后不会立即 COMMIT
+                while database.writer._waiting == 0:
+                    await asyncio.sleep(0)
+
+        async def second():
+            await recorded.wait()
+            async with write_session() as db:
+                observed.append(outbox._wakeup.is_set())
+                await db.commit()
+
+        await asyncio.gather(first(), second())
+        woken = outbox._wakeup.is_set()
+        outbox._wakeup = None
+        await close_db()
+        return observed, woken
+
+    observed, woken = asyncio.run(scenario())
+    assert observed == [False]
+    assert woken
@@ -0,0 +1,89 @@
+"""
+内存鱼塘引擎：写回与收获的先后顺序
+"""
+
+import asyncio
+
+from sqlalchemy import select, func
+
+from app.database import init_db, close_db, write_session, read_session_maker
+from app.models.models import User, Fish, Coupon, FeedingRecord, FishType, FishStatus
+from app.routers.game import _harvest
+from app.services.pond_engine import PondEngine, FeedOutcome
+
+
+async def _create_pond(status: FishStatus = FishStatus.BABY):
+    async with write_session() as db:
+        user = User(username="访客")
+        db.add(user)
+        await db.flush()
+        fish = Fish(user_id=user.id, fish_type=FishType.QINGJIANG, status=status)
+        db.add(fish)
+        await db.flush()
+        await db.commit()
+        return user.id, fish.id
+
+
+async def _feed(engine: PondEngine, fish_id: int):
+    async with write_session() as db:
+        outcome, _, remaining = await engine.feed(fish_id, db, None, None)
+        await db.commit()
+    assert outcome == FeedOutcome.OK
+    return remaining
+
+
+def test_flush_writes_feeds_back():
+    async def scenario():
+        await init_db()
+        engine = PondEngine(shards=4)
+        user_id, fish_id = await _create_pond()
+        remaining = await _feed(engine, fish_id)
+
+        assert await engine.flush() == 1
+        assert not engine.resident(user_id).dirty
+        async with read_session_maker() as db:
+            user = await db.get(User, user_id)
+            records = await db.scalar(
+                select(func.count()).select_from(FeedingRecord).where(FeedingRecord.fish_id == fish_id)
+            )
+        await close_db()
+        return user.daily_feed_count, remaining, records
+
+    daily_feed_count, remaining, records = asyncio.run(scenario())
+    assert daily_feed_count == remaining
+    assert records == 1
+
+
+def test_harvest_while_flush_is_due_does_not_deadlock():
+    async def scenario():
+        await init_db()
+        engine = PondEngine(shards=4)
+        user_id, fish_id = await _create_pond(FishStatus.ADULT)
+        remaining = await _feed(engine, fish_id)
+
+        # 收获占着写会话时写回到期
+        async with write_session() as db:
+            flusher = asyncio.create_task(engine.flush())
+            await asyncio.sleep(0.05)
+            async with engine.synchronous(user_id, db):
+                result = await _harvest(fish_id, db)
+        await asyncio.wait_for(flusher, 5)
+
+        async with read_session_maker() as db:
+            user = await db.get(User, user_id)
+            coupons = await db.scalar(select(func.count()).select_from(Coupon).where(Coupon.user_id == user_id))
+            records = await db.scalar(
+                select(func.count()).select_from(FeedingRecord).where(FeedingRecord.fish_id == fish_id)
+            )
+        resident = engine.resident(user_id)
+        await close_db()
+        return result, user, remaining, coupons, records, resident
+
+    result, user, remaining, coupons, records, resident = asyncio.run(asyncio.wait_for(scenario(), 10))
+    assert result.success
+    # 收获前的喂食与优惠券在同一事务落库，写回不会覆盖
+    assert user.daily_feed_count == remaining
+    assert user.total_coupons_earned == 1
+    assert coupons == 1
+    assert records == 1
+    assert resident is None
@@ -0,0 +1,36 @@
+"""
+query_budget 测试断言
+"""
+
+import pytest
+from sqlalchemy import text
+
+from app.database import read_session_maker
+from app.services.query_profiler import query_budget
+
+
+async def _background_query():
+    async with read_session_maker() as db:
+        await db.execute(text("SELECT 1"))
+
+
+def test_counts_only_queries_inside_requests(client):
+    with query_budget(10) as budget:
+        # 事件循环上的非请求查询（如后台任务）不计入
+        client.portal.call(_background_query)
+        assert budget.count == 0
+        client.post("/api/auth/register", json={})
+    assert budget.count == 1
+
+
+def test_route_filter(client):
+    with query_budget(10, route="POST /api/auth/register") as budget:
+        client.get("/api/game/state/1")
+        client.post("/api/auth/register", json={})
+    assert budget.count == 1
+
+
+def test_exceeding_limit_fails_with_statements(client):
+    with pytest.raises(AssertionError, match="查询预算超限: 1 > 0"):
+        with query_budget(0):
+            client.post("/api/auth/register", json={})
@@ -0,0 +1,72 @@
+"""
+各写接口的查询数（每个请求只提交一次，写入后不再 refresh）
+"""
+
+import pytest
+
+from app.database import async_session_maker
+from app.models.models import AdminUser
+from app.services.query_profiler import query_budget
+
+REGISTER = "POST /api/auth/register"
+ADD_FISH = "POST /api/game/fish/add/{user_id}"
+FEED = "POST /api/game/fish/feed/{fish_id}"
+HARVEST = "POST /api/game/fish/harvest/{fish_id}"
+VERIFY = "POST /api/admin/coupon/verify"
+
+
+@pytest.fixture(scope="module")
+def admin_id(client):
+    async def create():
+        async with async_session_maker() as db:
+            admin = AdminUser(username="query-count-staff", password_hash="!", role="staff", store_id="S1")
+            db.add(admin)
+            await db.commit()
+            return admin.id
+
+    return client.portal.call(create)
+
+
+def _register(client) -> int:
+    with query_budget(1, route=REGISTER):
+        response = client.post("/api/auth/register", json={})
+    assert response.status_code == 200
+    return response.json()["user"]["id"]
+
+
+def _add_fish(client, user_id: int) -> int:
+    with query_budget(3, route=ADD_FISH):
+        response = client.post(f"/api/game/fish/add/{user_id}", json={"fish_type": "qingjiang"})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_register(client):
+    _register(client)
+
+
+def test_add_fish(client):
+    _add_fish(client, _register(client))
+
+
+def test_feed(client):
+    fish_id = _add_fish(client, _register(client))
+    with query_budget(6, route=FEED):
+        response = client.post(f"/api/game/fish/feed/{fish_id}")
+    assert response.json()["success"]
+
+
+def test_harvest_and_verify(client, admin_id):
+    fish_id = _add_fish(client, _register(client))
+    # 清江鱼喂 3 次成年
+    for _ in range(3):
+        client.post(f"/api/game/fish/feed/{fish_id}")
+
+    with query_budget(6, route=HARVEST):
+        response = client.post(f"/api/game/fish/harvest/{fish_id}")
+    coupon = response.json()["coupon"]
+    assert coupon is not None
+
+    with query_budget(4, route=VERIFY):
+        response = client.post("/api/admin/coupon/verify", json={"code": coupon["code"], "admin_id": admin_id})
+    assert response.json()["success"]
@@ -0,0 +1,64 @@
+"""
+启动时的 schema 版本检查与补列迁移
+"""
+
+from types import SimpleNamespace
+import asyncio
+
+import pytest
+from sqlalchemy import text, Column, Integer, MetaData, Table
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import database
+import app.models.models  # noqa: F401  注册模型
+
+
+def test_existing_tables_get_new_columns_and_indexes(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/drift.db")
+    monkeypatch.setattr(database, "engine", engine)
+
+    async def scenario():
+        try:
+            assert await database.init_db("check")
+            assert not await database.init_db("check")
+            async with engine.connect() as conn:
+                assert await conn.run_sync(database._migrate) == []
+            # 模拟升级前的旧库：没有 txid/last_txid 列和对应索引，已有数据
+            async with engine.begin() as conn:
+                await conn.execute(text("DROP INDEX ix_coupons_txid_id"))
+                await conn.execute(text("ALTER TABLE coupons DROP COLUMN txid"))
+                await conn.execute(text("ALTER TABLE outbox_checkpoints DROP COLUMN last_txid"))
+                await conn.execute(text(
+                    "INSERT INTO outbox_checkpoints (consumer, last_event_id) VALUES ('rollups', 7)"
+                ))
+                await conn.execute(text("UPDATE schema_meta SET version = 'old'"))
+
+            assert await database.init_db("check")
+            async with engine.connect() as conn:
+                assert await conn.run_sync(database._missing_columns) == []
+                assert await conn.run_sync(database._migrate) == []
+                checkpoint = (await conn.execute(text(
+                    "SELECT last_event_id, last_txid FROM outbox_checkpoints WHERE consumer = 'rollups'"
+                ))).one()
+                version = await database._stored_version(conn)
+            assert tuple(checkpoint) == (7, 0)
+            assert version == database.schema_version()
+            assert not await database.init_db("check")
+        finally:
+            await engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_not_null_column_needs_scalar_default():
+    conn = SimpleNamespace(dialect=sqlite.dialect())
+    table = Table(
+        "t", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("counter", Integer, default=0, nullable=False),
+        Column("rank", Integer, nullable=False),
+    )
+    assert database._column_ddl(conn, table, table.c.counter) == "counter INTEGER DEFAULT 0 NOT NULL"
+    with pytest.raises(RuntimeError, match="t.rank"):
+        database._column_ddl(conn, table, table.c.rank)
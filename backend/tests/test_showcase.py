@@ -0,0 +1,25 @@
+"""
+精选鱼塘快照的 ETag/304
+"""
+
+
+def test_etag_differs_per_encoding_and_revalidates(client):
+    identity = client.get("/api/game/showcase", headers={"Accept-Encoding": "identity"})
+    gzipped = client.get("/api/game/showcase", headers={"Accept-Encoding": "gzip"})
+    assert identity.status_code == gzipped.status_code == 200
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert identity.headers["etag"] != gzipped.headers["etag"]
+
+    for response, encoding in ((identity, "identity"), (gzipped, "gzip")):
+        etag = response.headers["etag"]
+        for tag in (etag, "W/" + etag):
+            revalidated = client.get(
+                "/api/game/showcase", headers={"Accept-Encoding": encoding, "If-None-Match": tag}
+            )
+            assert revalidated.status_code == 304
+
+    # 另一种表示的 ETag 不能命中
+    mismatched = client.get(
+        "/api/game/showcase", headers={"Accept-Encoding": "identity", "If-None-Match": gzipped.headers["etag"]}
+    )
+    assert mismatched.status_code == 200
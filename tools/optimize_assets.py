@@ -0,0 +1,247 @@
+"""
+🐟 鱼塘动画资源优化工具
+
+把 frontend/src/assets 下的 GIF 动画转码为多尺寸的动画 WebP（可选精灵图），
+并生成带内容哈希的文件名和 manifest.json，供前端按尺寸选用、nginx 长期缓存。
+
+- 文件级去重：解码后帧内容完全相同的 GIF 只输出一份，其余指向同一结果
+- 帧级去重：连续相同的帧合并为一帧并累加停留时间
+- 近似重复：缩略图逐帧差异低于阈值的 GIF 在报告中标出，供人工确认后删除
+- 输出每个资源的字节节省情况
+
+用法：
+    python tools/optimize_assets.py
+    python tools/optimize_assets.py --widths 160,320 --quality 80 --method 4 --sprites
+"""
+
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import hashlib
+import json
+import math
+
+from PIL import Image, ImageChops, ImageSequence
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SOURCE = ROOT / "frontend" / "src" / "assets"
+DEFAULT_OUTPUT = ROOT / "frontend" / "public" / "optimized"
+# 输出目录在站点中的 URL 前缀（frontend/public 会被原样复制到站点根目录）
+DEFAULT_URL_PREFIX = "/optimized/"
+
+# 近似重复判定阈值：32x32 灰度缩略图平均像素差（0~255）
+NEAR_DUPLICATE_THRESHOLD = 2.0
+
+
+@dataclass
+class Animation:
+    path: Path
+    frames: List[Image.Image]
+    durations: List[int]
+    source_frames: int
+    digest: str
+    thumbs: List[Image.Image] = field(default_factory=list)
+
+
+def load_animation(path: Path) -> Animation:
+    """解码 GIF 并合并连续重复帧"""
+    frames: List[Image.Image] = []
+    durations: List[int] = []
+    source_frames = 0
+    with Image.open(path) as im:
+        default_duration = im.info.get("duration", 100)
+        for frame in ImageSequence.Iterator(im):
+            source_frames += 1
+            rgba = frame.convert("RGBA")
+            duration = frame.info.get("duration", default_duration) or default_duration
+            if frames and ImageChops.difference(frames[-1], rgba).getbbox() is None:
+                durations[-1] += duration
+                continue
+            frames.append(rgba)
+            durations.append(duration)
+
+    digest = hashlib.sha256()
+    for frame, duration in zip(frames, durations):
+        digest.update(frame.tobytes())
+        digest.update(str(duration).encode())
+
+    thumbs = [f.convert("L").resize((32, 32)) for f in frames]
+    return Animation(path, frames, durations, source_frames, digest.hexdigest(), thumbs)
+
+
+def mean_difference(a: Animation, b: Animation) -> Optional[float]:
+    """两段动画的平均像素差；帧数不同视为不相似"""
+    if len(a.thumbs) != len(b.thumbs):
+        return None
+    total = 0.0
+    for x, y in zip(a.thumbs, b.thumbs):
+        histogram = ImageChops.difference(x, y).histogram()
+        total += sum(i * n for i, n in enumerate(histogram)) / (32 * 32)
+    return total / len(a.thumbs)
+
+
+def _resize(frames: List[Image.Image], width: int) -> List[Image.Image]:
+    if width == frames[0].width:
+        return frames
+    height = round(frames[0].height * width / frames[0].width)
+    return [f.resize((width, height), Image.LANCZOS) for f in frames]
+
+
+def encode_webp(frames: List[Image.Image], durations: List[int], quality: int, method: int) -> bytes:
+    buffer = BytesIO()
+    frames[0].save(
+        buffer,
+        format="WEBP",
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=0,
+        quality=quality,
+        method=method,
+    )
+    return buffer.getvalue()
+
+
+def encode_sprite(frames: List[Image.Image], quality: int, method: int):
+    """网格精灵图（WebP 单边不能超过 16383 像素），返回 (数据, 列数)"""
+    width, height = frames[0].size
+    columns = min(math.ceil(math.sqrt(len(frames))), 16383 // width)
+    rows = math.ceil(len(frames) / columns)
+    sheet = Image.new("RGBA", (width * columns, height * rows))
+    for i, frame in enumerate(frames):
+        sheet.paste(frame, ((i % columns) * width, (i // columns) * height))
+    buffer = BytesIO()
+    sheet.save(buffer, format="WEBP", quality=quality, method=method)
+    return buffer.getvalue(), columns
+
+
+def write_hashed(output: Path, stem: str, suffix: str, data: bytes) -> str:
+    """按内容哈希命名写出，返回文件名"""
+    name = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{suffix}"
+    (output / name).write_bytes(data)
+    return name
+
+
+def _slug(path: Path, source: Path) -> str:
+    relative = path.relative_to(source).with_suffix("")
+    return "-".join(relative.parts).replace(" ", "_").replace("(", "").replace(")", "")
+
+
+def optimize(
+    source: Path,
+    output: Path,
+    url_prefix: str,
+    widths: List[int],
+    quality: int,
+    method: int,
+    sprites: bool,
+) -> Dict:
+    output.mkdir(parents=True, exist_ok=True)
+    # 输出目录由本工具独占，清掉上次生成的文件
+    for stale in output.glob("*.webp"):
+        stale.unlink()
+    manifest = {"version": 1, "assets": {}}
+    report = []
+    canonical: Dict[str, str] = {}
+    loaded: List[Animation] = []
+
+    for path in sorted(source.rglob("*.gif")):
+        key = path.relative_to(source.parent).as_posix()
+        original_bytes = path.stat().st_size
+        animation = load_animation(path)
+
+        if animation.digest in canonical:
+            target = canonical[animation.digest]
+            manifest["assets"][key] = {**manifest["assets"][target], "duplicate_of": target}
+            report.append((key, original_bytes, 0, f"重复，复用 {target}"))
+            continue
+
+        near = None
+        for other in loaded:
+            diff = mean_difference(animation, other)
+            if diff is not None and diff < NEAR_DUPLICATE_THRESHOLD:
+                near = (other.path.relative_to(source.parent).as_posix(), diff)
+                break
+
+        stem = _slug(path, source)
+        variants = []
+        for width in sorted(set(w for w in widths if w < animation.frames[0].width) | {animation.frames[0].width}):
+            frames = _resize(animation.frames, width)
+            data = encode_webp(frames, animation.durations, quality, method)
+            name = write_hashed(output, f"{stem}.{width}w", ".webp", data)
+            variants.append({
+                "width": width,
+                "height": frames[0].height,
+                "format": "webp",
+                "url": url_prefix + name,
+                "bytes": len(data),
+            })
+
+        entry = {
+            "source_bytes": original_bytes,
+            "frames": len(animation.frames),
+            "source_frames": animation.source_frames,
+            "durations": animation.durations,
+            "variants": variants,
+            "duplicate_of": None,
+        }
+        if sprites:
+            data, columns = encode_sprite(animation.frames, quality, method)
+            name = write_hashed(output, f"{stem}.sprite", ".webp", data)
+            entry["sprite"] = {
+                "url": url_prefix + name,
+                "frame_width": animation.frames[0].width,
+                "frame_height": animation.frames[0].height,
+                "columns": columns,
+                "bytes": len(data),
+            }
+
+        manifest["assets"][key] = entry
+        canonical[animation.digest] = key
+        loaded.append(animation)
+
+        largest = variants[-1]["bytes"]
+        note = f"帧 {animation.source_frames}→{len(animation.frames)}"
+        if near:
+            note += f"，与 {near[0]} 近似（差异 {near[1]:.2f}）"
+        report.append((key, original_bytes, largest, note))
+
+    (output / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=2))
+    return {"manifest": manifest, "report": report}
+
+
+def print_report(report):
+    total_before = total_after = 0
+    print(f"{'资源':<42}{'原始':>12}{'优化后':>12}{'节省':>8}  备注")
+    for key, before, after, note in report:
+        total_before += before
+        total_after += after
+        saved = 100 * (before - after) / before if before else 0
+        print(f"{key:<42}{before:>12,}{after:>12,}{saved:>7.1f}%  {note}")
+    saved = 100 * (total_before - total_after) / total_before if total_before else 0
+    print(f"{'合计（原尺寸）':<40}{total_before:>12,}{total_after:>12,}{saved:>7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GIF 动画转码为多尺寸 WebP 并生成内容哈希清单")
+    parser.add_argument("--source", type=Path, default=DEFAULT_SOURCE, help="资源目录")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="输出目录")
+    parser.add_argument("--url-prefix", default=DEFAULT_URL_PREFIX, help="输出文件的 URL 前缀")
+    parser.add_argument("--widths", default="160,320", help="输出宽度，逗号分隔（不会放大原图）")
+    parser.add_argument("--quality", type=int, default=80, help="WebP 质量 (0-100)")
+    parser.add_argument("--method", type=int, default=4, help="WebP 压缩力度 (0-6)，越大越慢")
+    parser.add_argument("--sprites", action="store_true", help="同时输出网格精灵图")
+    args = parser.parse_args()
+
+    widths = [int(w) for w in args.widths.split(",") if w.strip()]
+    result = optimize(
+        args.source, args.output, args.url_prefix, widths, args.quality, args.method, args.sprites
+    )
+    print_report(result["report"])
+    print(f"\n清单已写入 {args.output / 'manifest.json'}")
+
+
+if __name__ == "__main__":
+    main()